@@ -0,0 +1,91 @@
+"""Count JWT decodes, MongoDB commands and Redis calls per authenticated request.
+
+Needs the same .env, MongoDB and Redis as the server, and a valid access token.
+
+    python -m benchmarks.auth_context --token <access token> [--requests 200]
+
+Run it on the commit before the shared AuthContext to get the "before" numbers.
+"""
+
+import argparse
+import time
+from collections import Counter
+
+from pymongo import monitoring
+
+
+class CommandCounter(monitoring.CommandListener):
+
+    def __init__(self) -> None:
+        self.commands = Counter()
+
+    def started(self, event):
+        self.commands[f"{event.command_name} {event.command.get(event.command_name)}"] += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+# The listener must be registered before src.config creates the Motor client
+command_counter = CommandCounter()
+monitoring.register(command_counter)
+
+import jwt  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+from src.user import redis as user_redis  # noqa: E402
+from src.main import app  # noqa: E402
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--token", required=True)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--path", default="/api/v1/dynamic_books/published")
+    args = parser.parse_args()
+
+    counts = Counter()
+
+    jwt_decode = jwt.decode
+
+    def counting_decode(*args, **kwargs):
+        counts["jwt decode"] += 1
+        return jwt_decode(*args, **kwargs)
+
+    blocklist_get = user_redis.token_blocklist.get
+
+    async def counting_get(name):
+        counts["redis GET"] += 1
+        return await blocklist_get(name)
+
+    jwt.decode = counting_decode
+    user_redis.token_blocklist.get = counting_get
+
+    headers = {"Authorization": f"Bearer {args.token}"}
+
+    with TestClient(app) as client:
+
+        # Warm up the connection pools before counting
+        client.get(args.path, headers=headers)
+        counts.clear()
+        command_counter.commands.clear()
+
+        started = time.perf_counter()
+
+        for _ in range(args.requests):
+            client.get(args.path, headers=headers)
+
+        elapsed = time.perf_counter() - started
+
+    print(f"{args.requests} x GET {args.path} in {elapsed:.2f}s")
+
+    for name, count in sorted({**counts, **command_counter.commands}.items()):
+        print(f"  {name:<40} {count / args.requests:.2f} per request")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""Memory and latency of the autocomplete PrefixIndex (standalone).
+
+Builds the index from synthetic published books and reports the memory held by
+the index, the build time and the completion latency for short prefixes.
+
+    python -m benchmarks.autocomplete [--books 1000000]
+"""
+
+import argparse
+import gc
+import random
+import statistics
+import string
+import time
+import tracemalloc
+
+from src.dynamic_books.autocomplete import PrefixIndex
+
+WORDS = [
+    "".join(random.choices(string.ascii_lowercase, k=random.randint(3, 9)))
+    for _ in range(20000)
+]
+
+
+def synthetic_books(count: int, authors: int):
+
+    author_names = [
+        f"{random.choice(WORDS).title()} {random.choice(WORDS).title()}"
+        for _ in range(authors)
+    ]
+
+    for id in range(count):
+
+        title = " ".join(random.choices(WORDS, k=random.randint(2, 5))).capitalize()
+
+        yield f"{id:024x}", title, random.choice(author_names)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--books", type=int, default=1000000)
+    parser.add_argument("--authors", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=10000)
+    args = parser.parse_args()
+
+    random.seed(42)
+    books = list(synthetic_books(args.books, args.authors))
+
+    gc.collect()
+    tracemalloc.start()
+
+    index = PrefixIndex()
+
+    started = time.perf_counter()
+    index.rebuild(books)
+    build = time.perf_counter() - started
+
+    gc.collect()
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    print(f"{args.books} books, {len(index)} distinct terms, built in {build:.2f}s")
+    print(
+        f"index memory {memory / 2**20:.0f} MiB"
+        f" ({memory / args.books:.0f} bytes per book)"
+    )
+
+    for length in (1, 2, 3, 5):
+
+        prefixes = [random.choice(WORDS)[:length] for _ in range(args.queries)]
+        latencies = []
+
+        for prefix in prefixes:
+            started = time.perf_counter()
+            index.complete(prefix, 10)
+            latencies.append((time.perf_counter() - started) * 1e6)
+
+        quantiles = statistics.quantiles(latencies, n=100)
+
+        print(
+            f"prefix of {length} : p50 {quantiles[49]:8.1f} us   p99 {quantiles[98]:8.1f} us"
+        )
+
+    started = time.perf_counter()
+
+    for id, title, author in books[: args.queries]:
+        index.add(id, title.upper(), author)
+
+    print(f"incremental update : {(time.perf_counter() - started) / args.queries * 1e6:.1f} us per book")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Requests per second of GET /api/v1/books, encoded per call or pre-encoded (standalone).
+
+Loads synthetic books in the store and calls book_router in process (httpx
+ASGI transport, no network). "validated" asks for the same list with a
+`limit`, which goes through response_model validation and encoding like every
+call did before; the other runs get the pre-encoded body, plain, gzipped and
+as a 304.
+
+    python -m benchmarks.book_list [--books 10000] [--requests 200]
+"""
+
+import argparse
+import asyncio
+import random
+import time
+
+import httpx
+from fastapi import FastAPI
+
+from benchmarks.book_store import synthetic_books
+from src.books.routes import book_list, book_router, book_store
+
+
+async def fetch(client: httpx.AsyncClient, url: str, headers: dict):
+
+    # Body as sent, httpx would otherwise spend the time decompressing it
+    async with client.stream("GET", url, headers=headers) as response:
+        size = sum([len(chunk) async for chunk in response.aiter_raw()])
+
+    return response, size
+
+
+async def run(client: httpx.AsyncClient, name: str, requests: int, url: str, headers: dict) -> None:
+
+    response, size = await fetch(client, url, headers)
+
+    started = time.perf_counter()
+
+    for _ in range(requests):
+        response, _ = await fetch(client, url, headers)
+
+    elapsed = time.perf_counter() - started
+
+    print(
+        f"{name:<16} {requests / elapsed:9.0f} requests/s,"
+        f" {elapsed / requests * 1000:8.2f} ms per request,"
+        f" status {response.status_code}, {size / 1024:8.0f} KiB"
+    )
+
+
+async def main_async(args) -> None:
+
+    random.seed(42)
+
+    book_store.clear()
+    book_store.load(synthetic_books(args.books, 1000, 100))
+
+    app = FastAPI()
+    app.include_router(book_router, prefix="/books")
+
+    transport = httpx.ASGITransport(app=app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+
+        plain = {"Accept-Encoding": "identity"}
+
+        await run(client, "validated", args.requests, f"/books/?limit={args.books}", plain)
+        await run(client, "pre-encoded", args.requests, "/books/", plain)
+        await run(client, "pre-encoded gzip", args.requests, "/books/", {"Accept-Encoding": "gzip"})
+
+        etag = (await client.get("/books/")).headers["ETag"]
+        await run(client, "not modified", args.requests, "/books/", {"If-None-Match": etag})
+
+        # First request after a write pays the encoding once
+        book_store.update(1, {"page_count": 100})
+
+        started = time.perf_counter()
+        await client.get("/books/", headers=plain)
+        print(f"\nfirst request after a write : {(time.perf_counter() - started) * 1000:.1f} ms")
+
+    print(f"encoded list : {book_list.stats()}")
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--books", type=int, default=10000)
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
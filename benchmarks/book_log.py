@@ -0,0 +1,113 @@
+"""Write throughput and recovery time of the books store log (standalone).
+
+Throughput: concurrent writers update the store and wait for their log entry
+to be on disk, with and without a group commit wait. Recovery: a snapshot of
+--books books plus a log tail of --tail entries is loaded into an empty store.
+Files go to a temporary directory (--directory to use another disk).
+
+    python -m benchmarks.book_log [--books 1000000] [--tail 100000]
+"""
+
+import argparse
+import asyncio
+import random
+import tempfile
+import time
+
+from benchmarks.book_store import synthetic_books
+from src.books.store import BookStore
+from src.books.wal import BookLog
+
+
+async def write_load(directory: str, writers: int, writes: int, group_commit_ms: int) -> None:
+
+    store = BookStore(synthetic_books(10000, 1000, 100))
+    log = BookLog(directory, group_commit_ms, snapshot_entries=10**9)
+    log.recover(store)
+
+    flusher = asyncio.create_task(log.run())
+
+    async def writer():
+
+        for _ in range(writes):
+            id = random.randint(1, 10000)
+            changes = {"page_count": random.randint(50, 1500)}
+            store.update(id, changes)
+            await log.append("update", id=id, changes=changes)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(writer() for _ in range(writers)))
+    elapsed = time.perf_counter() - started
+
+    flusher.cancel()
+    await log.close()
+
+    stats = log.stats()
+
+    print(
+        f"{writers:>4} writers, group commit {group_commit_ms} ms :"
+        f" {stats['appends'] / elapsed:9.0f} writes/s,"
+        f" {stats['fsyncs'] / elapsed:7.0f} fsyncs/s,"
+        f" {stats['entries_per_fsync']:7.1f} writes per fsync"
+    )
+
+
+async def fill_tail(log: BookLog, store: BookStore, tail: int, books: int) -> None:
+
+    flusher = asyncio.create_task(log.run())
+
+    async def writer(count: int):
+
+        for _ in range(count):
+            id = random.randint(1, books)
+            changes = {"page_count": random.randint(50, 1500)}
+            store.update(id, changes)
+            await log.append("update", id=id, changes=changes)
+
+    await asyncio.gather(*(writer(tail // 100) for _ in range(100)))
+
+    flusher.cancel()
+    await log.close()
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--books", type=int, default=1000000)
+    parser.add_argument("--tail", type=int, default=100000)
+    parser.add_argument("--writes", type=int, default=20000, help="Writes per throughput run")
+    parser.add_argument("--directory", default=None)
+    args = parser.parse_args()
+
+    random.seed(42)
+
+    for writers, group_commit_ms in ((1, 0), (16, 0), (256, 0), (256, 2)):
+
+        with tempfile.TemporaryDirectory(dir=args.directory) as directory:
+            asyncio.run(write_load(directory, writers, max(args.writes // writers, 1), group_commit_ms))
+
+    with tempfile.TemporaryDirectory(dir=args.directory) as directory:
+
+        store = BookStore(synthetic_books(args.books, 50000, 500))
+
+        started = time.perf_counter()
+        log = BookLog(directory, snapshot_entries=10**9)
+        log.recover(store)
+        print(f"\ninitial snapshot of {args.books} books : {time.perf_counter() - started:.2f}s")
+
+        asyncio.run(fill_tail(log, store, args.tail, args.books))
+
+        recovered = BookStore()
+        report = BookLog(directory).recover(recovered)
+
+        assert len(recovered) == len(store)
+        assert all(recovered.get(id) == store.get(id) for id in random.sample(range(1, args.books + 1), 1000))
+
+        print(
+            f"recovery of {report['books']} books + {report['replayed_entries']} log entries :"
+            f" {report['seconds']:.2f}s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""Latency of the indexed BookStore against a linear scan of a list (standalone).
+
+Loads synthetic books in the store and in a plain list (what book_router used
+to scan), then times lookups by id, filtered, range and sorted page queries,
+updates and deletes on both.
+
+    python -m benchmarks.book_store [--books 1000000]
+"""
+
+import argparse
+import gc
+import random
+import statistics
+import time
+import tracemalloc
+
+from src.books.store import BookStore
+
+LANGUAGES = ["English", "French", "Spanish", "German", "Italian", "Japanese"]
+
+
+def synthetic_books(count: int, authors: int, publishers: int):
+
+    for id in range(1, count + 1):
+
+        yield {
+            "id": id,
+            "title": f"Title {random.randrange(count)}",
+            "author": f"Author {random.randrange(authors)}",
+            "publisher": f"Publisher {random.randrange(publishers)}",
+            "published_date": f"{random.randint(1950, 2024)}-{random.randint(1, 12):02d}-{random.randint(1, 28):02d}",
+            "page_count": random.randint(50, 1500),
+            "language": random.choice(LANGUAGES),
+        }
+
+
+def measure(name: str, runs: int, fn) -> None:
+
+    latencies = []
+
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - started) * 1e6)
+
+    if len(latencies) > 1:
+        quantiles = statistics.quantiles(latencies, n=100)
+        p50, p99 = quantiles[49], quantiles[98]
+    else:
+        p50 = p99 = latencies[0]
+
+    print(f"{name:<44} p50 {p50:12.1f} us   p99 {p99:12.1f} us")
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--books", type=int, default=1000000)
+    parser.add_argument("--authors", type=int, default=50000)
+    parser.add_argument("--publishers", type=int, default=500)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--scan-queries", type=int, default=10, help="Runs of the linear scans")
+    args = parser.parse_args()
+
+    random.seed(42)
+    books = list(synthetic_books(args.books, args.authors, args.publishers))
+
+    gc.collect()
+    tracemalloc.start()
+
+    started = time.perf_counter()
+    store = BookStore(books)
+    build = time.perf_counter() - started
+
+    gc.collect()
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    print(f"{args.books} books loaded in {build:.2f}s, store memory {memory / 2**20:.0f} MiB")
+    print()
+
+    ids = [random.randint(1, args.books) for _ in range(args.queries)]
+    authors = [f"Author {random.randrange(args.authors)}" for _ in range(args.queries)]
+
+    def scan_get(id):
+        return next(book for book in books if book["id"] == id)
+
+    def scan_author(author):
+        return [book for book in books if book["author"] == author][:20]
+
+    measure("store get by id", args.queries, lambda: store.get(random.choice(ids)))
+    measure(
+        "scan get by id",
+        args.scan_queries,
+        lambda: scan_get(random.choice(ids)),
+    )
+
+    measure(
+        "store author filter, 20 per page",
+        args.queries,
+        lambda: store.query(filters={"author": random.choice(authors)}, limit=20),
+    )
+    measure(
+        "scan author filter",
+        args.scan_queries,
+        lambda: scan_author(random.choice(authors)),
+    )
+
+    measure(
+        "store language + 300-320 pages, 20 per page",
+        args.queries,
+        lambda: store.query(
+            filters={"language": "French"}, ranges={"page_count": (300, 320)}, limit=20
+        ),
+    )
+    measure(
+        "store 300-320 pages, by date, 20 per page",
+        args.queries,
+        lambda: store.query(
+            ranges={"page_count": (300, 320)}, sort_by="published_date", limit=20
+        ),
+    )
+    measure(
+        "scan 300-320 pages, by date",
+        args.scan_queries,
+        lambda: sorted(
+            (book for book in books if 300 <= book["page_count"] <= 320),
+            key=lambda book: book["published_date"],
+        )[:20],
+    )
+
+    measure(
+        "store newest first, page 50 of 20",
+        args.queries,
+        lambda: store.query(sort_by="published_date", descending=True, offset=1000, limit=20),
+    )
+    measure(
+        "scan newest first, page 50 of 20",
+        args.scan_queries,
+        lambda: sorted(books, key=lambda book: book["published_date"], reverse=True)[1000:1020],
+    )
+
+    measure(
+        "store update (reindexes the record)",
+        args.queries,
+        lambda: store.update(random.choice(ids), {"page_count": random.randint(50, 1500)}),
+    )
+
+    deleted = iter(random.sample(range(1, args.books + 1), args.queries + args.scan_queries))
+
+    measure("store delete", args.queries, lambda: store.delete(next(deleted)))
+
+    def scan_delete():
+        id = next(deleted)
+        books.remove(next(book for book in books if book["id"] == id))
+
+    measure("scan delete (list.remove)", args.scan_queries, scan_delete)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Mongo round trips and latency of the BookServices state transitions.
+
+Needs the same .env and MongoDB as the server. Books are created in the books
+collection under a dedicated publisher id and hard deleted at the end.
+
+    python -m benchmarks.book_transitions [--books 200]
+
+Run it on the commit before the atomic transitions to get the "before" numbers.
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+from uuid import uuid4
+
+from pymongo import monitoring
+
+
+class CommandCounter(monitoring.CommandListener):
+
+    def __init__(self) -> None:
+        self.count = 0
+
+    def started(self, event):
+        self.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+# The listener must be registered before src.config creates the Motor client
+command_counter = CommandCounter()
+monitoring.register(command_counter)
+
+from src.config import db  # noqa: E402
+from src.dynamic_books.schemas import Book  # noqa: E402
+from src.dynamic_books.services import BookServices  # noqa: E402
+
+
+async def measure(name: str, call, ids: list) -> None:
+
+    latencies = []
+    command_counter.count = 0
+
+    for id in ids:
+        started = time.perf_counter()
+        await call(id)
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    quantiles = statistics.quantiles(latencies, n=100)
+
+    print(
+        f"{name:<10} {command_counter.count / len(ids):5.2f} round trips"
+        f"   p50 {quantiles[49]:7.2f} ms   p99 {quantiles[98]:7.2f} ms"
+    )
+
+
+async def main(books: int) -> None:
+
+    publisher = f"bench-{uuid4().hex}"
+    owner = {"_id": publisher, "role": "user"}
+    admin = {"_id": publisher, "role": "admin"}
+
+    ids = [uuid4().hex for _ in range(books)]
+
+    await db["books"].insert_many(
+        [
+            {
+                "_id": id,
+                "title": f"Benchmark book {id}",
+                "description": "Benchmark",
+                "author_name": "Benchmark",
+                "publisher": "Benchmark",
+                "released_at": "2024-01-01",
+                "page_count": 100,
+                "language": "English",
+                "publisher_user_id": publisher,
+                "created_at": "2024-01-01 00:00:00",
+                "status": False,
+                "delete_status": False,
+                "deleted_by_admin": False,
+            }
+            for id in ids
+        ]
+    )
+
+    update = Book(
+        title="Benchmark book", description="Updated", author_name="Benchmark",
+        publisher="Benchmark", released_at="2024-01-01", page_count=200, language="English",
+    )
+
+    try:
+
+        for name, user in (("owner", owner), ("admin", admin)):
+
+            print(f"As {name}:")
+
+            await measure("publish", lambda id: BookServices.publish_a_book(id, user), ids)
+            await measure("unpublish", lambda id: BookServices.unpublish_a_book(id, user), ids)
+            await measure("update", lambda id: BookServices.update_book(id, update, user), ids)
+
+        await measure("delete", lambda id: BookServices.delete_a_book(id, owner), ids)
+
+    finally:
+
+        await db["books"].delete_many({"publisher_user_id": publisher})
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--books", type=int, default=200)
+    args = parser.parse_args()
+
+    asyncio.run(main(args.books))
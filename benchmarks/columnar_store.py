@@ -0,0 +1,104 @@
+"""Memory and latency of the columnar books store (standalone).
+
+Compares the list of dicts of src/books/book_data.py, the indexed BookStore
+and the ColumnarBookStore on the same synthetic books: memory held once built
+and latency of the book_router queries. The columnar scans use NumPy when it
+is installed.
+
+    python -m benchmarks.columnar_store [--books 1000000]
+"""
+
+import argparse
+import gc
+import random
+import time
+import tracemalloc
+
+from benchmarks.book_store import measure, synthetic_books
+from src.books import columnar
+from src.books.columnar import ColumnarBookStore
+from src.books.store import BookStore
+
+
+def build(name: str, count: int, factory):
+
+    random.seed(42)
+
+    gc.collect()
+    tracemalloc.start()
+
+    started = time.perf_counter()
+    store = factory(synthetic_books(count, 50000, 500))
+    elapsed = time.perf_counter() - started
+
+    gc.collect()
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    print(
+        f"{name:<12} built in {elapsed:6.2f}s, {memory / 2**20:6.0f} MiB"
+        f" ({memory / count:5.0f} bytes per book)"
+    )
+
+    return store
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--books", type=int, default=1000000)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"NumPy: {'yes' if columnar.numpy is not None else 'no'}\n")
+
+    stores = {
+        "dict list": build("dict list", args.books, list),
+        "indexed": build("indexed", args.books, BookStore),
+        "columnar": build("columnar", args.books, ColumnarBookStore),
+    }
+
+    del stores["dict list"]
+    print()
+
+    ids = [random.randint(1, args.books) for _ in range(args.queries)]
+    authors = [f"Author {random.randrange(50000)}" for _ in range(args.queries)]
+
+    for name, store in stores.items():
+
+        measure(f"{name} get by id", args.queries, lambda: store.get(random.choice(ids)))
+        measure(
+            f"{name} author filter, 20 per page",
+            args.queries,
+            lambda: store.query(filters={"author": random.choice(authors)}, limit=20),
+        )
+        measure(
+            f"{name} French + 300-320 pages",
+            args.queries,
+            lambda: store.query(
+                filters={"language": "French"}, ranges={"page_count": (300, 320)}, limit=20
+            ),
+        )
+        measure(
+            f"{name} 1990s by date, 20 per page",
+            args.queries,
+            lambda: store.query(
+                ranges={"published_date": ("1990-01-01", "1999-12-31")},
+                sort_by="published_date",
+                limit=20,
+            ),
+        )
+        measure(
+            f"{name} first page of 100, unfiltered",
+            args.queries,
+            lambda: store.query(limit=100),
+        )
+        measure(
+            f"{name} update",
+            args.queries,
+            lambda: store.update(random.choice(ids), {"page_count": random.randint(50, 1500)}),
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""p99 latency of an unrelated endpoint while logins hash passwords.
+
+Runs a small in-process app (no MongoDB or Redis needed) with a /login route
+doing bcrypt and a /ping route, once with bcrypt on the event loop (before)
+and once through PasswordHasher (after).
+
+    python -m benchmarks.password_hashing [--logins 200] [--pings 500] [--executor process]
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+import httpx
+from fastapi import FastAPI
+
+from src.user.hashing import PasswordHasher, hash_password
+
+
+def build_app(hasher: PasswordHasher = None) -> FastAPI:
+
+    app = FastAPI()
+
+    @app.post("/login")
+    async def login():
+
+        if hasher is None:
+            hash_password("s3cRet_password")
+        else:
+            await hasher.hash("s3cRet_password")
+
+        return {"message": "Login successful"}
+
+    @app.get("/ping")
+    async def ping():
+        return {"status": "OK"}
+
+    return app
+
+
+async def run(app: FastAPI, logins: int, pings: int, concurrency: int) -> list:
+
+    transport = httpx.ASGITransport(app=app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def login():
+            async with semaphore:
+                await client.post("/login")
+
+        async def ping():
+            latencies = []
+
+            for _ in range(pings):
+                started = time.perf_counter()
+                await client.get("/ping")
+                latencies.append((time.perf_counter() - started) * 1000)
+                await asyncio.sleep(0.001)
+
+            return latencies
+
+        storm = asyncio.gather(*(login() for _ in range(logins)))
+        latencies = await ping()
+        await storm
+
+    return latencies
+
+
+def report(name: str, latencies: list) -> None:
+
+    quantiles = statistics.quantiles(latencies, n=100)
+
+    print(
+        f"{name:<8} /ping p50 {quantiles[49]:8.2f} ms   p99 {quantiles[98]:8.2f} ms"
+        f"   max {max(latencies):8.2f} ms"
+    )
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--pings", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--executor", default="process", choices=["process", "thread"])
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    before = asyncio.run(run(build_app(), args.logins, args.pings, args.concurrency))
+
+    hasher = PasswordHasher(args.executor, args.workers, max_pending=args.logins)
+
+    try:
+        after = asyncio.run(
+            run(build_app(hasher), args.logins, args.pings, args.concurrency)
+        )
+    finally:
+        hasher.shutdown()
+
+    report("before", before)
+    report("after", after)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""Allocations and latency of get_all_published_books pages, decoded or raw BSON (standalone).
+
+A page of synthetic published books is encoded once as the BSON MongoDB
+replies with, then served by an in-process app (httpx ASGI transport, no
+network, no database) the way the route does it:
+
+- decoded : the driver decodes the reply into dicts, the route computes the
+  list ETag and sends them through response_model (the current path)
+- raw : the reply is read as RawBSONDocument with the page projection and
+  BSONPageEncoder writes the JSON from its bytes (RAW_BSON_ROUTES)
+
+Both on a query cache miss (the reply is decoded) and on a hit (the page is
+read back from the json_util entry the query cache stores in Redis: documents
+validated again when decoded, the JSON body as it is when raw).
+
+Per request: peak memory allocated (tracemalloc) and p50 / p99 latency.
+
+    python -m benchmarks.raw_bson_pages [--page-size 100] [--requests 1000]
+"""
+
+import argparse
+import asyncio
+import random
+import statistics
+import time
+import tracemalloc
+from typing import List
+
+import bson
+import httpx
+from bson import json_util
+from fastapi import FastAPI, Request, Response
+
+from benchmarks.trusted_projection import book_document
+from src.bson_json import RAW_CODEC, BSONPageEncoder
+from src.conditional import conditional_response, list_etag, versions_etag
+from src.dynamic_books.schemas import BookResponse
+
+
+def page_app(reply: bytes, projected_reply: bytes) -> FastAPI:
+
+    app = FastAPI()
+    encoder = BSONPageEncoder(BookResponse)
+
+    # Query cache entries, as written to Redis
+    decoded_entry = json_util.dumps({"value": [bson.decode_all(reply), None]})
+    raw_entry = json_util.dumps({"value": [encoder.encode(bson.decode_all(projected_reply, RAW_CODEC)), None]})
+
+    def send_decoded(request: Request, response: Response, books: list):
+
+        etag = list_etag(books, None, "admin")
+        not_modified = conditional_response(request, response, etag)
+
+        return not_modified or books
+
+    def send_raw(request: Request, response: Response, page: dict):
+
+        etag = versions_etag(page["versions"], None, "admin")
+        not_modified = conditional_response(request, response, etag)
+
+        return not_modified or Response(
+            page["body"], media_type="application/json", headers=dict(response.headers)
+        )
+
+    @app.get("/decoded", response_model=List[BookResponse])
+    async def decoded(request: Request, response: Response):
+        return send_decoded(request, response, bson.decode_all(reply))
+
+    @app.get("/raw", response_model=List[BookResponse])
+    async def raw(request: Request, response: Response):
+        return send_raw(request, response, encoder.encode(bson.decode_all(projected_reply, RAW_CODEC)))
+
+    @app.get("/decoded-hit", response_model=List[BookResponse])
+    async def decoded_hit(request: Request, response: Response):
+        return send_decoded(request, response, json_util.loads(decoded_entry)["value"][0])
+
+    @app.get("/raw-hit", response_model=List[BookResponse])
+    async def raw_hit(request: Request, response: Response):
+        return send_raw(request, response, json_util.loads(raw_entry)["value"][0])
+
+    return app
+
+
+async def measure(client: httpx.AsyncClient, name: str, requests: int) -> None:
+
+    await client.get(f"/{name}")
+
+    latencies = []
+
+    for _ in range(requests):
+        started = time.perf_counter()
+        await client.get(f"/{name}")
+        latencies.append((time.perf_counter() - started) * 1e6)
+
+    # Allocations in a separate pass, tracemalloc slows everything down
+    peaks = []
+    tracemalloc.start()
+
+    for _ in range(min(requests, 100)):
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        await client.get(f"/{name}")
+        peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+
+    tracemalloc.stop()
+
+    quantiles = statistics.quantiles(latencies, n=100)
+
+    print(
+        f"{name:<12} p50 {quantiles[49]:8.0f} us   p99 {quantiles[98]:8.0f} us"
+        f"   peak allocated {statistics.median(peaks) / 1024:8.0f} KiB per request"
+    )
+
+
+async def main_async(args) -> None:
+
+    random.seed(42)
+
+    books = [book_document(published=True) for _ in range(args.page_size)]
+    encoder = BSONPageEncoder(BookResponse)
+
+    reply = b"".join(bson.encode(book) for book in books)
+    projected_reply = b"".join(
+        bson.encode({key: book[key] for key in encoder.projection if key in book}) for book in books
+    )
+
+    transport = httpx.ASGITransport(app=page_app(reply, projected_reply))
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+
+        # Same JSON both ways
+        expected = (await client.get("/decoded")).json()
+
+        for name in ("raw", "decoded-hit", "raw-hit"):
+            assert (await client.get(f"/{name}")).json() == expected
+
+        print(f"{args.page_size} books per page, {len(reply) / 1024:.0f} KiB of BSON\n")
+
+        for name in ("decoded", "raw", "decoded-hit", "raw-hit"):
+            await measure(client, name, args.requests)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=1000)
+    args = parser.parse_args()
+
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
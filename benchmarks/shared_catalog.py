@@ -0,0 +1,161 @@
+"""Memory per worker and write visibility of the shared books catalog (standalone).
+
+Starts --workers processes which either build their own store (indexed or
+columnar, as every uvicorn worker does today) or attach to the shared catalog,
+then run the same queries. Each worker reports its private memory (USS, from
+/proc/self/smaps_rollup, Linux only). The writer then publishes updates and
+the workers report when they first read each new version.
+
+    python -m benchmarks.shared_catalog [--books 1000000] [--workers 4]
+"""
+
+import argparse
+import multiprocessing
+import random
+import statistics
+import time
+
+from benchmarks.book_store import synthetic_books
+from src.books.columnar import ColumnarBookStore
+from src.books.shared import SharedBookStore
+from src.books.store import BookStore
+
+NAME = "fastbook_benchmark"
+
+# Page count of the first published write, above the synthetic ones
+FIRST_PAGE_COUNT = 10000
+
+
+def private_memory() -> int:
+
+    # Bytes of memory only this process maps
+    with open("/proc/self/smaps_rollup") as smaps:
+
+        fields = dict(line.split(":", 1) for line in smaps if ":" in line)
+
+    return sum(int(fields[field].split()[0]) * 1024 for field in ("Private_Clean", "Private_Dirty"))
+
+
+def run_queries(store) -> None:
+
+    for _ in range(20):
+        store.get(random.randint(1, 1000))
+        store.query(filters={"language": "French"}, ranges={"page_count": (300, 320)}, limit=20)
+        store.query(limit=100)
+
+
+def worker(mode: str, books: int, versions: int, ready, results) -> None:
+
+    random.seed(42)
+    baseline = private_memory()
+
+    if mode == "shared":
+        store = SharedBookStore(NAME)
+    elif mode == "columnar":
+        store = ColumnarBookStore(synthetic_books(books, 50000, 500))
+    else:
+        store = BookStore(synthetic_books(books, 50000, 500))
+
+    run_queries(store)
+    memory = private_memory() - baseline
+
+    ready.put(None)
+
+    # Page count written by each version -> when this worker first read it
+    seen = {}
+
+    if mode == "shared":
+
+        # The last write sets the page count to FIRST_PAGE_COUNT + versions - 1
+        while FIRST_PAGE_COUNT + versions - 1 not in seen:
+
+            seen.setdefault(store.get(1)["page_count"], time.monotonic())
+
+            # A read every millisecond, like a busy worker
+            time.sleep(0.001)
+
+    results.put((memory, seen))
+
+
+def run(mode: str, books: int, workers: int, versions: int) -> None:
+
+    context = multiprocessing.get_context("spawn")
+    ready, results = context.Queue(), context.Queue()
+
+    writer = None
+
+    if mode == "shared":
+
+        started = time.perf_counter()
+        writer = SharedBookStore(NAME, synthetic_books(books, 50000, 500))
+        len(writer)
+        print(f"shared catalog of {books} books published in {time.perf_counter() - started:.2f}s")
+
+    processes = [
+        context.Process(target=worker, args=(mode, books, versions, ready, results))
+        for _ in range(workers)
+    ]
+
+    for process in processes:
+        process.start()
+
+    for _ in processes:
+        ready.get()
+
+    publishes = []
+
+    # Page count written by each version -> when it was published
+    published = {}
+
+    if writer is not None:
+
+        for version in range(versions):
+
+            started = time.monotonic()
+            writer.update(1, {"page_count": FIRST_PAGE_COUNT + version})
+            published[FIRST_PAGE_COUNT + version] = time.monotonic()
+            publishes.append(published[FIRST_PAGE_COUNT + version] - started)
+
+            # Leave the readers time to see each version
+            time.sleep(0.05)
+
+    reports = [results.get() for _ in processes]
+
+    for process in processes:
+        process.join()
+
+    memory = statistics.mean(memory for memory, _ in reports)
+    print(f"{mode:<9} {workers} workers : {memory / 2**20:7.1f} MiB private memory per worker")
+
+    if writer is not None:
+
+        delays = sorted(
+            seen[page_count] - published_at
+            for _, seen in reports
+            for page_count, published_at in published.items()
+            if page_count in seen
+        )
+
+        print(
+            f"          publish {statistics.median(publishes) * 1000:7.1f} ms (median),"
+            f" visible to the workers after {statistics.median(delays) * 1000:6.2f} ms (median),"
+            f" {delays[int(len(delays) * 0.99)] * 1000:6.2f} ms (p99)"
+        )
+
+        writer.unlink()
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--books", type=int, default=1000000)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--versions", type=int, default=20, help="Writes published to the workers")
+    args = parser.parse_args()
+
+    for mode in ("indexed", "columnar", "shared"):
+        run(mode, args.books, args.workers, args.versions)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""Cost of sending a page of documents per list route, validated or trusted (standalone).
+
+For each list route that can be trusted, a page of synthetic documents shaped
+like the ones MongoDB returns for it is sent by an in-process app (httpx ASGI
+transport, no network, no database) in three ways:
+
+- validated : response_model validation and encoding, rendered by json.dumps
+  (the app before the orjson default response class)
+- orjson : the same with ORJSONResponse, the default response class now
+- trusted : TrustedProjection shaping, dumped by orjson
+
+    python -m benchmarks.trusted_projection [--page-size 100] [--requests 300]
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from typing import List
+from uuid import uuid4
+
+import httpx
+from fastapi import FastAPI, Response
+from fastapi.responses import JSONResponse, ORJSONResponse
+
+from src.dynamic_books.schemas import BookResponse
+from src.responses import TrustedProjection
+from src.user.schemas import UserResponseAdmin
+
+
+def timestamp() -> str:
+
+    return f"2024-{random.randint(1, 12):02d}-{random.randint(1, 28):02d} 10:00:00.000000+00:00"
+
+
+def book_document(published: bool = False, deleted: bool = False) -> dict:
+
+    book = {
+        "_id": uuid4().hex,
+        "title": f"Title {random.randrange(10**6)}",
+        "description": "A brief description of the book " * 4,
+        "author_name": f"Author {random.randrange(5000)}",
+        "publisher": f"Publisher {random.randrange(500)}",
+        "released_at": timestamp(),
+        "page_count": random.randint(50, 1500),
+        "language": random.choice(["English", "French", "Spanish"]),
+        "publisher_user_id": uuid4().hex,
+        "created_at": timestamp(),
+        "status": published,
+        "delete_status": deleted,
+        "version": random.randint(1, 5),
+        "modified_at": timestamp(),
+    }
+
+    if published:
+        book["published_at"] = timestamp()
+
+    if deleted:
+        book["deleted_at"] = timestamp()
+
+    return book
+
+
+def user_document() -> dict:
+
+    return {
+        "_id": uuid4().hex,
+        "username": f"user{random.randrange(10**6)}",
+        "email": f"user{random.randrange(10**6)}@example.com",
+        "password": "$2b$12$" + "x" * 53,
+        "role": "user",
+        "created_at": timestamp(),
+        "is_verified": True,
+        "verified_at": timestamp(),
+        "is_logged_in": False,
+        "last_login_at": timestamp(),
+    }
+
+
+# Route -> (response model, one document of its pages)
+ROUTES = {
+    "get_all_books": (BookResponse, lambda: book_document(random.random() < 0.5)),
+    "get_all_published_books": (BookResponse, lambda: book_document(published=True)),
+    "get_unpublished_books": (BookResponse, lambda: book_document()),
+    "get_deleted_books": (BookResponse, lambda: book_document(deleted=True)),
+    "search_books": (BookResponse, lambda: {**book_document(published=True), "score": 1.5}),
+    "get_user_books": (BookResponse, lambda: book_document(random.random() < 0.5)),
+    "get_all_users": (UserResponseAdmin, user_document),
+}
+
+
+def route_app(model, documents: list) -> FastAPI:
+
+    app = FastAPI()
+    trusted = TrustedProjection(model)
+
+    @app.get("/validated", response_model=List[model], response_class=JSONResponse)
+    async def validated():
+        return documents
+
+    @app.get("/orjson", response_model=List[model], response_class=ORJSONResponse)
+    async def with_orjson():
+        return documents
+
+    @app.get("/trusted", response_model=List[model])
+    async def with_trusted_projection(response: Response):
+        return trusted.response(documents, response)
+
+    return app
+
+
+async def measure(client: httpx.AsyncClient, url: str, requests: int) -> tuple:
+
+    body = (await client.get(url)).content
+
+    started = time.perf_counter()
+
+    for _ in range(requests):
+        await client.get(url)
+
+    return (time.perf_counter() - started) / requests * 1e6, body
+
+
+async def main_async(args) -> None:
+
+    random.seed(42)
+
+    for route, (model, document) in ROUTES.items():
+
+        documents = [document() for _ in range(args.page_size)]
+        transport = httpx.ASGITransport(app=route_app(model, documents))
+
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+
+            results = {
+                name: await measure(client, f"/{name}", args.requests)
+                for name in ("validated", "orjson", "trusted")
+            }
+
+        # Same JSON whichever way it is sent
+        assert all(json.loads(body) == json.loads(results["validated"][1]) for _, body in results.values())
+
+        validated = results["validated"][0]
+
+        print(
+            f"{route:<24}"
+            + "".join(
+                f" {name} {micros:8.0f} us ({validated / micros:4.1f}x)"
+                for name, (micros, _) in results.items()
+            )
+        )
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=300)
+    args = parser.parse_args()
+
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""DataLoader style batching of lookups by _id.
+
+Lookups made by concurrent requests are queued, and the queue is resolved with
+one find({"_id": {"$in": ids}}) once `max_wait` seconds have passed (0: at the
+end of the current event loop iteration) or `max_batch_size` ids are queued.
+Each caller gets its own document, or None.
+"""
+
+import asyncio
+
+
+class BatchLoader:
+
+    def __init__(self, collection, query: dict = None, max_batch_size: int = 100, max_wait: float = 0.0) -> None:
+
+        self.collection = collection
+        self.query = query or {}
+        self.max_batch_size = max(max_batch_size, 1)
+        self.max_wait = max_wait
+
+        # id -> futures of the callers waiting for it
+        self._pending = {}
+        self._timer = None
+
+        self.keys = 0
+        self.batches = 0
+
+        # Background queries, kept referenced until they finish
+        self._dispatching = set()
+
+    async def load(self, id):
+
+        future = asyncio.get_running_loop().create_future()
+
+        self._pending.setdefault(id, []).append(future)
+
+        if len(self._pending) >= self.max_batch_size:
+            self._dispatch()
+
+        elif self._timer is None:
+            loop = asyncio.get_running_loop()
+
+            if self.max_wait > 0:
+                self._timer = loop.call_later(self.max_wait, self._dispatch)
+            else:
+                self._timer = loop.call_soon(self._dispatch)
+
+        return await future
+
+    def _dispatch(self) -> None:
+
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        if not self._pending:
+            return
+
+        batch, self._pending = self._pending, {}
+
+        task = asyncio.ensure_future(self._resolve(batch))
+        self._dispatching.add(task)
+        task.add_done_callback(self._dispatching.discard)
+
+    async def _resolve(self, batch: dict) -> None:
+
+        self.keys += len(batch)
+        self.batches += 1
+
+        try:
+
+            documents = {
+                document["_id"]: document
+                async for document in self.collection.find(
+                    {**self.query, "_id": {"$in": list(batch)}}
+                )
+            }
+
+        except Exception as e:
+
+            for futures in batch.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+
+            return
+
+        for id, futures in batch.items():
+
+            for future in futures:
+
+                # The caller may have been cancelled meanwhile
+                if not future.done():
+                    future.set_result(documents.get(id))
+
+    def stats(self) -> dict:
+
+        return {
+            "keys": self.keys,
+            "batches": self.batches,
+            "average_batch_size": round(self.keys / self.batches, 2) if self.batches else 0.0,
+            "max_batch_size": self.max_batch_size,
+            "max_wait": self.max_wait,
+        }
@@ -0,0 +1,128 @@
+"""Pre-encoded JSON body of the whole book list.
+
+GET /api/v1/books without parameters returns every book of the store. Instead
+of validating and encoding each record on every call, the body is encoded once
+per version of the store (bumped by every write) and sent as is. The gzipped
+body is built the first time a client accepts it. Both are rebuilt lazily, on
+the first request after a write.
+
+The ETag is derived from the body, so it is the same in every worker holding
+the same books, and a matching If-None-Match gets a 304 without any encoding.
+"""
+
+import gzip
+import hashlib
+import json
+from typing import Optional
+
+from fastapi import Request, Response, status
+
+from src.conditional import is_not_modified
+
+
+def accepts_gzip(accept_encoding: str) -> bool:
+
+    # q-value of gzip, or of `*` when gzip is not listed; q=0 refuses it
+    qualities = {}
+
+    for coding in accept_encoding.split(","):
+
+        name, *parameters = coding.split(";")
+        quality = 1.0
+
+        for parameter in parameters:
+
+            key, _, value = parameter.partition("=")
+
+            if key.strip().lower() == "q":
+
+                try:
+                    quality = float(value)
+
+                except ValueError:
+                    quality = 0.0
+
+        qualities[name.strip().lower()] = quality
+
+    return qualities.get("gzip", qualities.get("x-gzip", qualities.get("*", 0.0))) > 0
+
+
+class EncodedList:
+
+    def __init__(self, store, gzip_level: int) -> None:
+
+        self.store = store
+
+        # 0 never compresses
+        self.gzip_level = gzip_level
+
+        self._version = None
+        self.body = b""
+        self.count = 0
+        self.etag = '""'
+        self._gzipped = None
+
+        self.encodes = 0
+        self.compressions = 0
+
+    def refresh(self) -> None:
+
+        version = self.store.version
+
+        if version == self._version:
+            return
+
+        records = [dict(book) for book in self.store]
+
+        # Same output as FastAPI's JSONResponse
+        self.body = json.dumps(
+            records, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+        ).encode("utf-8")
+
+        self.count = len(records)
+        self.etag = f'"{hashlib.sha1(self.body).hexdigest()}"'
+        self._gzipped = None
+        self._version = version
+
+        self.encodes += 1
+
+    def gzipped(self) -> bytes:
+
+        if self._gzipped is None:
+
+            # mtime=0 keeps the bytes, hence the ETag, the same in every worker
+            self._gzipped = gzip.compress(self.body, compresslevel=self.gzip_level, mtime=0)
+            self.compressions += 1
+
+        return self._gzipped
+
+    def response(self, request: Request, count_header: Optional[str] = None) -> Response:
+
+        self.refresh()
+
+        # Weak ETag: the same for the plain and gzipped bodies
+        headers = {"ETag": f"W/{self.etag}", "Vary": "Accept-Encoding"}
+
+        if count_header is not None:
+            headers[count_header] = str(self.count)
+
+        if is_not_modified(request, self.etag, None):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        if self.gzip_level and accepts_gzip(request.headers.get("accept-encoding", "")):
+            headers["Content-Encoding"] = "gzip"
+
+            return Response(self.gzipped(), media_type="application/json", headers=headers)
+
+        return Response(self.body, media_type="application/json", headers=headers)
+
+    def stats(self) -> dict:
+
+        return {
+            "version": self._version,
+            "books": self.count,
+            "bytes": len(self.body),
+            "gzipped_bytes": None if self._gzipped is None else len(self._gzipped),
+            "encodes": self.encodes,
+            "compressions": self.compressions,
+        }
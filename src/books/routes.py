@@ -1,18 +1,69 @@
-from fastapi import APIRouter, status
+import asyncio
+from fastapi import APIRouter, Query, Request, Response, status
 from fastapi.exceptions import HTTPException
-from typing import List
+from typing import List, Literal, Optional
 
-from src.books.book_data import books
+from src.books.encoded import EncodedList
+from src.books.store import book_store
+from src.books.wal import book_log
 from src.books.schemas import Book, BookUpdateModel
+from src.config import BOOKS_LIST_GZIP_LEVEL
 
 book_router = APIRouter(
     tags=["CRUD on Book without DataBase"]
 )
 
+# Response header carrying the number of books matching the filters
+TOTAL_COUNT_HEADER = "X-Total-Count"
 
-# Get all books
+# Encoded body of the unfiltered list, rebuilt after the writes
+book_list = EncodedList(book_store, BOOKS_LIST_GZIP_LEVEL)
+
+
+# Writes of the shared store wait for the other workers and republish the catalog: in a thread
+async def store_write(write, *args):
+
+    if getattr(book_store, "blocking_writes", False):
+        return await asyncio.to_thread(write, *args)
+
+    return write(*args)
+
+
+# Get all books, filtered, sorted and paginated from the store indexes
 @book_router.get("/", response_model=List[Book])
-async def get_all_books():
+async def get_all_books(
+    request: Request,
+    response: Response,
+    author: Optional[str] = None,
+    language: Optional[str] = None,
+    publisher: Optional[str] = None,
+    min_pages: Optional[int] = None,
+    max_pages: Optional[int] = None,
+    published_after: Optional[str] = Query(None, description="YYYY-MM-DD, included"),
+    published_before: Optional[str] = Query(None, description="YYYY-MM-DD, included"),
+    sort_by: Optional[Literal["id", "title", "page_count", "published_date"]] = None,
+    order: Literal["asc", "desc"] = "asc",
+    offset: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1),
+):
+
+    # The whole list is served pre-encoded
+    if not request.query_params:
+        return book_list.response(request, TOTAL_COUNT_HEADER)
+
+    total, books = book_store.query(
+        filters={"author": author, "language": language, "publisher": publisher},
+        ranges={
+            "page_count": (min_pages, max_pages),
+            "published_date": (published_after, published_before),
+        },
+        sort_by=sort_by,
+        descending=order == "desc",
+        offset=offset,
+        limit=limit,
+    )
+
+    response.headers[TOTAL_COUNT_HEADER] = str(total)
 
     return books
 
@@ -22,17 +73,29 @@ async def get_all_books():
 async def create_a_book(book_data: Book) -> dict:
     new_book = book_data.model_dump()
 
-    books.append(new_book)
+    # Logged first, the store only holds durable writes
+    async with book_log.writing(new_book["id"]):
+
+        if book_store.get(new_book["id"]) is not None:
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Book Already Exists")
 
-    return new_book
+        await book_log.append("insert", record=new_book)
+
+        try:
+            return await store_write(book_store.insert, new_book)
+
+        # Inserted by another worker of the shared store meanwhile
+        except KeyError:
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Book Already Exists")
 
 
 # Get a book
 @book_router.get("/{book_id}")
 async def get_a_book(book_id: int) -> dict:
-    for book in books:
-        if book["id"] == book_id:
-            return book
+    book = book_store.get(book_id)
+
+    if book is not None:
+        return book
 
     raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Book Not Found")
 
@@ -40,14 +103,22 @@ async def get_a_book(book_id: int) -> dict:
 # Update a book
 @book_router.patch("/{book_id}")
 async def update_a_book(book_id: int, book_update_data: BookUpdateModel) -> dict:
-    for book in books:
-        if book["id"] == book_id:
-            book["title"] = book_update_data.title
-            book["publisher"] = book_update_data.publisher
-            book["page_count"] = book_update_data.page_count
-            book["language"] = book_update_data.language
+    changes = {
+        "title": book_update_data.title,
+        "publisher": book_update_data.publisher,
+        "page_count": book_update_data.page_count,
+        "language": book_update_data.language,
+    }
+
+    async with book_log.writing(book_id):
 
-            return book
+        if book_store.get(book_id) is not None:
+            await book_log.append("update", id=book_id, changes=changes)
+
+            book = await store_write(book_store.update, book_id, changes)
+
+            if book is not None:
+                return book
 
     raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Book Not Found")
 
@@ -55,10 +126,12 @@ async def update_a_book(book_id: int, book_update_data: BookUpdateModel) -> dict
 # Get a book
 @book_router.delete("/{book_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_a_book(book_id: int):
-    for book in books:
-        if book["id"] == book_id:
-            books.remove(book)
+    async with book_log.writing(book_id):
+
+        if book_store.get(book_id) is not None:
+            await book_log.append("delete", id=book_id)
 
-            return {}
+            if await store_write(book_store.delete, book_id) is not None:
+                return {}
 
     raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Book Not Found")
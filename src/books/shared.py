@@ -0,0 +1,546 @@
+"""Books catalog shared by the workers of a node through shared memory.
+
+Selected with BOOKS_STORE=shared. The catalog is published in the columnar
+layout of src.books.columnar, in one shared memory segment per version
+(<BOOKS_SHARED_NAME>_<version>), plus the rows and ids sorted by id for
+lookups. A small control segment (<BOOKS_SHARED_NAME>) holds the current
+version. Every worker maps the current segment and reads the columns in place
+(memoryview, NumPy views when installed): the catalog costs its memory once
+per node, each worker only keeps its string tables.
+
+Writes are serialized between the workers by an exclusive lock on a file. The
+writer applies the mutation to a private ColumnarBookStore copy of the
+current version (kept for its next writes while nobody else publishes),
+writes the next version to a new segment, switches the control segment to it
+and unlinks the previous one. Readers notice the new version on their next
+request and swap their mapping; mappings of an unlinked segment stay valid
+until closed. A write republishes the whole catalog, which suits a read
+mostly catalog; prefer the indexed store for write heavy use. book_router runs
+the writes in a thread (blocking_writes): waiting for the lock and publishing
+(~100 ms for 200k books) do not stall the event loop. The reads stay on the
+event loop and never take the lock once the catalog is mapped (attach() at
+startup).
+
+The segments outlive the workers (a restart attaches to the current version).
+Remove them with:
+
+    python -m src.books.shared --unlink
+"""
+
+import argparse
+import atexit
+import bisect
+import fcntl
+import json
+import os
+import struct
+import tempfile
+import threading
+from array import array
+from contextlib import contextmanager
+from multiprocessing import resource_tracker, shared_memory
+from typing import Optional
+
+from src.books.columnar import INTERNED_FIELDS, ColumnarBookStore, StringTable, numpy
+from src.config import BOOKS_SHARED_NAME
+
+# Current version, in the control segment
+CONTROL = struct.Struct("<Q")
+
+# Length of the JSON header at the start of a catalog segment
+HEADER_LENGTH = struct.Struct("<Q")
+
+ALIGNMENT = 8
+
+# Reads of the published version when its segment was unlinked by a newer one in between
+SEGMENT_ATTEMPTS = 5
+
+
+def open_segment(name: str, create: bool = False, size: int = 0) -> shared_memory.SharedMemory:
+
+    try:
+        return shared_memory.SharedMemory(name=name, create=create, size=size, track=False)
+
+    except TypeError:
+        pass
+
+    segment = shared_memory.SharedMemory(name=name, create=create, size=size)
+
+    # Before Python 3.13 the resource tracker (one for all the workers) unlinks every segment a
+    # process used when it exits, even the ones other workers still read: take it back out
+    resource_tracker.unregister(segment._name, "shared_memory")
+
+    return segment
+
+
+def unlink_segment(name: str) -> None:
+
+    try:
+        segment = open_segment(name)
+
+    except FileNotFoundError:
+        return
+
+    segment.close()
+
+    # Before Python 3.13, unlink() also unregisters the segment from the resource tracker
+    if getattr(segment, "_track", True):
+
+        try:
+            shared_memory._posixshmem.shm_unlink(segment._name)
+
+        except FileNotFoundError:
+            pass
+
+    else:
+        segment.unlink()
+
+
+def catalog_sections(store: ColumnarBookStore) -> dict:
+
+    # name -> (array, typecode) of a compacted store
+    if store._dead_rows or store._dead_text:
+        store._compact()
+
+    ids = store._ids
+
+    if numpy is not None:
+        order = numpy.argsort(numpy.frombuffer(ids, dtype=numpy.int64), kind="stable")
+        by_id = array("Q", order.astype(numpy.uint64).tobytes())
+        sorted_ids = array(ids.typecode, numpy.frombuffer(ids, dtype=numpy.int64)[order].tobytes())
+    else:
+        by_id = array("Q", sorted(range(len(ids)), key=ids.__getitem__))
+        sorted_ids = array(ids.typecode, (ids[row] for row in by_id))
+
+    sections = {
+        "ids": ids,
+        "page_counts": store._page_counts,
+        "alive": store._alive,
+        "title_starts": store._title_starts,
+        "title_lengths": store._title_lengths,
+        "by_id": by_id,
+        "sorted_ids": sorted_ids,
+        "text": array("B", store._text),
+    }
+
+    for field in INTERNED_FIELDS:
+        sections[f"codes.{field}"] = store._codes[field]
+
+    return sections
+
+
+def write_catalog(name: str, store: ColumnarBookStore) -> None:
+
+    sections = catalog_sections(store)
+    tables = {field: store._tables[field].strings for field in INTERNED_FIELDS}
+
+    # Offsets depend on the header length, which depends on the offsets: reserve room for them
+    layout = {}
+    offset = 0
+
+    for section, values in sections.items():
+        layout[section] = [offset, len(values) * values.itemsize, values.typecode]
+        offset += -(-layout[section][1] // ALIGNMENT) * ALIGNMENT
+
+    header = json.dumps({"count": len(store), "sections": layout, "tables": tables}).encode()
+    start = -(-(HEADER_LENGTH.size + len(header) + len(sections) * 40) // ALIGNMENT) * ALIGNMENT
+
+    for section in layout.values():
+        section[0] += start
+
+    header = json.dumps({"count": len(store), "sections": layout, "tables": tables}).encode()
+    assert HEADER_LENGTH.size + len(header) <= start
+
+    segment = open_segment(name, create=True, size=max(start + offset, 1))
+
+    try:
+
+        HEADER_LENGTH.pack_into(segment.buf, 0, len(header))
+        segment.buf[HEADER_LENGTH.size : HEADER_LENGTH.size + len(header)] = header
+
+        for section, values in sections.items():
+            position, size, _ = layout[section]
+            segment.buf[position : position + size] = memoryview(values).cast("B")
+
+    finally:
+
+        segment.close()
+
+
+class CatalogView(ColumnarBookStore):
+    """Read only ColumnarBookStore over a mapped catalog segment."""
+
+    def __init__(self, segment: shared_memory.SharedMemory) -> None:
+
+        self.segment = segment
+
+        buffer = segment.buf
+        (length,) = HEADER_LENGTH.unpack_from(buffer, 0)
+        header = json.loads(bytes(buffer[HEADER_LENGTH.size : HEADER_LENGTH.size + length]))
+
+        self._count = header["count"]
+        self._views = []
+
+        def section(name: str):
+
+            position, size, typecode = header["sections"][name]
+            view = buffer[position : position + size].cast(typecode)
+            self._views.append(view)
+
+            return view
+
+        self._ids = section("ids")
+        self._page_counts = section("page_counts")
+        self._alive = section("alive")
+        self._title_starts = section("title_starts")
+        self._title_lengths = section("title_lengths")
+        self._by_id = section("by_id")
+        self._text = section("text")
+        self._codes = {field: section(f"codes.{field}") for field in INTERNED_FIELDS}
+
+        # Catalogs published before the sorted ids section (segments outlive the workers)
+        if "sorted_ids" in header["sections"]:
+            self._sorted_ids = section("sorted_ids")
+        else:
+            self._sorted_ids = array("q", (self._ids[row] for row in self._by_id))
+
+        self._tables = {}
+
+        for field, strings in header["tables"].items():
+            table = self._tables[field] = StringTable()
+            table.strings = strings
+            table.codes = {value: code for code, value in enumerate(strings)}
+
+        self._dead_rows = self._dead_text = 0
+        self._dates = ([], [])
+
+    def __len__(self) -> int:
+
+        return self._count
+
+    def _row(self, id: int) -> Optional[int]:
+
+        # The ids in the by_id order: bisect's key argument needs Python 3.10
+        position = bisect.bisect_left(self._sorted_ids, id)
+
+        if position < self._count and self._sorted_ids[position] == id:
+            return self._by_id[position]
+
+        return None
+
+    def _live_rows(self):
+
+        # Published catalogs are compacted
+        return iter(range(self._count))
+
+    def writable_copy(self) -> ColumnarBookStore:
+
+        store = ColumnarBookStore()
+
+        for name in ("ids", "page_counts", "alive", "title_starts", "title_lengths"):
+            getattr(store, f"_{name}").frombytes(getattr(self, f"_{name}").cast("B"))
+
+        for field in INTERNED_FIELDS:
+
+            store._codes[field].frombytes(self._codes[field].cast("B"))
+
+            table = store._tables[field]
+            table.strings = list(self._tables[field].strings)
+            table.codes = dict(self._tables[field].codes)
+
+        store._text = bytearray(self._text)
+        store._rows = {id: row for row, id in enumerate(store._ids)}
+
+        return store
+
+    def close(self) -> bool:
+
+        # False while the columns are still in use (a running query, a NumPy view)
+        try:
+
+            for view in self._views:
+                view.release()
+
+            self.segment.close()
+
+        except BufferError:
+            return False
+
+        return True
+
+
+class SharedBookStore:
+
+    # Writes wait for the other workers and republish the catalog: run them off the event loop
+    blocking_writes = True
+
+    def __init__(self, name: str, records=()) -> None:
+
+        self.name = name
+        self.lock_path = os.path.join(tempfile.gettempdir(), f"{name}.lock")
+
+        # Books of the first version, when no worker published one yet
+        self._seed = records
+
+        self._control = None
+        self._retired = []
+
+        # (version, view) mapped by this worker for the reads, all made on the event loop
+        self._mapped = (None, None)
+
+        # (version, store) published by the last write of this worker
+        self._writable = None
+
+        # Store of the batch running in this thread, the other threads read the published version
+        self._local = threading.local()
+
+        # Mappings still exported at exit make SharedMemory.__del__ complain
+        atexit.register(self.close)
+
+    @property
+    def _batch(self) -> Optional[ColumnarBookStore]:
+
+        return getattr(self._local, "batch", None)
+
+    @_batch.setter
+    def _batch(self, store: Optional[ColumnarBookStore]) -> None:
+
+        self._local.batch = store
+
+    @contextmanager
+    def _writer(self):
+
+        with open(self.lock_path, "a") as lock:
+
+            fcntl.flock(lock, fcntl.LOCK_EX)
+
+            try:
+                yield
+
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def attach(self) -> None:
+
+        # Maps the control segment, publishing the initial catalog on the first worker of the node
+        if self._control is not None:
+            return
+
+        try:
+
+            self._control = open_segment(self.name)
+            return
+
+        except FileNotFoundError:
+            pass
+
+        with self._writer():
+
+            try:
+
+                self._control = open_segment(self.name)
+
+            except FileNotFoundError:
+
+                control = open_segment(self.name, create=True, size=CONTROL.size)
+                write_catalog(f"{self.name}_1", ColumnarBookStore(self._seed))
+                CONTROL.pack_into(control.buf, 0, 1)
+                self._control = control
+
+    def _published_version(self) -> int:
+
+        self.attach()
+
+        return CONTROL.unpack_from(self._control.buf, 0)[0]
+
+    def _current(self) -> ColumnarBookStore:
+
+        # Within a batch, this thread reads its own writes
+        if self._batch is not None:
+            return self._batch
+
+        for _ in range(SEGMENT_ATTEMPTS):
+
+            version = self._published_version()
+            mapped_version, mapped = self._mapped
+
+            if version == mapped_version:
+                return mapped
+
+            try:
+                view = CatalogView(open_segment(f"{self.name}_{version}"))
+
+            except FileNotFoundError:
+
+                # Unlinked by a newer version in between, read the version again
+                continue
+
+            if mapped is not None:
+                self._retired.append(mapped)
+
+            self._retired = [old for old in self._retired if not old.close()]
+            self._mapped = (version, view)
+
+            return view
+
+        raise RuntimeError(
+            f"Segment {self.name}_{version} of the published books catalog is missing, "
+            f"restart the workers (python -m src.books.shared --unlink first)"
+        )
+
+    def _copy(self, version: int) -> ColumnarBookStore:
+
+        # Writable copy of a version, through its own mapping: the writes run in threads and
+        # must not swap the view the reads are using
+        view = CatalogView(open_segment(f"{self.name}_{version}"))
+
+        try:
+            return view.writable_copy()
+
+        finally:
+            view.close()
+
+    @contextmanager
+    def batch(self):
+
+        # Writes of the block are applied to one copy, published once at the end
+        if self._batch is not None:
+            yield
+            return
+
+        self.attach()
+
+        with self._writer():
+
+            version = self._published_version()
+
+            if self._writable is not None and self._writable[0] == version:
+                self._batch = self._writable[1]
+            else:
+                self._batch = self._copy(version)
+
+            changes = self._batch.version
+
+            try:
+
+                yield
+
+                # Nothing to publish (update or delete of a missing book)
+                if self._batch.version == changes:
+                    self._writable = (version, self._batch)
+                    return
+
+                write_catalog(f"{self.name}_{version + 1}", self._batch)
+                CONTROL.pack_into(self._control.buf, 0, version + 1)
+
+                self._writable = (version + 1, self._batch)
+
+            except BaseException:
+
+                # The copy may hold part of the failed writes
+                self._writable = None
+                raise
+
+            finally:
+                self._batch = None
+
+            unlink_segment(f"{self.name}_{version}")
+
+    def _write(self, apply):
+
+        with self.batch():
+            return apply(self._batch)
+
+    @property
+    def version(self) -> int:
+
+        # Published version, the same in every worker
+        return self._published_version()
+
+    def __len__(self) -> int:
+
+        return len(self._current())
+
+    def __contains__(self, id: int) -> bool:
+
+        return id in self._current()
+
+    def __iter__(self):
+
+        return iter(self._current())
+
+    def get(self, id: int) -> Optional[dict]:
+
+        return self._current().get(id)
+
+    def query(self, *args, **kwargs):
+
+        return self._current().query(*args, **kwargs)
+
+    def insert(self, record: dict) -> dict:
+
+        return self._write(lambda store: store.insert(record))
+
+    def update(self, id: int, changes: dict) -> Optional[dict]:
+
+        return self._write(lambda store: store.update(id, changes))
+
+    def delete(self, id: int) -> Optional[dict]:
+
+        return self._write(lambda store: store.delete(id))
+
+    def clear(self) -> None:
+
+        self._write(lambda store: store.clear())
+
+    def load(self, records) -> None:
+
+        self._write(lambda store: store.load(records))
+
+    def close(self) -> None:
+
+        for view in [self._mapped[1], *self._retired]:
+            if view is not None:
+                view.close()
+
+        if self._control is not None:
+            self._control.close()
+
+        self._control = self._writable = None
+        self._mapped = (None, None)
+        self._retired = []
+
+    def unlink(self) -> None:
+
+        version = self._published_version()
+
+        self.close()
+
+        for name in (f"{self.name}_{version}", self.name):
+            unlink_segment(name)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--unlink", action="store_true", help="Remove the shared catalog of this node")
+    args = parser.parse_args()
+
+    store = SharedBookStore(BOOKS_SHARED_NAME)
+
+    try:
+        open_segment(BOOKS_SHARED_NAME).close()
+
+    except FileNotFoundError:
+        print("No shared catalog")
+        return
+
+    if args.unlink:
+        store.unlink()
+        print("Shared catalog removed")
+    else:
+        print(f"version {store._published_version()}, {len(store)} books")
+
+
+if __name__ == "__main__":
+    main()
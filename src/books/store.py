@@ -0,0 +1,267 @@
+"""Indexed in-memory store of the books served by book_router.
+
+Records are kept in an id -> record dict, so get, update and delete by id are
+O(1). Every indexed field has a hash index (value -> set of ids), so keeping
+the indexes up to date is O(1) per write too. `page_count` and
+`published_date` (ISO dates, ordered as strings) also keep the sorted list of
+their distinct values: a range query finds its values with two binary searches
+and takes the ids of their buckets. Books share few distinct values, so a new
+value (the only O(distinct values) insert) is rare.
+
+A query reads the candidates of its most selective condition from its index
+(the smallest bucket or range) and checks the other conditions on them. A
+query without filters sorted on a range field walks that index in order and
+stops after the returned page.
+"""
+
+import bisect
+import heapq
+from itertools import islice
+from operator import itemgetter
+from typing import Iterable, Optional, Tuple
+
+from src.books.book_data import books
+from src.config import BOOKS_SHARED_NAME, BOOKS_STORE
+
+HASH_FIELDS = ("author", "language", "publisher")
+RANGE_FIELDS = ("page_count", "published_date")
+SORT_FIELDS = ("id", "title", *RANGE_FIELDS)
+
+
+class BookStore:
+
+    def __init__(self, records: Iterable[dict] = ()) -> None:
+
+        # Incremented by every write
+        self.version = 0
+
+        self._records = {}
+        self._hash = {field: {} for field in (*HASH_FIELDS, *RANGE_FIELDS)}
+
+        # Sorted distinct values of the range fields
+        self._values = {field: [] for field in RANGE_FIELDS}
+
+        self.load(records)
+
+    def __len__(self) -> int:
+
+        return len(self._records)
+
+    def __contains__(self, id: int) -> bool:
+
+        return id in self._records
+
+    def __iter__(self):
+
+        return iter(self._records.values())
+
+    def clear(self) -> None:
+
+        self.version += 1
+        self._records = {}
+        self._hash = {field: {} for field in self._hash}
+        self._values = {field: [] for field in RANGE_FIELDS}
+
+    def load(self, records: Iterable[dict]) -> None:
+
+        self.version += 1
+
+        # Bulk load: one sort per range field instead of one insort per new value
+        for record in records:
+
+            record = self._records[record["id"]] = dict(record)
+
+            for field, index in self._hash.items():
+                index.setdefault(record[field], set()).add(record["id"])
+
+        for field in RANGE_FIELDS:
+            self._values[field] = sorted(self._hash[field])
+
+    def _index(self, record: dict) -> None:
+
+        for field, index in self._hash.items():
+
+            ids = index.get(record[field])
+
+            if ids is None:
+
+                ids = index[record[field]] = set()
+
+                if field in self._values:
+                    bisect.insort(self._values[field], record[field])
+
+            ids.add(record["id"])
+
+    def _unindex(self, record: dict) -> None:
+
+        for field, index in self._hash.items():
+
+            ids = index[record[field]]
+            ids.discard(record["id"])
+
+            if ids:
+                continue
+
+            del index[record[field]]
+
+            if field in self._values:
+                values = self._values[field]
+                del values[bisect.bisect_left(values, record[field])]
+
+    def get(self, id: int) -> Optional[dict]:
+
+        return self._records.get(id)
+
+    def insert(self, record: dict) -> dict:
+
+        if record["id"] in self._records:
+            raise KeyError(record["id"])
+
+        record = dict(record)
+
+        self.version += 1
+        self._records[record["id"]] = record
+        self._index(record)
+
+        return record
+
+    def update(self, id: int, changes: dict) -> Optional[dict]:
+
+        record = self._records.get(id)
+
+        if record is None:
+            return None
+
+        self.version += 1
+        self._unindex(record)
+        record.update(changes)
+        self._index(record)
+
+        return record
+
+    def delete(self, id: int) -> Optional[dict]:
+
+        record = self._records.pop(id, None)
+
+        if record is not None:
+            self.version += 1
+            self._unindex(record)
+
+        return record
+
+    def _range_values(self, field: str, low, high) -> list:
+
+        values = self._values[field]
+
+        start = 0 if low is None else bisect.bisect_left(values, low)
+        stop = len(values) if high is None else bisect.bisect_right(values, high)
+
+        return values[start:stop]
+
+    def query(
+        self,
+        filters: dict = None,
+        ranges: dict = None,
+        sort_by: Optional[str] = None,
+        descending: bool = False,
+        offset: int = 0,
+        limit: Optional[int] = None,
+    ) -> Tuple[int, list]:
+
+        # `filters`: {hash field: value}, `ranges`: {range field: (low, high)} bounds included or None.
+        # Without sort_by the records come in insertion order (by id when filtered).
+        # Returns the number of matching records and the requested page.
+        filters = {field: value for field, value in (filters or {}).items() if value is not None}
+        ranges = {
+            field: bounds for field, bounds in (ranges or {}).items() if bounds != (None, None)
+        }
+
+        if not filters and not ranges:
+
+            if sort_by is None and not descending:
+                stop = None if limit is None else offset + limit
+                return len(self._records), list(islice(self._records.values(), offset, stop))
+
+            if sort_by in RANGE_FIELDS:
+                return len(self._records), self._walk(sort_by, descending, offset, limit)
+
+        # Start from the index giving the fewest candidates, check the other conditions on them
+        buckets = {
+            field: [self._hash[field].get(value, set())] for field, value in filters.items()
+        }
+
+        for field, (low, high) in ranges.items():
+            buckets[field] = [
+                self._hash[field][value] for value in self._range_values(field, low, high)
+            ]
+
+        if buckets:
+
+            field = min(buckets, key=lambda field: sum(map(len, buckets[field])))
+            filters.pop(field, None)
+            ranges.pop(field, None)
+
+            records = [self._records[id] for ids in buckets[field] for id in ids]
+
+        else:
+
+            records = list(self._records.values())
+
+        for field, value in filters.items():
+            records = [record for record in records if record[field] == value]
+
+        for field, (low, high) in ranges.items():
+            records = [
+                record
+                for record in records
+                if (low is None or record[field] >= low) and (high is None or record[field] <= high)
+            ]
+
+        total = len(records)
+        sort_by = sort_by or "id"
+        key = itemgetter(sort_by) if sort_by == "id" else itemgetter(sort_by, "id")
+
+        if limit is not None and offset + limit < total:
+
+            # Only the first offset + limit records have to be ordered
+            select = heapq.nlargest if descending else heapq.nsmallest
+            page = select(offset + limit, records, key=key)[offset:]
+
+        else:
+
+            page = sorted(records, key=key, reverse=descending)[offset:]
+
+        return total, page[:limit] if limit is not None else page
+
+    def _walk(self, field: str, descending: bool, offset: int, limit: Optional[int]) -> list:
+
+        # Buckets in value order, the ids of a bucket in id order
+        values = self._values[field]
+        wanted = None if limit is None else offset + limit
+        ids = []
+
+        for value in reversed(values) if descending else values:
+
+            ids.extend(sorted(self._hash[field][value], reverse=descending))
+
+            if wanted is not None and len(ids) >= wanted:
+                break
+
+        return [self._records[id] for id in ids[offset:wanted]]
+
+
+if BOOKS_STORE == "columnar":
+
+    from src.books.columnar import ColumnarBookStore
+
+    book_store = ColumnarBookStore(books)
+
+elif BOOKS_STORE == "shared":
+
+    from src.books.shared import SharedBookStore
+
+    book_store = SharedBookStore(BOOKS_SHARED_NAME, books)
+
+else:
+
+    book_store = BookStore(books)
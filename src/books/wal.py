@@ -0,0 +1,421 @@
+"""Optional persistence of the books store: write-ahead log and snapshots.
+
+Enabled by BOOKS_DATA_DIR. Every mutation of book_router is appended to the
+log of the current generation (books.<generation>.log) and only applied to the
+store, then answered, once the entry is on disk: a failed write leaves the
+store as it was. Entries arriving while a write + fsync is
+in progress are written together by the next one (group commit), so the fsync
+rate does not grow with the request rate; BOOKS_GROUP_COMMIT_MS makes the
+flusher wait for more entries first.
+
+After BOOKS_SNAPSHOT_ENTRIES entries the log moves to the next generation and
+the store is written to books.snapshot (temporary file, fsync, rename), which
+records the first generation to replay; older logs are then deleted.
+
+At startup the snapshot is loaded and the logs of its generation onwards are
+replayed, both read through mmap. A log entry is framed by its length and
+CRC32, the replay stops at the first incomplete or corrupt entry (a write
+interrupted by a crash) and the log is truncated there.
+
+The data directory belongs to one process, held by an exclusive lock on
+books.lock from the recovery to the shutdown: a second worker pointed at the
+same BOOKS_DATA_DIR refuses to start.
+"""
+
+import asyncio
+import fcntl
+import glob
+import json
+import mmap
+import os
+import struct
+import time
+import zlib
+from contextlib import asynccontextmanager, contextmanager
+from typing import Optional
+
+from src.config import BOOKS_DATA_DIR, BOOKS_GROUP_COMMIT_MS, BOOKS_SNAPSHOT_ENTRIES
+
+SNAPSHOT_NAME = "books.snapshot"
+LOCK_NAME = "books.lock"
+
+# Entry header: payload length and CRC32 of the payload
+HEADER = struct.Struct("<II")
+
+
+def log_name(generation: int) -> str:
+
+    return f"books.{generation:08d}.log"
+
+
+def encode_entry(entry: dict) -> bytes:
+
+    payload = json.dumps(entry, separators=(",", ":")).encode()
+
+    return HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+@contextmanager
+def mapped(path: str):
+
+    with open(path, "rb") as file:
+
+        # mmap can not map an empty file
+        if os.fstat(file.fileno()).st_size == 0:
+            yield b""
+            return
+
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            yield data
+
+
+def fsync_directory(path: str) -> None:
+
+    # Makes a rename in the directory durable
+    fd = os.open(path, os.O_RDONLY)
+
+    try:
+        os.fsync(fd)
+
+    finally:
+        os.close(fd)
+
+
+def snapshot_lines(data, offset: int):
+
+    # One record per line after the header
+    while offset < len(data):
+
+        end = data.find(b"\n", offset)
+
+        if end == -1:
+            end = len(data)
+
+        if end > offset:
+            yield data[offset:end]
+
+        offset = end + 1
+
+
+def read_entries(data) -> tuple:
+
+    # Complete entries of a log and the offset of the first byte after them
+    entries = []
+    offset = 0
+
+    while offset + HEADER.size <= len(data):
+
+        length, crc = HEADER.unpack_from(data, offset)
+        payload = data[offset + HEADER.size : offset + HEADER.size + length]
+
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            break
+
+        entries.append(json.loads(payload))
+        offset += HEADER.size + length
+
+    return entries, offset
+
+
+def apply_entry(store, entry: dict) -> None:
+
+    if entry["op"] == "insert":
+        store.delete(entry["record"]["id"])
+        store.insert(entry["record"])
+
+    elif entry["op"] == "update":
+        store.update(entry["id"], entry["changes"])
+
+    elif entry["op"] == "delete":
+        store.delete(entry["id"])
+
+
+class BookLog:
+
+    def __init__(self, directory: Optional[str], group_commit_ms: int = 0, snapshot_entries: int = 100000) -> None:
+
+        self.directory = directory
+        self.group_commit_wait = group_commit_ms / 1000
+        self.snapshot_entries = snapshot_entries
+
+        self.store = None
+        self.generation = 0
+        self._file = None
+        self._lock = None
+
+        # (encoded entry, future of its writer) waiting for the next flush
+        self._pending = []
+        self._wakeup = asyncio.Event()
+        self._flushing = asyncio.Lock()
+        self._snapshotting = None
+        self._since_snapshot = 0
+
+        # Book id -> (lock, number of writes holding or waiting for it)
+        self._writing = {}
+
+        self.appends = 0
+        self.fsyncs = 0
+
+    @property
+    def enabled(self) -> bool:
+
+        return self.directory is not None
+
+    def path(self, name: str) -> str:
+
+        return os.path.join(self.directory, name)
+
+    def recover(self, store) -> dict:
+
+        # Load the snapshot and replay the log tail into `store`, then open the log for appends
+        started = time.perf_counter()
+        self.store = store
+        os.makedirs(self.directory, exist_ok=True)
+        self.own_directory()
+
+        snapshot_path = self.path(SNAPSHOT_NAME)
+        replayed = 0
+
+        if os.path.exists(snapshot_path):
+
+            with mapped(snapshot_path) as data:
+
+                header_end = data.find(b"\n") + 1
+
+                store.clear()
+                store.load(json.loads(line) for line in snapshot_lines(data, header_end))
+
+                self.generation = json.loads(data[:header_end])["generation"]
+
+        elif not glob.glob(self.path("books.*.log")):
+
+            # First start: the current content of the store is the initial snapshot
+            self.write_snapshot([dict(record) for record in store], self.generation)
+
+        for path in sorted(glob.glob(self.path("books.*.log"))):
+
+            generation = int(os.path.basename(path).split(".")[1])
+
+            if generation < self.generation:
+                continue
+
+            with mapped(path) as data:
+                entries, end = read_entries(data)
+
+            for entry in entries:
+                apply_entry(store, entry)
+
+            replayed += len(entries)
+
+            if end < os.path.getsize(path):
+
+                # Torn tail of an interrupted write, never acknowledged
+                with open(path, "r+b") as file:
+                    file.truncate(end)
+
+            self.generation = max(self.generation, generation)
+
+        self._file = open(self.path(log_name(self.generation)), "ab")
+        self._since_snapshot = replayed
+
+        return {
+            "books": len(store),
+            "replayed_entries": replayed,
+            "seconds": round(time.perf_counter() - started, 3),
+        }
+
+    def own_directory(self) -> None:
+
+        # One process owns the data directory for its lifetime: another one would truncate the
+        # entries being written, remove the logs still appended to and snapshot another store
+        self._lock = open(self.path(LOCK_NAME), "a+")
+
+        try:
+            fcntl.flock(self._lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+        except BlockingIOError:
+
+            self._lock.close()
+            self._lock = None
+
+            raise RuntimeError(
+                f"{self.directory} is already used by another process, "
+                "BOOKS_DATA_DIR needs the app to run in a single worker"
+            )
+
+    def write_snapshot(self, records: list, generation: int) -> None:
+
+        temporary = self.path(SNAPSHOT_NAME + ".tmp")
+
+        with open(temporary, "wb") as file:
+
+            file.write(json.dumps({"generation": generation, "count": len(records)}).encode() + b"\n")
+
+            for record in records:
+                file.write(json.dumps(record, separators=(",", ":")).encode() + b"\n")
+
+            file.flush()
+            os.fsync(file.fileno())
+
+        os.replace(temporary, self.path(SNAPSHOT_NAME))
+        fsync_directory(self.directory)
+
+        # Logs before the snapshot generation are in the snapshot
+        for path in glob.glob(self.path("books.*.log")):
+            if int(os.path.basename(path).split(".")[1]) < generation:
+                os.remove(path)
+
+    @asynccontextmanager
+    async def writing(self, id: int):
+
+        # Writes to one book are logged then applied one after another, so the
+        # store and the log see them in the same order
+        lock, writes = self._writing.get(id, (None, 0))
+        lock = lock or asyncio.Lock()
+        self._writing[id] = (lock, writes + 1)
+
+        try:
+            async with lock:
+                yield
+
+        finally:
+
+            _, writes = self._writing[id]
+
+            if writes == 1:
+                del self._writing[id]
+            else:
+                self._writing[id] = (lock, writes - 1)
+
+    async def append(self, op: str, **fields) -> None:
+
+        # Returns once the entry is on disk
+        if not self.enabled:
+            return
+
+        future = asyncio.get_running_loop().create_future()
+
+        self._pending.append((encode_entry({"op": op, **fields}), future))
+        self._wakeup.set()
+
+        await future
+
+    def _write(self, data: bytes) -> None:
+
+        position = self._file.tell()
+
+        try:
+
+            self._file.write(data)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+        except Exception:
+
+            # A partial group would stop the replay before the entries written after it
+            self._file.truncate(position)
+            raise
+
+    async def flush(self) -> None:
+
+        async with self._flushing:
+
+            if not self._pending:
+                return
+
+            batch, self._pending = self._pending, []
+
+            try:
+
+                # In a thread, the event loop keeps serving (and queueing the next group)
+                await asyncio.to_thread(self._write, b"".join(entry for entry, _ in batch))
+
+            except Exception as e:
+
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+                return
+
+            self.appends += len(batch)
+            self.fsyncs += 1
+            self._since_snapshot += len(batch)
+
+            for _, future in batch:
+                if not future.done():
+                    future.set_result(None)
+
+        if self._since_snapshot >= self.snapshot_entries and self._snapshotting is None:
+            self._snapshotting = asyncio.create_task(self.snapshot())
+
+    async def run(self) -> None:
+
+        # Flusher, for the lifetime of the app, see life_span in src.main
+        if not self.enabled:
+            return
+
+        while True:
+
+            await self._wakeup.wait()
+
+            if self.group_commit_wait:
+                await asyncio.sleep(self.group_commit_wait)
+
+            self._wakeup.clear()
+
+            await self.flush()
+
+    async def snapshot(self) -> None:
+
+        try:
+
+            async with self._flushing:
+
+                # New entries go to the next generation, the snapshot holds everything before
+                self._file.close()
+                self.generation += 1
+                self._file = open(self.path(log_name(self.generation)), "ab")
+                self._since_snapshot = 0
+
+                # Copied in the event loop, so no mutation happens in between
+                records = [dict(record) for record in self.store]
+
+            await asyncio.to_thread(self.write_snapshot, records, self.generation)
+
+        except Exception as e:
+
+            print(f"Error occurred: {e}")
+
+        finally:
+
+            self._snapshotting = None
+
+    async def close(self) -> None:
+
+        if not self.enabled or self._file is None:
+            return
+
+        await self.flush()
+
+        if self._snapshotting is not None:
+            await self._snapshotting
+
+        self._file.close()
+
+        # Closing the file releases the lock
+        if self._lock is not None:
+            self._lock.close()
+            self._lock = None
+
+    def stats(self) -> dict:
+
+        return {
+            "generation": self.generation,
+            "appends": self.appends,
+            "fsyncs": self.fsyncs,
+            "entries_per_fsync": round(self.appends / self.fsyncs, 2) if self.fsyncs else 0.0,
+        }
+
+
+book_log = BookLog(BOOKS_DATA_DIR, BOOKS_GROUP_COMMIT_MS, BOOKS_SNAPSHOT_ENTRIES)
@@ -0,0 +1,215 @@
+"""JSON list pages written straight from the BSON documents.
+
+The list routes named in RAW_BSON_ROUTES read their books as RawBSONDocument
+(the bytes MongoDB sent, nothing decoded), with a projection of the response
+fields. BSONPageEncoder then writes the JSON body of the page in one pass over
+those bytes: strings are copied as they are unless they need escaping, numbers
+and booleans are formatted from their bytes. No dict nor Pydantic model is
+built per book. The same pass collects what the list ETag is made of (ids and
+versions).
+
+The body is the JSON the response model would send, fields in the order of the
+documents. A document holding a value the encoder does not write (embedded
+document, array, date...) in a response field is decoded and shaped like a
+trusted projection instead.
+"""
+
+import re
+import struct
+from typing import Iterable, Type
+
+import bson
+import orjson
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+from pydantic import BaseModel
+
+from src.config import RAW_BSON_ROUTES
+from src.responses import TrustedProjection
+
+# Documents left as the BSON bytes MongoDB sent
+RAW_CODEC = CodecOptions(document_class=RawBSONDocument)
+
+INT32 = struct.Struct("<i")
+INT64 = struct.Struct("<q")
+DOUBLE = struct.Struct("<d")
+
+# Bytes a JSON string must escape
+ESCAPED = re.compile(rb'["\\\x00-\x1f]')
+
+# Size of the fixed size BSON values, by type
+FIXED_SIZES = {0x01: 8, 0x07: 12, 0x08: 1, 0x09: 8, 0x0A: 0, 0x10: 4, 0x11: 8, 0x12: 8, 0x13: 16, 0x7F: 0, 0xFF: 0}
+
+
+class Unsupported(Exception):
+    pass
+
+
+class BSONPageEncoder:
+
+    def __init__(self, model: Type[BaseModel]) -> None:
+
+        self.trusted = TrustedProjection(model)
+
+        # BSON key -> (index, `"key":` prefix) of the response fields
+        self.keys = {
+            key.encode(): (index, f'"{key}":'.encode())
+            for index, (key, _) in enumerate(self.trusted.fields)
+        }
+
+        # `"key":default` of each response field, for the documents lacking it
+        self.defaults = [f'"{key}":'.encode() + orjson.dumps(default) for key, default in self.trusted.fields]
+
+        self.id_index = self.keys[b"_id"][0]
+        self.all_written = (1 << len(self.defaults)) - 1
+
+        # The ETag needs the versions
+        self.projection = {**self.trusted.projection, "version": 1}
+
+    def trusts(self, route: str) -> bool:
+
+        return route in RAW_BSON_ROUTES
+
+    def encode(self, documents: Iterable[RawBSONDocument]) -> dict:
+
+        # Page as cached by the query cache: body, number of books, list ETag input
+        body = bytearray(b"[")
+        versions = []
+
+        for document in documents:
+
+            if len(versions):
+                body += b","
+
+            mark = len(body)
+
+            try:
+                id, version = self._encode(document.raw, body)
+
+            except Unsupported:
+                del body[mark:]
+                id, version = self._decode(document.raw, body)
+
+            versions.append(f"{id}:{version};")
+
+        body += b"]"
+
+        return {
+            "body": bytes(body),
+            "count": len(versions),
+            "versions": "".join(versions),
+        }
+
+    def _encode(self, raw: bytes, body: bytearray) -> tuple:
+
+        # Appends the JSON object of one document to `body`
+        keys = self.keys
+        unpack_int32 = INT32.unpack_from
+        escaped = ESCAPED.search
+
+        # Bit i set once the response field i is written
+        written = 0
+        id, version = None, 0
+
+        body += b"{"
+        position = 4
+        end = len(raw) - 1
+
+        while position < end:
+
+            kind = raw[position]
+            key_end = raw.index(0, position + 1)
+            key = raw[position + 1 : key_end]
+            start = position = key_end + 1
+
+            if kind == 0x02:
+                position = start + 4 + unpack_int32(raw, start)[0]
+
+            elif kind in FIXED_SIZES:
+                position = start + FIXED_SIZES[kind]
+
+            elif kind in (0x03, 0x04):
+                position = start + unpack_int32(raw, start)[0]
+
+            elif kind == 0x05:
+                position = start + 5 + unpack_int32(raw, start)[0]
+
+            else:
+                raise Unsupported(kind)
+
+            field = keys.get(key)
+
+            if field is None:
+
+                if key == b"version" and kind in (0x10, 0x12):
+                    version = (INT32 if kind == 0x10 else INT64).unpack_from(raw, start)[0]
+
+                continue
+
+            index, prefix = field
+
+            if written:
+                body += b","
+
+            body += prefix
+            written |= 1 << index
+
+            if kind == 0x02:
+
+                value = raw[start + 4 : position - 1]
+
+                if escaped(value) is None:
+                    body += b'"'
+                    body += value
+                    body += b'"'
+                else:
+                    body += orjson.dumps(value.decode())
+
+                if index == self.id_index:
+                    id = value.decode()
+
+            elif kind == 0x08:
+                body += b"true" if raw[start] else b"false"
+
+            elif kind == 0x10 or kind == 0x12:
+                body += str((INT32 if kind == 0x10 else INT64).unpack_from(raw, start)[0]).encode()
+
+            elif kind == 0x0A:
+                body += b"null"
+
+            elif kind == 0x01:
+                body += orjson.dumps(DOUBLE.unpack_from(raw, start)[0])
+
+            elif kind == 0x07:
+                value = raw[start:position].hex()
+                body += b'"' + value.encode() + b'"'
+
+                if index == self.id_index:
+                    id = value
+
+            else:
+                raise Unsupported(kind)
+
+        # Defaults of the response fields the document lacks
+        if written != self.all_written:
+
+            for index, default in enumerate(self.defaults):
+
+                if not written >> index & 1:
+
+                    if written:
+                        body += b","
+
+                    body += default
+                    written |= 1 << index
+
+        body += b"}"
+
+        return id, version
+
+    def _decode(self, raw: bytes, body: bytearray) -> tuple:
+
+        document = bson.decode(raw)
+        body += orjson.dumps(self.trusted.shape(document), default=str)
+
+        return document["_id"], document.get("version", 0)
@@ -0,0 +1,109 @@
+"""HTTP conditional requests (ETag, If-None-Match, If-Match, Last-Modified).
+
+Books carry a `version`, incremented by every write, and a `modified_at` UTC
+timestamp. The ETag of a book is built from its id and version, the ETag of a
+list from the ids and versions of its books, so a 304 needs no serialization.
+
+Lists only get an ETag: the newest `modified_at` of a page does not move when
+a book leaves it (deleted, unpublished), If-Modified-Since would answer 304
+with the old page.
+"""
+
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Optional
+
+from fastapi import Request, Response, status
+
+
+def modified_at() -> str:
+
+    return datetime.now(timezone.utc).isoformat()
+
+
+def book_etag(book: dict) -> str:
+
+    return f'"{book["_id"]}-{book.get("version", 0)}"'
+
+
+def etag_version(etag: str, id: str) -> Optional[int]:
+
+    # Version of the book `id` in one of its ETags, None if the ETag is not one
+    etag = etag.strip().removeprefix("W/").strip('"')
+    book_id, _, version = etag.rpartition("-")
+
+    if book_id != id or not version.isdigit():
+        return None
+
+    return int(version)
+
+
+def list_etag(books: list, *parts: Optional[str]) -> str:
+
+    versions = "".join(f"{book['_id']}:{book.get('version', 0)};" for book in books)
+
+    return versions_etag(versions, *parts)
+
+
+def versions_etag(versions: str, *parts: Optional[str]) -> str:
+
+    # `versions` lists the "id:version;" of the books, `parts` are whatever else shapes the
+    # response (next cursor, user)
+    digest = hashlib.sha1(versions.encode())
+
+    for part in parts:
+        digest.update(f"{part or ''};".encode())
+
+    return f'"{digest.hexdigest()}"'
+
+
+def last_modified(book: dict) -> Optional[datetime]:
+
+    if not book.get("modified_at"):
+        return None
+
+    return datetime.fromisoformat(book["modified_at"])
+
+
+def is_not_modified(request: Request, etag: str, modified: Optional[datetime]) -> bool:
+
+    if_none_match = request.headers.get("if-none-match")
+
+    # If-None-Match wins over If-Modified-Since (RFC 9110)
+    if if_none_match is not None:
+
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+
+        return "*" in tags or etag in tags
+
+    if_modified_since = request.headers.get("if-modified-since")
+
+    if if_modified_since is None or modified is None:
+        return False
+
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+
+    except (TypeError, ValueError):
+        return False
+
+    return modified.replace(microsecond=0) <= since
+
+
+def conditional_response(
+    request: Request, response: Response, etag: str, modified: Optional[datetime] = None
+) -> Optional[Response]:
+
+    # Sets the validators on the response, returns a 304 to send instead if the client is up to date
+    headers = {"ETag": etag}
+
+    if modified is not None:
+        headers["Last-Modified"] = format_datetime(modified.astimezone(timezone.utc), usegmt=True)
+
+    response.headers.update(headers)
+
+    if is_not_modified(request, etag, modified):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    return None
@@ -30,6 +30,65 @@ SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES"))
 
+# In-process cache of user documents (number of users, seconds)
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 10000))
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", 60))
+
+# Password hashing pool ("process" or "thread", number of workers, max queued hashes)
+PASSWORD_HASH_EXECUTOR = os.getenv("PASSWORD_HASH_EXECUTOR", "process")
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", os.cpu_count() or 1))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", 64))
+
+# Maximum number of books in one bulk request
+BULK_MAX_BOOKS = int(os.getenv("BULK_MAX_BOOKS", 1000))
+
+# Number of books fetched per cursor batch by the export
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", 1000))
+
+# Books validated and inserted per batch by the import, and batches written at the same time
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", 1000))
+IMPORT_CONCURRENCY = int(os.getenv("IMPORT_CONCURRENCY", 4))
+IMPORT_MAX_BATCH_SIZE = int(os.getenv("IMPORT_MAX_BATCH_SIZE", 5000))
+
+# Seconds between two rebuilds of the autocomplete index
+AUTOCOMPLETE_REFRESH_SECONDS = int(os.getenv("AUTOCOMPLETE_REFRESH_SECONDS", 300))
+
+# Seconds between two full recomputations of the catalog statistics
+STATS_RECONCILE_SECONDS = int(os.getenv("STATS_RECONCILE_SECONDS", 3600))
+
+# Representation of the books store: "indexed" (dicts and hash indexes), "columnar" (compact arrays)
+# or "shared" (columnar, in shared memory segments named after BOOKS_SHARED_NAME)
+BOOKS_STORE = os.getenv("BOOKS_STORE", "indexed")
+BOOKS_SHARED_NAME = os.getenv("BOOKS_SHARED_NAME", "fastbook_books")
+
+# gzip level of the pre-encoded book list (0 to never compress it)
+BOOKS_LIST_GZIP_LEVEL = int(os.getenv("BOOKS_LIST_GZIP_LEVEL", 6))
+
+# List routes (endpoint names, comma separated) answering without response_model validation
+TRUSTED_PROJECTION_ROUTES = {
+    route.strip() for route in os.getenv("TRUSTED_PROJECTION_ROUTES", "").split(",") if route.strip()
+}
+
+# Book list routes (endpoint names, comma separated) writing their JSON straight from the BSON
+RAW_BSON_ROUTES = {
+    route.strip() for route in os.getenv("RAW_BSON_ROUTES", "").split(",") if route.strip()
+}
+
+# Persistence of the books store (directory, unset to keep it in memory only), fsync batching wait
+# and number of log entries between two snapshots
+BOOKS_DATA_DIR = os.getenv("BOOKS_DATA_DIR")
+BOOKS_GROUP_COMMIT_MS = int(os.getenv("BOOKS_GROUP_COMMIT_MS", 0))
+BOOKS_SNAPSHOT_ENTRIES = int(os.getenv("BOOKS_SNAPSHOT_ENTRIES", 100000))
+
+# Lookups by id batched in one $in query (ids per query, milliseconds waited for more ids)
+LOOKUP_BATCH_MAX_SIZE = int(os.getenv("LOOKUP_BATCH_MAX_SIZE", 100))
+LOOKUP_BATCH_MAX_WAIT_MS = int(os.getenv("LOOKUP_BATCH_MAX_WAIT_MS", 0))
+
+# Redis database of the list query cache, seconds an entry is fresh then may be served stale
+QUERY_CACHE_REDIS_DB = int(os.getenv("QUERY_CACHE_REDIS_DB", 1))
+QUERY_CACHE_FRESH_SECONDS = int(os.getenv("QUERY_CACHE_FRESH_SECONDS", 5))
+QUERY_CACHE_STALE_SECONDS = int(os.getenv("QUERY_CACHE_STALE_SECONDS", 60))
+
 
 REDIS_HOST = os.getenv("REDIS_HOST")
 REDIS_PORT = os.getenv("REDIS_PORT")
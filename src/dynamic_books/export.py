@@ -0,0 +1,44 @@
+import csv
+import io
+import json
+
+from src.dynamic_books.schemas import EXPORT_FIELDS
+
+# Rows are sent in chunks of about this size instead of one write per book
+CHUNK_SIZE = 64 * 1024
+
+
+async def ndjson_chunks(books):
+
+    buffer = io.StringIO()
+
+    async for book in books:
+
+        buffer.write(json.dumps(book, default=str))
+        buffer.write("\n")
+
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+
+    yield buffer.getvalue()
+
+
+async def csv_chunks(books):
+
+    buffer = io.StringIO()
+
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS, extrasaction="ignore")
+    writer.writeheader()
+
+    async for book in books:
+
+        writer.writerow(book)
+
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+
+    yield buffer.getvalue()
@@ -0,0 +1,382 @@
+"""Batched import of books from NDJSON or CSV.
+
+Rows are parsed as they arrive, validated against Book in batches and written
+with unordered insert_many, at most `concurrency` batches in flight. The
+checkpoint is the last line number up to which every row has been handled, so
+an interrupted import resumes with `start_line=checkpoint`. On a failure the
+batches already sent are waited for first, the import route reports the
+checkpoint as `resume_from` in its error.
+
+    python -m src.dynamic_books.importer books.ndjson --publisher-user-id <user id>
+"""
+
+import argparse
+import asyncio
+import csv
+import json
+import re
+import time
+from collections import deque
+
+from pydantic import ValidationError
+from pymongo.errors import BulkWriteError
+
+from src.config import db, IMPORT_BATCH_SIZE, IMPORT_CONCURRENCY
+from src.dynamic_books.schemas import Book
+from src.dynamic_books.services import new_book_document, track_books
+
+# Only the first errors are reported in detail, the others are counted
+MAX_REPORTED_ERRORS = 1000
+
+# A quote opening a field, and the rest of a quoted field up to its closing quote (csv excel dialect)
+QUOTE_OPENING = re.compile(r'(?:^|,)"')
+QUOTED_REST = re.compile(r'(?:[^"]|"")*')
+
+
+async def byte_lines(chunks):
+
+    pending = b""
+
+    async for chunk in chunks:
+
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+
+        for line in lines:
+            yield line.decode("utf-8")
+
+    if pending:
+        yield pending.decode("utf-8")
+
+
+async def file_lines(path: str):
+
+    with open(path, encoding="utf-8") as file:
+
+        for line in file:
+            yield line
+
+
+class LineFeed:
+
+    # Iterator the csv reader pulls lines from: refilled between rows, so it may run dry and go on
+    def __init__(self) -> None:
+
+        self.lines = deque()
+
+    def __iter__(self):
+
+        return self
+
+    def __next__(self) -> str:
+
+        if not self.lines:
+            raise StopIteration
+
+        return self.lines.popleft()
+
+
+def ends_quoted(line: str, quoted: bool) -> bool:
+
+    # Whether a quoted field is still open at the end of `line`
+    position = 0
+
+    while True:
+
+        if quoted:
+
+            position = QUOTED_REST.match(line, position).end()
+
+            if position == len(line):
+                return True
+
+            position += 1
+            quoted = False
+
+        else:
+
+            opening = QUOTE_OPENING.search(line, position)
+
+            if opening is None:
+                return False
+
+            position = opening.end()
+            quoted = True
+
+
+async def csv_rows(lines):
+
+    # One reader for the whole stream, asked for a row once the lines of a whole record are fed
+    # (a quoted field may hold newlines); reader.line_num is the last line of the row
+    feed = LineFeed()
+    reader = csv.reader(feed)
+    quoted = False
+
+    async for line in lines:
+
+        line = line.rstrip("\r\n")
+        feed.lines.append(line + "\n")
+
+        if quoted or '"' in line:
+            quoted = ends_quoted(line, quoted)
+
+        if quoted:
+            continue
+
+        yield reader.line_num + len(feed.lines), next(reader)
+
+    # Quoted field never closed
+    if feed.lines:
+
+        line_number = reader.line_num + len(feed.lines)
+        yield line_number, csv.Error(f"unexpected end of data in the row ending at line {line_number}")
+
+
+async def parse_rows(lines, format: str):
+
+    # Yields (line number, row), line numbers start at 1 and count the CSV header
+    if format == "csv":
+
+        header = None
+
+        async for line_number, values in csv_rows(lines):
+
+            if isinstance(values, csv.Error):
+                yield line_number, values
+                continue
+
+            # Blank line
+            if len(values) <= 1 and not "".join(values).strip():
+                continue
+
+            if header is None:
+                header = values
+                continue
+
+            yield line_number, dict(zip(header, values))
+
+        return
+
+    line_number = 0
+
+    async for line in lines:
+
+        line_number += 1
+        line = line.rstrip("\r\n")
+
+        if not line.strip():
+            continue
+
+        try:
+            yield line_number, json.loads(line)
+
+        except ValueError as e:
+            yield line_number, e
+
+
+class BookImporter:
+
+    def __init__(
+        self,
+        current_user,
+        batch_size: int = IMPORT_BATCH_SIZE,
+        concurrency: int = IMPORT_CONCURRENCY,
+        start_line: int = 0,
+        on_checkpoint=None,
+    ) -> None:
+
+        self.current_user = current_user
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.start_line = start_line
+        self.on_checkpoint = on_checkpoint
+
+        self.checkpoint = start_line
+        self.batch_failed = False
+        self.processed = 0
+        self.inserted = 0
+        self.failed = 0
+        self.errors = []
+
+    def add_error(self, line_number: int, error: str) -> None:
+
+        self.failed += 1
+
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"line": line_number, "error": error})
+
+    async def write_batch(self, batch: list) -> int:
+
+        documents = []
+        line_numbers = []
+
+        for line_number, row in batch:
+
+            if isinstance(row, csv.Error):
+                self.add_error(line_number, f"Invalid CSV: {row}")
+                continue
+
+            if isinstance(row, Exception):
+                self.add_error(line_number, f"Invalid JSON: {row}")
+                continue
+
+            try:
+                book = Book(**row)
+
+            except (ValidationError, TypeError) as e:
+                self.add_error(line_number, str(e))
+                continue
+
+            documents.append(new_book_document(book, self.current_user))
+            line_numbers.append(line_number)
+
+        failed = set()
+
+        if documents:
+
+            try:
+
+                await db["books"].insert_many(documents, ordered=False)
+
+            except BulkWriteError as e:
+
+                for error in e.details["writeErrors"]:
+                    failed.add(error["index"])
+                    self.add_error(line_numbers[error["index"]], error["errmsg"])
+
+        inserted = [book for index, book in enumerate(documents) if index not in failed]
+
+        if inserted:
+            await track_books([None] * len(inserted), inserted)
+
+        self.inserted += len(inserted)
+
+        return batch[-1][0]
+
+    async def advance(self, task: asyncio.Task) -> None:
+
+        try:
+            self.checkpoint = await task
+
+        except Exception:
+            self.batch_failed = True
+            raise
+
+        if self.on_checkpoint is not None:
+            self.on_checkpoint(self.checkpoint)
+
+    async def settle(self, in_flight: deque) -> None:
+
+        # After a failed batch the checkpoint stays before it
+        while in_flight and not self.batch_failed:
+
+            try:
+                await self.advance(in_flight.popleft())
+
+            except Exception:
+                pass
+
+        await asyncio.gather(*in_flight, return_exceptions=True)
+
+    async def run(self, lines, format: str = "ndjson") -> dict:
+
+        started = time.perf_counter()
+
+        # Batches in flight, oldest first, so the checkpoint only moves forward
+        in_flight = deque()
+        batch = []
+
+        try:
+
+            async for line_number, row in parse_rows(lines, format):
+
+                if line_number <= self.start_line:
+                    continue
+
+                self.processed += 1
+                batch.append((line_number, row))
+
+                if len(batch) < self.batch_size:
+                    continue
+
+                in_flight.append(asyncio.create_task(self.write_batch(batch)))
+                batch = []
+
+                # Backpressure: stop reading until the oldest batch is written
+                if len(in_flight) >= self.concurrency:
+                    await self.advance(in_flight.popleft())
+
+            if batch:
+                in_flight.append(asyncio.create_task(self.write_batch(batch)))
+
+            while in_flight:
+                await self.advance(in_flight.popleft())
+
+        except BaseException:
+
+            # The checkpoint covers the batches written before the failure, so the import can
+            # resume from it; the ones after a failed batch are waited for, not counted
+            await self.settle(in_flight)
+            raise
+
+        elapsed = time.perf_counter() - started
+
+        return {
+            "processed": self.processed,
+            "inserted": self.inserted,
+            "failed": self.failed,
+            "errors": self.errors,
+            "checkpoint": self.checkpoint,
+            "elapsed_seconds": round(elapsed, 3),
+            "docs_per_second": round(self.inserted / elapsed, 1) if elapsed else 0.0,
+        }
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("path")
+    parser.add_argument("--publisher-user-id", required=True)
+    parser.add_argument("--format", choices=["ndjson", "csv"])
+    parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE)
+    parser.add_argument("--concurrency", type=int, default=IMPORT_CONCURRENCY)
+    parser.add_argument("--checkpoint", help="File keeping the last imported line, to resume")
+    args = parser.parse_args()
+
+    format = args.format or ("csv" if args.path.endswith(".csv") else "ndjson")
+
+    start_line = 0
+
+    if args.checkpoint:
+
+        try:
+            with open(args.checkpoint) as file:
+                start_line = int(file.read().strip() or 0)
+
+        except FileNotFoundError:
+            pass
+
+    def save_checkpoint(line_number: int) -> None:
+
+        if args.checkpoint:
+            with open(args.checkpoint, "w") as file:
+                file.write(str(line_number))
+
+    importer = BookImporter(
+        {"_id": args.publisher_user_id, "role": "admin"},
+        batch_size=args.batch_size,
+        concurrency=args.concurrency,
+        start_line=start_line,
+        on_checkpoint=save_checkpoint,
+    )
+
+    report = asyncio.run(importer.run(file_lines(args.path), format))
+
+    for error in report.pop("errors"):
+        print(f"line {error['line']}: {error['error']}")
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,24 @@
-from fastapi import APIRouter, Depends, status
+from fastapi import APIRouter, Depends, Header, Query, Request, Response, status
 from fastapi.exceptions import HTTPException
-from typing import List
-
-from fastapi.responses import JSONResponse
-
-from src.dynamic_books.schemas import Book, BookResponse
-from src.dynamic_books.services import BookServices
+from typing import List, Literal, Optional
+
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from src.dynamic_books.schemas import Book, BookResponse, BulkBookIds, BulkResponse
+from src.dynamic_books.services import BookServices, book_page_encoder
+from src.dynamic_books.export import csv_chunks, ndjson_chunks
+from src.dynamic_books.importer import BookImporter, byte_lines
+from src.pagination import NEXT_CURSOR_HEADER, CreatedOrder, DeletedOrder
+from src.conditional import (
+    book_etag,
+    conditional_response,
+    etag_version,
+    last_modified,
+    list_etag,
+    versions_etag,
+)
+from src.config import BULK_MAX_BOOKS, EXPORT_BATCH_SIZE, IMPORT_BATCH_SIZE, IMPORT_MAX_BATCH_SIZE
+from src.responses import TrustedProjection
 
 from src.user.dependencies import AccessTokenBearer, RoleChecker
 from src.user.utils import get_current_user
@@ -16,6 +29,43 @@ role_checker = Depends(RoleChecker(["admin", "user"]))
 
 dynamic_book_router = APIRouter(tags=["CRUD on Book with DataBase"])
 
+# Book lists sent without response_model validation by the trusted routes
+trusted_books = TrustedProjection(BookResponse)
+
+
+# A list of books, as the response model of the route would send it
+def book_list(route: str, books: list, response: Response):
+
+    if trusted_books.trusts(route):
+        return trusted_books.response(books, response)
+
+    return books
+
+
+# A raw page of books (RAW_BSON_ROUTES), sent as it was encoded from the BSON documents
+def raw_book_list(request: Request, response: Response, page: dict, next_cursor, *etag_parts):
+
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+
+    etag = versions_etag(page["versions"], next_cursor, *etag_parts)
+    not_modified = conditional_response(request, response, etag)
+
+    if not_modified is not None:
+        return not_modified
+
+    return Response(page["body"], media_type="application/json", headers=dict(response.headers))
+
+
+# Refuse bulk requests over BULK_MAX_BOOKS books
+def check_bulk_size(count: int) -> None:
+
+    if count > BULK_MAX_BOOKS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"A bulk request is limited to {BULK_MAX_BOOKS} books",
+        )
+
 
 # Get all books (published and un published) limit to 10 per page and order by created date
 @dynamic_book_router.get(
@@ -25,14 +75,39 @@ dynamic_book_router = APIRouter(tags=["CRUD on Book with DataBase"])
     dependencies=[Depends(RoleChecker(["admin"]))],
 )
 async def get_all_books(
+    request: Request,
+    response: Response,
     limit: int = 10,
-    order_by: str = "created_at",
+    order_by: CreatedOrder = "created_at",
+    cursor: Optional[str] = None,
     user_details=Depends(access_token_bearer),
     current_user=Depends(get_current_user),
 ):
 
     try:
-        books = await book_services.get_all_books(limit, order_by)
+        # Admins may get the raw page, users only see their books out of it
+        if book_page_encoder.trusts("get_all_books") and current_user["role"] == "admin":
+
+            page, next_cursor = await book_services.get_all_books(limit, order_by, cursor, raw=True)
+
+            if not page["count"]:
+                return JSONResponse(
+                    status_code=status.HTTP_200_OK,
+                    content={"message": "No book published yet"},
+                )
+
+            return raw_book_list(request, response, page, next_cursor, current_user["_id"])
+
+        books, next_cursor = await book_services.get_all_books(limit, order_by, cursor)
+
+        if next_cursor:
+            response.headers[NEXT_CURSOR_HEADER] = next_cursor
+
+        etag = list_etag(books, next_cursor, current_user["_id"])
+        not_modified = conditional_response(request, response, etag)
+
+        if not_modified is not None:
+            return not_modified
 
         result = []
 
@@ -40,7 +115,7 @@ async def get_all_books(
 
             if books:
 
-                return books
+                return book_list("get_all_books", books, response)
 
             return JSONResponse(
                 status_code=status.HTTP_200_OK,
@@ -62,7 +137,12 @@ async def get_all_books(
                         content={"message": "No book published by you"},
                     )
 
-                return result
+                return book_list("get_all_books", result, response)
+
+    except HTTPException:
+
+        # 400 on an invalid cursor
+        raise
 
     except Exception as e:
 
@@ -140,15 +220,44 @@ async def publish_a_book(
     dependencies=[role_checker],
 )
 async def get_all_published_books(
+    request: Request,
+    response: Response,
     limit: int = 10,
-    order_by: str = "created_at",
+    order_by: CreatedOrder = "created_at",
+    cursor: Optional[str] = None,
     user_details=Depends(access_token_bearer),
     current_user=Depends(get_current_user),
 ):
 
     try:
 
-        published_books = await book_services.get_all_published_books(limit, order_by)
+        # Admins may get the raw page, users only see their books out of it
+        if book_page_encoder.trusts("get_all_published_books") and current_user["role"] == "admin":
+
+            page, next_cursor = await book_services.get_all_published_books(
+                limit, order_by, cursor, raw=True
+            )
+
+            if not page["count"]:
+                return JSONResponse(
+                    status_code=status.HTTP_200_OK,
+                    content={"message": "No book published yet"},
+                )
+
+            return raw_book_list(request, response, page, next_cursor, current_user["_id"])
+
+        published_books, next_cursor = await book_services.get_all_published_books(
+            limit, order_by, cursor
+        )
+
+        if next_cursor:
+            response.headers[NEXT_CURSOR_HEADER] = next_cursor
+
+        etag = list_etag(published_books, next_cursor, current_user["_id"])
+        not_modified = conditional_response(request, response, etag)
+
+        if not_modified is not None:
+            return not_modified
 
         result = []
 
@@ -156,7 +265,7 @@ async def get_all_published_books(
 
             if published_books:
 
-                return published_books
+                return book_list("get_all_published_books", published_books, response)
 
             return JSONResponse(
                 status_code=status.HTTP_200_OK,
@@ -178,7 +287,12 @@ async def get_all_published_books(
                         content={"message": "No book published by you"},
                     )
 
-                return result
+                return book_list("get_all_published_books", result, response)
+
+    except HTTPException:
+
+        # 400 on an invalid cursor
+        raise
 
     except Exception as e:
 
@@ -227,21 +341,44 @@ async def unpublish_a_book(
     dependencies=[role_checker],
 )
 async def get_unpublished_books(
+    request: Request,
+    response: Response,
     limit: int = 10,
-    order_by: str = "created_at",
+    order_by: CreatedOrder = "created_at",
+    cursor: Optional[str] = None,
     user_details=Depends(access_token_bearer),
     current_user=Depends(get_current_user),
 ):
 
     try:
 
-        unpub_books = await book_services.get_unpublished_books(limit, order_by)
+        # Admins may get the raw page, users only see their books out of it
+        if book_page_encoder.trusts("get_unpublished_books") and current_user["role"] == "admin":
+
+            page, next_cursor = await book_services.get_unpublished_books(
+                limit, order_by, cursor, raw=True
+            )
+
+            return raw_book_list(request, response, page, next_cursor, current_user["_id"])
+
+        unpub_books, next_cursor = await book_services.get_unpublished_books(
+            limit, order_by, cursor
+        )
+
+        if next_cursor:
+            response.headers[NEXT_CURSOR_HEADER] = next_cursor
+
+        etag = list_etag(unpub_books, next_cursor, current_user["_id"])
+        not_modified = conditional_response(request, response, etag)
+
+        if not_modified is not None:
+            return not_modified
 
         result = []
 
         if current_user["role"] == "admin":
 
-            return unpub_books
+            return book_list("get_unpublished_books", unpub_books, response)
 
         elif current_user["role"] == "user":
 
@@ -258,7 +395,12 @@ async def get_unpublished_books(
                         content={"message": "No book unpublished by you"},
                     )
 
-                return result
+                return book_list("get_unpublished_books", result, response)
+
+    except HTTPException:
+
+        # 400 on an invalid cursor
+        raise
 
     except Exception as e:
 
@@ -307,17 +449,177 @@ async def delete_a_book(
     dependencies=[Depends(RoleChecker(["admin"]))],
 )
 async def get_deleted_books(
+    request: Request,
+    response: Response,
     limit: int = 10,
-    order_by: str = "deleted_at",
+    order_by: DeletedOrder = "deleted_at",
+    cursor: Optional[str] = None,
     user_details=Depends(access_token_bearer),
     current_user=Depends(get_current_user),
 ):
 
     try:
 
-        books = await book_services.get_deleted_books(limit, order_by)
+        if book_page_encoder.trusts("get_deleted_books"):
+
+            page, next_cursor = await book_services.get_deleted_books(
+                limit, order_by, cursor, raw=True
+            )
+
+            return raw_book_list(request, response, page, next_cursor)
+
+        books, next_cursor = await book_services.get_deleted_books(limit, order_by, cursor)
 
-        return books
+        if next_cursor:
+            response.headers[NEXT_CURSOR_HEADER] = next_cursor
+
+        etag = list_etag(books, next_cursor)
+        not_modified = conditional_response(request, response, etag)
+
+        if not_modified is not None:
+            return not_modified
+
+        return book_list("get_deleted_books", books, response)
+
+    except HTTPException:
+
+        # 400 on an invalid cursor, 404 without any deleted book
+        raise
+
+    except Exception as e:
+
+        print(f"Error occurred: {e}")
+
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Internal server error: {str(e)}",
+        )
+
+
+# Export books as NDJSON or CSV, streamed from the database
+@dynamic_book_router.get(
+    "/export",
+    response_description="Export books",
+    dependencies=[Depends(RoleChecker(["admin"]))],
+)
+async def export_books(
+    format: Literal["ndjson", "csv"] = "ndjson",
+    book_status: Optional[bool] = Query(None, alias="status"),
+    delete_status: Optional[bool] = None,
+    deleted_by_admin: Optional[bool] = None,
+    user_details=Depends(access_token_bearer),
+):
+
+    filters = {
+        "status": book_status,
+        "delete_status": delete_status,
+        "deleted_by_admin": deleted_by_admin,
+    }
+
+    query = {key: value for key, value in filters.items() if value is not None}
+
+    books = book_services.export_books(query, EXPORT_BATCH_SIZE)
+
+    if format == "csv":
+
+        return StreamingResponse(
+            csv_chunks(books),
+            media_type="text/csv",
+            headers={"Content-Disposition": 'attachment; filename="books.csv"'},
+        )
+
+    return StreamingResponse(
+        ndjson_chunks(books),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="books.ndjson"'},
+    )
+
+
+# Catalog statistics by admin
+@dynamic_book_router.get(
+    "/stats",
+    response_description="Get catalog statistics",
+    dependencies=[Depends(RoleChecker(["admin"]))],
+)
+async def get_stats(user_details=Depends(access_token_bearer)):
+
+    try:
+
+        return await book_services.get_stats()
+
+    except Exception as e:
+
+        print(f"Error occurred: {e}")
+
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Internal server error: {str(e)}",
+        )
+
+
+# List query cache counters by admin
+@dynamic_book_router.get(
+    "/cache_stats",
+    response_description="Get list query cache statistics",
+    dependencies=[Depends(RoleChecker(["admin"]))],
+)
+async def get_cache_stats(user_details=Depends(access_token_bearer)):
+
+    return book_services.get_cache_stats()
+
+
+# Complete a book title or author name
+@dynamic_book_router.get(
+    "/autocomplete",
+    response_description="Autocomplete titles and authors",
+    dependencies=[role_checker],
+)
+async def autocomplete(
+    q: str = Query(..., min_length=1),
+    kind: Optional[Literal["title", "author"]] = None,
+    limit: int = Query(10, ge=1, le=50),
+    user_details=Depends(access_token_bearer),
+):
+
+    return book_services.autocomplete(q, limit, kind)
+
+
+# Search published books
+@dynamic_book_router.get(
+    "/search",
+    response_description="Search books",
+    response_model=List[BookResponse],
+    dependencies=[role_checker],
+)
+async def search_books(
+    response: Response,
+    q: str = Query(..., min_length=1),
+    language: Optional[str] = None,
+    min_pages: Optional[int] = None,
+    max_pages: Optional[int] = None,
+    limit: int = 10,
+    cursor: Optional[str] = None,
+    user_details=Depends(access_token_bearer),
+):
+
+    try:
+
+        # Trusted, the pipeline only returns the fields of the response model
+        projection = trusted_books.projection if trusted_books.trusts("search_books") else None
+
+        books, next_cursor = await book_services.search_books(
+            q, language, min_pages, max_pages, limit, cursor, projection
+        )
+
+        if next_cursor:
+            response.headers[NEXT_CURSOR_HEADER] = next_cursor
+
+        return book_list("search_books", books, response)
+
+    except HTTPException:
+
+        # 400 on an invalid cursor
+        raise
 
     except Exception as e:
 
@@ -338,6 +640,8 @@ async def get_deleted_books(
 )
 async def get_a_book(
     id: str,
+    request: Request,
+    response: Response,
     user_details=Depends(access_token_bearer),
     current_user=Depends(get_current_user),
 ):
@@ -348,6 +652,13 @@ async def get_a_book(
 
         if (current_user == book["publisher_user_id"]) or (current_user["role"] == "admin"):
 
+            not_modified = conditional_response(
+                request, response, book_etag(book), last_modified(book)
+            )
+
+            if not_modified is not None:
+                return not_modified
+
             return book
         
         else:
@@ -377,16 +688,45 @@ async def get_a_book(
 async def update_book(
     id: str,
     book_data: Book,
+    response: Response,
+    if_match: Optional[str] = Header(None),
     user_details=Depends(access_token_bearer),
     current_user=Depends(get_current_user),
 ):
 
+    version = None
+
+    if if_match is not None and if_match.strip() != "*":
+
+        version = etag_version(if_match, id)
+
+        if version is None:
+            raise HTTPException(
+                status_code=status.HTTP_412_PRECONDITION_FAILED,
+                detail="If-Match is not an ETag of this book",
+            )
+
     try:
 
-        book = await book_services.update_book(id, book_data, current_user)
+        book = await book_services.update_book(id, book_data, current_user, version)
+
+        response.headers["ETag"] = book_etag(book)
 
         return book
 
+    except HTTPException as e:
+
+        # Keep 404 and 412, the client acts on them
+        if e.status_code in (status.HTTP_404_NOT_FOUND, status.HTTP_412_PRECONDITION_FAILED):
+            raise
+
+        print(f"Error occurred: {e}")
+
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Internal server error: {str(e)}",
+        )
+
     except Exception as e:
 
         print(f"Error occurred: {e}")
@@ -405,14 +745,26 @@ async def update_book(
     dependencies=[Depends(RoleChecker(["admin"]))],
 )
 async def get_user_books(
+    request: Request,
+    response: Response,
     access_token=Depends(AccessTokenBearer()),
     id: str = "User ID",
     limit: int = 10,
-    order_by: str = "created_at",
+    order_by: CreatedOrder = "created_at",
+    cursor: Optional[str] = None,
 ):
 
     try:
-        books = await book_services.get_user_books(id, limit, order_by)
+        books, next_cursor = await book_services.get_user_books(id, limit, order_by, cursor)
+
+        if next_cursor:
+            response.headers[NEXT_CURSOR_HEADER] = next_cursor
+
+        etag = list_etag(books, next_cursor)
+        not_modified = conditional_response(request, response, etag)
+
+        if not_modified is not None:
+            return not_modified
 
         if not books:
             raise HTTPException(
@@ -420,7 +772,12 @@ async def get_user_books(
                 detail="No books found for this user.",
             )
 
-        return books
+        return book_list("get_user_books", books, response)
+
+    except HTTPException:
+
+        # 400 on an invalid cursor, 404 without any book of the user
+        raise
 
     except Exception as e:
 
@@ -455,3 +812,183 @@ async def hard_delete_book(id: str, user_details=Depends(access_token_bearer)):
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Internal server error: {str(e)}",
         )
+
+
+# Create many books
+@dynamic_book_router.post(
+    "/bulk",
+    response_description="Create many books",
+    response_model=BulkResponse,
+    dependencies=[role_checker],
+)
+async def create_books(
+    books_data: List[Book],
+    user_details=Depends(access_token_bearer),
+    current_user=Depends(get_current_user),
+):
+
+    check_bulk_size(len(books_data))
+
+    try:
+
+        return await book_services.create_books(books_data, current_user)
+
+    except Exception as e:
+
+        print(f"Error occurred: {e}")
+
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Internal server error: {str(e)}",
+        )
+
+
+# Publish many books
+@dynamic_book_router.patch(
+    "/bulk/publish",
+    response_description="Publish many books",
+    response_model=BulkResponse,
+    dependencies=[role_checker],
+)
+async def publish_books(
+    books: BulkBookIds,
+    user_details=Depends(access_token_bearer),
+    current_user=Depends(get_current_user),
+):
+
+    check_bulk_size(len(books.ids))
+
+    try:
+
+        return await book_services.publish_books(books.ids, current_user)
+
+    except Exception as e:
+
+        print(f"Error occurred: {e}")
+
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Internal server error: {str(e)}",
+        )
+
+
+# Unpublish many books
+@dynamic_book_router.patch(
+    "/bulk/unpublish",
+    response_description="Unpublish many books",
+    response_model=BulkResponse,
+    dependencies=[role_checker],
+)
+async def unpublish_books(
+    books: BulkBookIds,
+    user_details=Depends(access_token_bearer),
+    current_user=Depends(get_current_user),
+):
+
+    check_bulk_size(len(books.ids))
+
+    try:
+
+        return await book_services.unpublish_books(books.ids, current_user)
+
+    except Exception as e:
+
+        print(f"Error occurred: {e}")
+
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Internal server error: {str(e)}",
+        )
+
+
+# Soft Delete of many books
+@dynamic_book_router.patch(
+    "/bulk/delete",
+    response_description="Delete many books",
+    response_model=BulkResponse,
+    dependencies=[role_checker],
+)
+async def delete_books(
+    books: BulkBookIds,
+    user_details=Depends(access_token_bearer),
+    current_user=Depends(get_current_user),
+):
+
+    check_bulk_size(len(books.ids))
+
+    try:
+
+        return await book_services.delete_books(books.ids, current_user)
+
+    except Exception as e:
+
+        print(f"Error occurred: {e}")
+
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Internal server error: {str(e)}",
+        )
+
+
+# Hard Delete many books
+@dynamic_book_router.post(
+    "/bulk/hard_delete",
+    response_description="Hard Delete many books",
+    response_model=BulkResponse,
+    dependencies=[Depends(RoleChecker(["admin"]))],
+)
+async def hard_delete_books(
+    books: BulkBookIds, user_details=Depends(access_token_bearer)
+):
+
+    check_bulk_size(len(books.ids))
+
+    try:
+
+        return await book_services.hard_delete_books(books.ids)
+
+    except Exception as e:
+
+        print(f"Error occurred: {e}")
+
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Internal server error: {str(e)}",
+        )
+
+
+# Import books from an NDJSON or CSV request body
+@dynamic_book_router.post(
+    "/import",
+    response_description="Import books",
+    dependencies=[role_checker],
+)
+async def import_books(
+    request: Request,
+    format: Literal["ndjson", "csv"] = "ndjson",
+    batch_size: int = Query(IMPORT_BATCH_SIZE, ge=1, le=IMPORT_MAX_BATCH_SIZE),
+    resume_from: int = Query(0, ge=0),
+    user_details=Depends(access_token_bearer),
+    current_user=Depends(get_current_user),
+):
+
+    importer = BookImporter(current_user, batch_size=batch_size, start_line=resume_from)
+
+    try:
+
+        # The body is parsed while it is received, never loaded at once
+        return await importer.run(byte_lines(request.stream()), format)
+
+    except Exception as e:
+
+        print(f"Error occurred: {e}")
+
+        # Sending the file again with resume_from continues the import
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail={
+                "message": f"Internal server error: {str(e)}",
+                "resume_from": importer.checkpoint,
+                "inserted": importer.inserted,
+            },
+        )
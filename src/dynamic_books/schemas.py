@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import List, Optional
 from uuid import uuid4
 from bson import ObjectId
 from pydantic import BaseModel, Field
@@ -90,3 +90,37 @@ class BookResponse(BaseModel):
                 "updated_by_admin_at": "The timestamp when the item was updated by an admin."
             }
         }
+
+
+# Bulk operations on existing books
+class BulkBookIds(BaseModel):
+    ids: List[str] = Field(...)
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "ids": ["The ID of a book", "The ID of another book"],
+            }
+        }
+
+
+# Result of one item of a bulk operation
+class BulkItemResult(BaseModel):
+    index: int
+    id: Optional[str] = None
+    status: str
+    error: Optional[str] = None
+
+
+# Result of a bulk operation
+class BulkResponse(BaseModel):
+    requested: int
+    succeeded: int
+    failed: int
+    results: List[BulkItemResult]
+
+
+# Columns of the books export, in BookResponse order
+EXPORT_FIELDS = [
+    "_id" if field == "id" else field for field in BookResponse.model_fields
+]
@@ -1,433 +1,560 @@
+import asyncio
+import uuid
 from fastapi import Depends, status
 from fastapi.exceptions import HTTPException
 from fastapi.encoders import jsonable_encoder
 from datetime import datetime, timezone
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError
+
+from src.dynamic_books.schemas import Book, BookResponse, EXPORT_FIELDS
+from src.config import db, LOOKUP_BATCH_MAX_SIZE, LOOKUP_BATCH_MAX_WAIT_MS
+from src.batch_loader import BatchLoader
+from src.bson_json import RAW_CODEC, BSONPageEncoder
+from src.pagination import encode_cursor, keyset_query, keyset_sort, paginate
+from src.conditional import modified_at
+from src.query_cache import book_tags, query_cache
+from src.single_flight import single_flight
+from src.dynamic_books.autocomplete import book_autocomplete
+from src.dynamic_books.stats import apply_delta, get_stats as get_catalog_stats
+
+
+# Books looked up by id by concurrent requests are read together (not deleted ones only)
+book_loader = BatchLoader(
+    db["books"],
+    {"delete_status": False, "deleted_by_admin": False},
+    max_batch_size=LOOKUP_BATCH_MAX_SIZE,
+    max_wait=LOOKUP_BATCH_MAX_WAIT_MS / 1000,
+)
+
+
+# JSON pages of books written from the BSON documents, see src.bson_json
+book_page_encoder = BSONPageEncoder(BookResponse)
+raw_books = db["books"].with_options(codec_options=RAW_CODEC)
+
+
+# A page of books as JSON bytes, cached and shared by concurrent callers like the decoded pages
+async def raw_books_page(endpoint: str, params: dict, tag: str, query: dict) -> tuple:
+
+    async def load():
+
+        documents, next_cursor = await paginate(
+            raw_books,
+            query,
+            params["order_by"],
+            params["limit"],
+            params["cursor"],
+            book_page_encoder.projection,
+        )
 
-from src.dynamic_books.schemas import Book, BookResponse
-from src.config import db
+        return book_page_encoder.encode(documents), next_cursor
 
+    # The tag as namespace: a write to the books of the tag forgets the page in flight
+    return await single_flight.do(
+        (tag, endpoint, *params.values()),
+        lambda: query_cache.get_or_load(f"{endpoint}:raw", params, [tag], load),
+    )
 
-class BookServices:
 
-    # Get all books (published and un published) limit to 10 per page and order by created date
-    async def get_all_books(limit: int = 10, order_by: str = "created_at"):
+# Build a new book document owned by the current user
+def new_book_document(book_data: Book, current_user) -> dict:
 
-        books = await db["books"].find().sort(order_by, -1).to_list(limit)
+    new_book = jsonable_encoder(book_data)
 
-        return books
+    # Add additional informations
+    new_book["publisher_user_id"] = current_user["_id"]
+    new_book["created_at"] = str(datetime.now(timezone.utc))
+    new_book["status"] = new_book["delete_status"] = False
+    new_book["version"] = 1
+    new_book["modified_at"] = modified_at()
 
-    # Create a book
-    async def create_a_book(book_data: Book, current_user : str) -> dict:
+    return new_book
 
-        new_book = jsonable_encoder(book_data)
 
-        # Add additional informations
-        new_book["publisher_user_id"] = current_user["_id"]
-        new_book["created_at"] = str(datetime.now(timezone.utc))
-        new_book["status"] = new_book["delete_status"] = False
+# Filter of the books, not deleted, the current user may change: the owner's, any for an admin
+def transition_filter(current_user, query: dict) -> dict:
 
-        new_book = await db["books"].insert_one(new_book)
+    query = {"delete_status": False, "deleted_by_admin": False, **query}
 
-        created_book = await db["books"].find_one({"_id": new_book.inserted_id})
+    if current_user["role"] != "admin":
 
-        return created_book
+        query["publisher_user_id"] = current_user["_id"]
 
-    # Publish a Book
-    async def publish_a_book(id: str, current_user):
+    return query
 
-        book = await db["books"].find_one({"_id": id, "delete_status": False, "deleted_by_admin": False})
 
-        if book is not None:
+# Fields set by a transition, an admin also sets the `*_by_admin` ones
+def transition_changes(current_user, changes: dict, admin_changes: dict) -> dict:
 
-            try:
+    if current_user["role"] == "admin":
 
-                # Get current time
-                timestamp = {"published_at": datetime.today()}
-                book_status = {"status": True}
+        return {**changes, **admin_changes}
 
-                # Change data in JSON
-                json_timestamp = jsonable_encoder(timestamp)
-                json_book_status = jsonable_encoder(book_status)
+    return changes
 
-                # Merging JSON objects
-                book = {**book, **json_timestamp, **json_book_status}
 
-                if current_user["_id"] == book["publisher_user_id"]:
-        
-                    update_result = await db["books"].update_one(
-                        {"_id": id}, {"$set": book}
-                    )
-                
-                if current_user["role"] == "admin":
+# Fields the autocomplete index, the catalog statistics and the query cache need to follow a book
+TRACKED_PROJECTION = {
+    "publisher_user_id": 1,
+    "title": 1,
+    "author_name": 1,
+    "language": 1,
+    "publisher": 1,
+    "page_count": 1,
+    "status": 1,
+    "delete_status": 1,
+    "deleted_by_admin": 1,
+    "version": 1,
+}
 
-                    # Get current updated_by_admin
-                    admin_timestamp = {"published_by_admin_at": datetime.today()}
-                    admin_publish_status = {"published_by_admin" : True}
+# Rounds of a bulk write: the books another request changed between the read and the write are
+# read again in the next one
+BULK_WRITE_ATTEMPTS = 3
 
-                    # Change data in JSON
-                    json_timestamp = jsonable_encoder(admin_timestamp)
-                    json_status = jsonable_encoder(admin_publish_status)
 
-                    # Merging JSON objects
-                    book = {**book, **json_timestamp, **json_status}
+# Keep the autocomplete index in line with the state of a book
+def index_book(book: dict) -> None:
 
-                    update_result = await db["books"].update_one(
-                        {"_id": id}, {"$set": book}
-                    )
+    if book.get("status") and not book.get("delete_status") and not book.get("deleted_by_admin"):
 
-                if update_result.modified_count == 1:
+        book_autocomplete.add(book["_id"], book.get("title"), book.get("author_name"))
 
-                    if (
-                        updated_book := await db["books"].find_one({"_id": id})
-                    ) is not None:
+    else:
 
-                        return updated_book
+        book_autocomplete.remove(book["_id"])
 
-                if (
-                    existing_book := await db["books"].find_one({"_id": id})
-                ) is not None:
 
-                    return existing_book
+# Update the autocomplete index, the catalog statistics and the cached lists after a write,
+# `before` and `after` hold the books as they were and as they are (None if absent). Without
+# `delta` the statistics are left to the reconciliation (src.dynamic_books.stats)
+async def track_books(before: list, after: list, delta: bool = True) -> None:
 
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detal="The Book with this ID not found",
-                )
+    tags = set()
 
-            except Exception as e:
+    for book in (*before, *after):
+        if book is not None:
+            tags |= book_tags(book)
 
-                print(f"Error occurred: {e}")
+    await query_cache.invalidate(tags)
 
-                raise HTTPException(
-                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    detail=f"Internal server error: {str(e)}",
-                )
+    # Reads arriving after the write must not join one started before it
+    for tag in tags:
+        single_flight.forget(tag)
 
-        else:
+    for old, new in zip(before, after):
 
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="The Book with this ID not found",
-            )
+        single_flight.forget("book", (new or old)["_id"])
 
-    # Get all published books limit to 10 per page and order by created date
-    async def get_all_published_books(limit: int = 10, order_by: str = "created_at"):
+        if new is not None:
+            index_book(new)
 
-        published_books = (
-            await db["books"]
-            .find({"status": True, "delete_status": False, "deleted_by_admin": False})
-            .sort(order_by, -1)
-            .to_list(limit)
-        )
+        elif old is not None:
+            book_autocomplete.remove(old["_id"])
 
-        return published_books
+    if delta:
+        await apply_delta(before, after)
 
-    # Unpublish a book
-    async def unpublish_a_book(id: str, current_user):
 
-        book = await db["books"].find_one({"_id": id, "delete_status": False, "deleted_by_admin": False})
+# Every write bumps the version and the modification time of the book, see src.conditional
+def versioned_update(changes: dict) -> dict:
 
-        if book is not None:
+    return {"$set": changes, "$inc": {"version": 1}}
 
-            if book["status"] == True:
 
-                try:
+# The books still at the version they were read at, nobody wrote them since
+def unchanged_filter(books) -> dict:
 
-                    # Get current time
-                    timestamp = {"unpublished_at": datetime.today()}
-                    book_status = {"status": False}
+    return {"$or": [{"_id": book["_id"], "version": book.get("version")} for book in books]}
 
-                    # Change data in JSON
-                    json_timestamp = jsonable_encoder(timestamp)
-                    json_book_status = jsonable_encoder(book_status)
 
-                    # Merging JSON objects
-                    book = {**book, **json_timestamp, **json_book_status}
+# Change the state of a book in one round trip. Returns the updated book or None.
+async def apply_transition(
+    id: str, current_user, query: dict, changes: dict, admin_changes: dict
+):
 
-                    if current_user["_id"] == book["publisher_user_id"]:
-            
-                        update_result = await db["books"].update_one(
-                            {"_id": id}, {"$set": book}
-                        )
-                    
-                    if current_user["role"] == "admin":
+    changes = {
+        **transition_changes(current_user, changes, admin_changes),
+        "modified_at": modified_at(),
+    }
 
-                        # Get current updated_by_admin
-                        admin_timestamp = {"unpublished_by_admin_at": datetime.today()}
-                        admin_unpublish_status = {"unpublished_by_admin" : True}
+    # The book before the update gives the statistics delta, $set gives the book after it
+    book = await db["books"].find_one_and_update(
+        transition_filter(current_user, {"_id": id, **query}),
+        versioned_update(changes),
+        return_document=ReturnDocument.BEFORE,
+    )
 
-                        # Change data in JSON
-                        json_timestamp = jsonable_encoder(admin_timestamp)
-                        json_status = jsonable_encoder(admin_unpublish_status)
+    if book is None:
+        return None
 
-                        # Merging JSON objects
-                        book = {**book, **json_timestamp, **json_status}
+    updated_book = {**book, **changes, "version": book.get("version", 0) + 1}
 
-                        update_result = await db["books"].update_one(
-                            {"_id": id}, {"$set": book}
-                        )
+    await track_books([book], [updated_book])
 
-                    if update_result.modified_count == 1:
+    return updated_book
 
-                        if (
-                            updated_book := await db["books"].find_one({"_id": id})
-                        ) is not None:
 
-                            return updated_book
+# Per item result of a bulk operation on `ids`
+def bulk_report(ids: list, succeeded: set, status: str, error: str) -> dict:
 
-                    if (
-                        existing_book := await db["books"].find_one({"_id": id})
-                    ) is not None:
+    results = [
+        {"index": index, "id": id, "status": status, "error": None}
+        if id in succeeded
+        else {"index": index, "id": id, "status": "failed", "error": error}
+        for index, id in enumerate(ids)
+    ]
 
-                        return existing_book
+    done = sum(1 for result in results if result["error"] is None)
 
-                    raise HTTPException(
-                        status_code=status.HTTP_404_NOT_FOUND,
-                        detal="The Book with this ID not found",
-                    )
+    return {
+        "requested": len(ids),
+        "succeeded": done,
+        "failed": len(ids) - done,
+        "results": results,
+    }
 
-                except Exception as e:
 
-                    print(f"Error occurred: {e}")
+# Same transition as apply_transition on many books, in two round trips
+async def apply_bulk_transition(
+    ids: list, current_user, query: dict, changes: dict, admin_changes: dict
+) -> dict:
 
-                    raise HTTPException(
-                        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                        detail=f"Internal server error: {str(e)}",
-                    )
+    query = transition_filter(current_user, query)
+    changes = {
+        **transition_changes(current_user, changes, admin_changes),
+        "modified_at": modified_at(),
+    }
 
-        else:
+    # Marks the books this request wrote
+    stamp = {"bulk_write_id": uuid.uuid4().hex}
 
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="The Book with this ID not found or The Book is already published",
+    updated = set()
+    pending = ids
+
+    for _ in range(BULK_WRITE_ATTEMPTS):
+
+        # The books matching the guards, the update only changes them if they are still as read
+        matched = {
+            book["_id"]: book
+            async for book in db["books"].find(
+                {**query, "_id": {"$in": pending}}, TRACKED_PROJECTION
             )
+        }
 
-    # Get all unpublished books limit to 10 per page and order by created date by user
-    async def get_unpublished_books(limit: int = 10, order_by: str = "created_at"):
+        if not matched:
+            break
 
-        unpub_book = (
-            await db["books"]
-            .find({"status": False, "delete_status": False, "deleted_by_admin": False})
-            .sort(order_by, -1)
-            .to_list(limit)
+        result = await db["books"].update_many(
+            {"$and": [query, unchanged_filter(matched.values())]},
+            versioned_update({**changes, **stamp}),
         )
 
-        if unpub_book is not None:
+        written = list(matched)
 
-            return unpub_book
+        if result.modified_count != len(matched):
 
-        else:
+            # Some were written by another request after the read
+            written = [
+                book["_id"]
+                async for book in db["books"].find({"_id": {"$in": written}, **stamp}, {"_id": 1})
+            ]
 
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Internal server error",
-            )
+        before = [matched[id] for id in written]
 
-    # Soft Delete of a Book
-    async def delete_a_book(id: str, current_user):
+        await track_books(
+            before,
+            [{**book, **changes, "version": book.get("version", 0) + 1} for book in before],
+        )
 
-        book = await db["books"].find_one({"_id": id, "delete_status": False, "deleted_by_admin": False})
+        updated.update(written)
+        pending = [id for id in matched if id not in updated]
 
-        if book is not None:
+        if not pending:
+            break
 
-            try:
+    return bulk_report(
+        ids, updated, "updated", "The Book with this ID not found or not allowed"
+    )
 
-                # Get current time
-                timestamp = {"deleted_at": datetime.today()}
-                book_status = {"delete_status": True}
 
-                # Change data in JSON
-                json_timestamp = jsonable_encoder(timestamp)
-                json_book_status = jsonable_encoder(book_status)
+class BookServices:
 
-                # Merging JSON objects
-                book = {**book, **json_timestamp, **json_book_status}
+    # Get all books (published and un published) limit to 10 per page and order by created date
+    async def get_all_books(
+        limit: int = 10, order_by: str = "created_at", cursor: str = None, raw: bool = False
+    ):
+
+        if raw:
+            return await raw_books_page(
+                "get_all_books",
+                {"limit": limit, "order_by": order_by, "cursor": cursor},
+                "books:all",
+                {},
+            )
 
-                if current_user["_id"] == book["publisher_user_id"]:
-        
-                    deleted_result = await db["books"].update_one(
-                        {"_id": id}, {"$set": book}
-                    )
-                
-                if current_user["role"] == "admin":
+        books, next_cursor = await query_cache.get_or_load(
+            "get_all_books",
+            {"limit": limit, "order_by": order_by, "cursor": cursor},
+            ["books:all"],
+            lambda: paginate(db["books"], {}, order_by, limit, cursor),
+        )
+
+        return books, next_cursor
 
-                    # Get current updated_by_admin
-                    admin_timestamp = {"deleted_by_admin_at": datetime.today()}
-                    admin_delete_status = {"deleted_by_admin" : True}
+    # Create a book
+    async def create_a_book(book_data: Book, current_user : str) -> dict:
 
-                    # Change data in JSON
-                    json_timestamp = jsonable_encoder(admin_timestamp)
-                    json_status = jsonable_encoder(admin_delete_status)
+        new_book = new_book_document(book_data, current_user)
 
-                    # Merging JSON objects
-                    book = {**book, **json_timestamp, **json_status}
+        new_book = await db["books"].insert_one(new_book)
 
-                    deleted_result = await db["books"].update_one(
-                        {"_id": id}, {"$set": book}
-                    )
+        created_book = await db["books"].find_one({"_id": new_book.inserted_id})
 
-                if deleted_result.modified_count == 1:
+        await track_books([None], [created_book])
 
-                    if (
-                        deleted_book := await db["books"].find_one({"_id": id})
-                    ) is not None:
+        return created_book
 
-                        return deleted_book
+    # Publish a Book
+    async def publish_a_book(id: str, current_user):
 
-                if (
-                    existing_book := await db["books"].find_one({"_id": id})
-                ) is not None:
+        now = jsonable_encoder(datetime.today())
 
-                    return existing_book
+        book = await apply_transition(
+            id,
+            current_user,
+            {},
+            {"published_at": now, "status": True},
+            {"published_by_admin_at": now, "published_by_admin": True},
+        )
 
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detal="The Book with this ID not found",
-                )
+        if book is None:
 
-            except Exception as e:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="The Book with this ID not found",
+            )
 
-                print(f"Error occurred: {e}")
+        return book
 
-                raise HTTPException(
-                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    detail=f"Internal server error: {str(e)}",
-                )
+    # Get all published books limit to 10 per page and order by created date
+    async def get_all_published_books(
+        limit: int = 10, order_by: str = "created_at", cursor: str = None, raw: bool = False
+    ):
+
+        if raw:
+            return await raw_books_page(
+                "get_all_published_books",
+                {"limit": limit, "order_by": order_by, "cursor": cursor},
+                "books:published",
+                {"status": True, "delete_status": False, "deleted_by_admin": False},
+            )
 
-        else:
+        # The hottest endpoint: concurrent callers of a page share one cache lookup or query
+        published_books, next_cursor = await single_flight.do(
+            ("books:published", limit, order_by, cursor),
+            lambda: query_cache.get_or_load(
+                "get_all_published_books",
+                {"limit": limit, "order_by": order_by, "cursor": cursor},
+                ["books:published"],
+                lambda: paginate(
+                    db["books"],
+                    {"status": True, "delete_status": False, "deleted_by_admin": False},
+                    order_by,
+                    limit,
+                    cursor,
+                ),
+            ),
+        )
+
+        return published_books, next_cursor
+
+    # Unpublish a book
+    async def unpublish_a_book(id: str, current_user):
+
+        now = jsonable_encoder(datetime.today())
+
+        book = await apply_transition(
+            id,
+            current_user,
+            {"status": True},
+            {"unpublished_at": now, "status": False},
+            {"unpublished_by_admin_at": now, "unpublished_by_admin": True},
+        )
+
+        if book is None:
 
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
-                detail="The Book with this ID not found or The Book is already deleted",
+                detail="The Book with this ID not found or The Book is already unpublished",
             )
 
-    # Get all deleted books limit to 10 per page and order by created date by user
-    async def get_deleted_books(limit: int = 10, order_by: str = "deleted_at"):
+        return book
 
-        books = (
-            await db["books"]
-            .find({"delete_status": True})
-            .sort(order_by, -1)
-            .to_list(limit)
+    # Get all unpublished books limit to 10 per page and order by created date by user
+    async def get_unpublished_books(
+        limit: int = 10, order_by: str = "created_at", cursor: str = None, raw: bool = False
+    ):
+
+        if raw:
+            return await raw_books_page(
+                "get_unpublished_books",
+                {"limit": limit, "order_by": order_by, "cursor": cursor},
+                "books:unpublished",
+                {"status": False, "delete_status": False, "deleted_by_admin": False},
+            )
+
+        unpub_book, next_cursor = await query_cache.get_or_load(
+            "get_unpublished_books",
+            {"limit": limit, "order_by": order_by, "cursor": cursor},
+            ["books:unpublished"],
+            lambda: paginate(
+                db["books"],
+                {"status": False, "delete_status": False, "deleted_by_admin": False},
+                order_by,
+                limit,
+                cursor,
+            ),
         )
 
-        if not books:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND, detail="No deleted book found."
-            )
+        if unpub_book is not None:
 
-        result = []
+            return unpub_book, next_cursor
 
-        for book in books:
+        else:
 
-            result.append(BookResponse(**book))
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Internal server error",
+            )
 
-        return result
+    # Soft Delete of a Book
+    async def delete_a_book(id: str, current_user):
 
-    # Get one book
-    async def get_a_book(id: str):
+        now = jsonable_encoder(datetime.today())
 
-        book = await db["books"].find_one(
-            {"_id": id, "delete_status": False, "deleted_by_admin": False}
+        book = await apply_transition(
+            id,
+            current_user,
+            {},
+            {"deleted_at": now, "delete_status": True},
+            {"deleted_by_admin_at": now, "deleted_by_admin": True},
         )
 
         if book is None:
 
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
-                detail="The Book with this ID not found",
+                detail="The Book with this ID not found or The Book is already deleted",
             )
 
         return book
 
-    # Update a book
-    async def update_book(id: str, book_data: Book, current_user):
-
-        book = await db["books"].find_one({"_id": id, "delete_status": False, "deleted_by_admin": False})
-
-        if book is not None:
-
-            try:
+    # Get all deleted books limit to 10 per page and order by created date by user
+    async def get_deleted_books(
+        limit: int = 10, order_by: str = "deleted_at", cursor: str = None, raw: bool = False
+    ):
+
+        if raw:
+            books, next_cursor = await raw_books_page(
+                "get_deleted_books",
+                {"limit": limit, "order_by": order_by, "cursor": cursor},
+                "books:deleted",
+                {"delete_status": True},
+            )
 
-                book_data = {
-                    k: v
-                    for k, v in book_data.model_dump(exclude_unset=True).items()
-                    if v is not None
-                }
+        else:
+            books, next_cursor = await query_cache.get_or_load(
+                "get_deleted_books",
+                {"limit": limit, "order_by": order_by, "cursor": cursor},
+                ["books:deleted"],
+                lambda: paginate(db["books"], {"delete_status": True}, order_by, limit, cursor),
+            )
 
-                if len(book_data) >= 1:
+        # A raw page is a dict, empty without any book
+        if not books or (raw and not books["count"]):
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail="No deleted book found."
+            )
 
-                    # Get current time
-                    timestamp = {"updated_at": datetime.today()}
+        return books, next_cursor
 
-                    # Change data in JSON
-                    json_timestamp = jsonable_encoder(timestamp)
+    # Get one book
+    async def get_a_book(id: str):
 
-                    # Merging JSON objects
-                    book_data = {**book_data, **json_timestamp}
+        book = await single_flight.do(("book", id), lambda: book_loader.load(id))
 
-                    if current_user["_id"] == book["publisher_user_id"]:
-            
-                        update_result = await db["books"].update_one(
-                            {"_id": id}, {"$set": book_data}
-                        )
-                    
-                    if current_user["role"] == "admin":
+        if book is None:
 
-                        # Get current updated_by_admin
-                        timestamp = {"updated_by_admin_at": datetime.today()}
-                        status = {"updated_by_admin" : True}
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="The Book with this ID not found",
+            )
 
-                        # Change data in JSON
-                        json_timestamp = jsonable_encoder(timestamp)
-                        json_status = jsonable_encoder(status)
+        return book
 
-                        # Merging JSON objects
-                        book_data = {**book_data, **json_timestamp, **json_status}
+    # Update a book
+    async def update_book(id: str, book_data: Book, current_user, version: int = None):
 
-                        update_result = await db["books"].update_one(
-                            {"_id": id}, {"$set": book_data}
-                        )
+        book_data = {
+            k: v
+            for k, v in book_data.model_dump(exclude_unset=True).items()
+            if v is not None
+        }
 
-                    if update_result.modified_count == 1:
+        # If-Match: only update the version the client has seen (books without version are 0)
+        query = {} if version is None else {"version": version or {"$in": [0, None]}}
 
-                        if (
-                            updated_book := await db["books"].find_one({"_id": id})
-                        ) is not None:
+        if len(book_data) >= 1:
 
-                            return updated_book
+            now = jsonable_encoder(datetime.today())
 
-                    if (
-                        existing_book := await db["books"].find_one({"_id": id})
-                    ) is not None:
+            book = await apply_transition(
+                id,
+                current_user,
+                query,
+                {**book_data, "updated_at": now},
+                {"updated_by_admin_at": now, "updated_by_admin": True},
+            )
 
-                        return existing_book
+        else:
 
-                    raise HTTPException(
-                        status_code=status.HTTP_404_NOT_FOUND,
-                        detal="The Book with this ID not found",
-                    )
+            # Nothing to update, take the existing book
+            book = await db["books"].find_one(
+                {"_id": id, "delete_status": False, "deleted_by_admin": False, **query}
+            )
 
-            except Exception as e:
+        if book is None and query:
 
-                print(f"Error occurred: {e}")
+            # Only on failure: tell a stale version from a missing book
+            if await db["books"].find_one(
+                {"_id": id, "delete_status": False, "deleted_by_admin": False}, {"_id": 1}
+            ):
 
                 raise HTTPException(
-                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    detail=f"Internal server error: {str(e)}",
+                    status_code=status.HTTP_412_PRECONDITION_FAILED,
+                    detail="The Book has been modified since this version",
                 )
 
-        else:
+        if book is None:
 
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="The Book with this ID not found",
             )
-        
-    async def get_user_books(id, limit, order_by):
+
+        return book
+
+    async def get_user_books(id, limit, order_by, cursor: str = None):
 
         try:
-            books = await db["books"].find({"publisher_user_id": id}).sort(order_by, -1).to_list(limit)
+            books, next_cursor = await query_cache.get_or_load(
+                "get_user_books",
+                {"id": id, "limit": limit, "order_by": order_by, "cursor": cursor},
+                [f"books:user:{id}"],
+                lambda: paginate(
+                    db["books"], {"publisher_user_id": id}, order_by, limit, cursor
+                ),
+            )
 
             if not books :
                 raise HTTPException(
@@ -435,7 +562,12 @@ class BookServices:
                     detail = "No books found for this user."
                 )
 
-            return books
+            return books, next_cursor
+
+        except HTTPException:
+
+            # 400 on an invalid cursor, 404 without any book of the user
+            raise
 
         except Exception as e:
 
@@ -459,6 +591,8 @@ class BookServices:
 
                 if delete_result.deleted_count == 1:
 
+                    await track_books([book], [None])
+
                     return HTTPException(
                         status_code=status.HTTP_204_NO_CONTENT,
                     )
@@ -483,3 +617,234 @@ class BookServices:
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="The Book with this ID not found",
             )
+
+    # Create many books, one unordered insert_many
+    async def create_books(books_data: list, current_user) -> dict:
+
+        new_books = [new_book_document(book_data, current_user) for book_data in books_data]
+
+        errors = {}
+
+        try:
+
+            await db["books"].insert_many(new_books, ordered=False)
+
+        except BulkWriteError as e:
+
+            # The other books are inserted, only report the failed ones
+            for error in e.details["writeErrors"]:
+                errors[error["index"]] = error["errmsg"]
+
+        inserted = [book for index, book in enumerate(new_books) if index not in errors]
+
+        await track_books([None] * len(inserted), inserted)
+
+        results = [
+            {"index": index, "id": book["_id"], "status": "failed", "error": errors[index]}
+            if index in errors
+            else {"index": index, "id": book["_id"], "status": "created", "error": None}
+            for index, book in enumerate(new_books)
+        ]
+
+        return {
+            "requested": len(new_books),
+            "succeeded": len(new_books) - len(errors),
+            "failed": len(errors),
+            "results": results,
+        }
+
+    # Publish many books
+    async def publish_books(ids: list, current_user) -> dict:
+
+        now = jsonable_encoder(datetime.today())
+
+        return await apply_bulk_transition(
+            ids,
+            current_user,
+            {},
+            {"published_at": now, "status": True},
+            {"published_by_admin_at": now, "published_by_admin": True},
+        )
+
+    # Unpublish many books
+    async def unpublish_books(ids: list, current_user) -> dict:
+
+        now = jsonable_encoder(datetime.today())
+
+        return await apply_bulk_transition(
+            ids,
+            current_user,
+            {"status": True},
+            {"unpublished_at": now, "status": False},
+            {"unpublished_by_admin_at": now, "unpublished_by_admin": True},
+        )
+
+    # Soft delete many books
+    async def delete_books(ids: list, current_user) -> dict:
+
+        now = jsonable_encoder(datetime.today())
+
+        return await apply_bulk_transition(
+            ids,
+            current_user,
+            {},
+            {"deleted_at": now, "delete_status": True},
+            {"deleted_by_admin_at": now, "deleted_by_admin": True},
+        )
+
+    # Hard delete many books
+    async def hard_delete_books(ids: list) -> dict:
+
+        deleted = set()
+        pending = ids
+
+        for _ in range(BULK_WRITE_ATTEMPTS):
+
+            found = {
+                book["_id"]: book
+                async for book in db["books"].find({"_id": {"$in": pending}}, TRACKED_PROJECTION)
+            }
+
+            if not found:
+                break
+
+            result = await db["books"].delete_many(unchanged_filter(found.values()))
+
+            if result.deleted_count == len(found):
+
+                await track_books(list(found.values()), [None] * len(found))
+
+                deleted.update(found)
+
+                break
+
+            # Some were written by another request after the read, they are read again. The ones
+            # deleted here can't be told from the ones another request deleted meanwhile, their
+            # statistics are left to the reconciliation
+            left = {
+                book["_id"]
+                async for book in db["books"].find({"_id": {"$in": list(found)}}, {"_id": 1})
+            }
+
+            gone = [book for id, book in found.items() if id not in left]
+
+            await track_books(gone, [None] * len(gone), delta=False)
+
+            deleted.update(book["_id"] for book in gone)
+            pending = list(left)
+
+        return bulk_report(ids, deleted, "deleted", "The Book with this ID not found")
+
+    # Stream books matching the query, one cursor batch in memory at a time
+    async def export_books(query: dict, batch_size: int):
+
+        projection = {field: 1 for field in EXPORT_FIELDS}
+
+        cursor = db["books"].find(query, projection, batch_size=batch_size).sort("_id", 1)
+
+        async for book in cursor:
+
+            yield book
+
+    # Search published books by relevance on title, author, publisher and description
+    async def search_books(
+        text: str,
+        language: str = None,
+        min_pages: int = None,
+        max_pages: int = None,
+        limit: int = 10,
+        cursor: str = None,
+        projection: dict = None,
+    ):
+
+        query = {
+            "$text": {"$search": text},
+            "status": True,
+            "delete_status": False,
+            "deleted_by_admin": False,
+        }
+
+        if language is not None:
+            query["language"] = language
+
+        page_count = {}
+
+        if min_pages is not None:
+            page_count["$gte"] = min_pages
+
+        if max_pages is not None:
+            page_count["$lte"] = max_pages
+
+        if page_count:
+            query["page_count"] = page_count
+
+        limit = max(limit, 1)
+
+        # Pages follow (score, _id) like the other cursors, the score only exists in the pipeline
+        pipeline = [
+            {"$match": query},
+            {"$addFields": {"score": {"$meta": "textScore"}}},
+            {"$match": keyset_query({}, "score", cursor)},
+            {"$sort": dict(keyset_sort("score"))},
+            {"$limit": limit + 1},
+        ]
+
+        # The cursor of the next page needs the score
+        if projection is not None:
+            pipeline.append({"$project": {**projection, "score": 1}})
+
+        books = await db["books"].aggregate(pipeline).to_list(limit + 1)
+
+        if len(books) <= limit:
+            return books, None
+
+        books = books[:limit]
+
+        return books, encode_cursor(books[-1], "score")
+
+    # Rebuild the autocomplete index from the published books
+    async def load_autocomplete() -> None:
+
+        books = [
+            (book["_id"], book.get("title"), book.get("author_name"))
+            async for book in db["books"].find(
+                {"status": True, "delete_status": False, "deleted_by_admin": False},
+                {"title": 1, "author_name": 1},
+            )
+        ]
+
+        book_autocomplete.rebuild(books)
+
+    # Reload the autocomplete index periodically, to see the writes of the other workers
+    async def refresh_autocomplete(interval: int) -> None:
+
+        while True:
+
+            try:
+
+                await BookServices.load_autocomplete()
+
+            except Exception as e:
+
+                print(f"Error occurred: {e}")
+
+            await asyncio.sleep(interval)
+
+    # Complete a title or author prefix
+    def autocomplete(prefix: str, limit: int = 10, kind: str = None) -> list:
+
+        return book_autocomplete.complete(prefix, limit, kind)
+
+    # Counters of the list query cache and of the read coalescing of this process
+    def get_cache_stats() -> dict:
+
+        return {
+            "query_cache": query_cache.stats(),
+            "single_flight": single_flight.stats(),
+            "book_loader": book_loader.stats(),
+        }
+
+    # Catalog statistics, one read of the materialized document
+    async def get_stats() -> dict:
+
+        return await get_catalog_stats()
@@ -0,0 +1,254 @@
+"""Catalog statistics kept in one materialized document.
+
+Every book counts in a set of counters (total, language, publisher, page
+count bucket, deletion state and, when not deleted, publication status). The
+BookServices writes $inc the difference between the counters of the book
+before and after the write, and a periodic reconciliation recomputes the whole
+document from the books collection to correct any drift.
+
+Every $inc also increments the `revision` of the document. The reconciliation
+only replaces the document if its revision did not move during the
+aggregation, otherwise the increments applied meanwhile would be lost: it
+tries again, up to RECONCILE_ATTEMPTS times. One worker of the deployment
+reconciles per interval, the one taking the Redis lock.
+"""
+
+import asyncio
+import uuid
+from collections import Counter
+
+import redis.asyncio as aioredis
+from pymongo.errors import DuplicateKeyError
+
+from src.config import db
+from src.query_cache import query_cache
+
+STATS_ID = "books"
+
+# Held for the whole interval, so the other workers skip their turn
+RECONCILE_LOCK = "lock:stats:reconcile"
+RECONCILE_ATTEMPTS = 3
+
+# Width of the page count buckets, the last one is open ended
+PAGE_BUCKET_WIDTH = 100
+PAGE_BUCKET_LAST = 1000
+
+
+def stat_key(value) -> str:
+
+    # Field names can not contain dots or start with $
+    if value is None or value == "":
+        return "unknown"
+
+    return str(value).replace(".", "_").replace("$", "_")
+
+
+def page_bucket(page_count) -> str:
+
+    if not isinstance(page_count, (int, float)):
+        return "unknown"
+
+    low = min(int(page_count) // PAGE_BUCKET_WIDTH * PAGE_BUCKET_WIDTH, PAGE_BUCKET_LAST)
+
+    if low >= PAGE_BUCKET_LAST:
+        return f"{PAGE_BUCKET_LAST}+"
+
+    return f"{low}-{low + PAGE_BUCKET_WIDTH - 1}"
+
+
+def deletion_key(book: dict) -> str:
+
+    if book.get("deleted_by_admin"):
+        return "deleted_by_admin"
+
+    if book.get("delete_status"):
+        return "deleted"
+
+    return "active"
+
+
+def state_counters(book: dict) -> list:
+
+    deletion = deletion_key(book)
+
+    if deletion != "active":
+        return [f"by_deletion.{deletion}"]
+
+    return [
+        f"by_deletion.{deletion}",
+        f"by_status.{'published' if book.get('status') else 'unpublished'}",
+    ]
+
+
+def book_counters(book: dict) -> list:
+
+    return [
+        "total",
+        f"by_language.{stat_key(book.get('language'))}",
+        f"by_publisher.{stat_key(book.get('publisher'))}",
+        f"by_page_count.{page_bucket(book.get('page_count'))}",
+        *state_counters(book),
+    ]
+
+
+def counters_delta(before: list, after: list) -> dict:
+
+    # `before` and `after` are lists of books, None stands for no book
+    delta = Counter()
+
+    for book in after:
+        if book is not None:
+            delta.update(book_counters(book))
+
+    for book in before:
+        if book is not None:
+            delta.subtract(book_counters(book))
+
+    return {counter: count for counter, count in delta.items() if count}
+
+
+async def apply_delta(before: list, after: list) -> None:
+
+    delta = counters_delta(before, after)
+
+    if delta:
+        await db["stats"].update_one(
+            {"_id": STATS_ID}, {"$inc": {**delta, "revision": 1}}, upsert=True
+        )
+
+
+async def compute_stats() -> dict:
+
+    facets = (
+        await db["books"]
+        .aggregate(
+            [
+                {
+                    "$facet": {
+                        "total": [{"$count": "count"}],
+                        "by_language": [{"$group": {"_id": "$language", "count": {"$sum": 1}}}],
+                        "by_publisher": [{"$group": {"_id": "$publisher", "count": {"$sum": 1}}}],
+                        "by_page_count": [
+                            {
+                                "$group": {
+                                    "_id": {"$floor": {"$divide": ["$page_count", PAGE_BUCKET_WIDTH]}},
+                                    "count": {"$sum": 1},
+                                }
+                            }
+                        ],
+                        "by_state": [
+                            {
+                                "$group": {
+                                    "_id": {
+                                        "status": "$status",
+                                        "delete_status": "$delete_status",
+                                        "deleted_by_admin": "$deleted_by_admin",
+                                    },
+                                    "count": {"$sum": 1},
+                                }
+                            }
+                        ],
+                    }
+                }
+            ]
+        )
+        .to_list(1)
+    )[0]
+
+    stats = {
+        "total": facets["total"][0]["count"] if facets["total"] else 0,
+        "by_language": Counter(),
+        "by_publisher": Counter(),
+        "by_page_count": Counter(),
+        "by_deletion": Counter(),
+        "by_status": Counter(),
+    }
+
+    # Same keys as book_counters
+    for group in facets["by_language"]:
+        stats["by_language"][stat_key(group["_id"])] += group["count"]
+
+    for group in facets["by_publisher"]:
+        stats["by_publisher"][stat_key(group["_id"])] += group["count"]
+
+    for group in facets["by_page_count"]:
+        bucket = None if group["_id"] is None else group["_id"] * PAGE_BUCKET_WIDTH
+        stats["by_page_count"][page_bucket(bucket)] += group["count"]
+
+    for group in facets["by_state"]:
+
+        for counter in state_counters(group["_id"]):
+            family, key = counter.split(".", 1)
+            stats[family][key] += group["count"]
+
+    return {
+        family: dict(value) if isinstance(value, Counter) else value
+        for family, value in stats.items()
+    }
+
+
+async def reconcile_stats() -> dict:
+
+    for _ in range(RECONCILE_ATTEMPTS):
+
+        current = await db["stats"].find_one({"_id": STATS_ID}, {"revision": 1})
+        revision = (current or {}).get("revision", 0)
+
+        stats = await compute_stats()
+
+        # Compare and set: no $inc landed during the aggregation (documents from before the
+        # revision field lack it)
+        try:
+            result = await db["stats"].replace_one(
+                {"_id": STATS_ID, "revision": revision if revision else {"$in": [0, None]}},
+                {**stats, "revision": revision},
+                upsert=True,
+            )
+
+        # Created by an $inc meanwhile
+        except DuplicateKeyError:
+            continue
+
+        if result.matched_count or result.upserted_id is not None:
+            return stats
+
+    raise RuntimeError(f"statistics kept changing during {RECONCILE_ATTEMPTS} reconciliations")
+
+
+async def get_stats() -> dict:
+
+    stats = await db["stats"].find_one({"_id": STATS_ID}, {"_id": 0, "revision": 0})
+
+    return stats or {"total": 0}
+
+
+async def claim_reconciliation(interval: int) -> bool:
+
+    # Not released: the lock expires with the interval, one run per interval in the deployment
+    try:
+        return bool(
+            await query_cache.redis.set(RECONCILE_LOCK, uuid.uuid4().hex, nx=True, ex=interval)
+        )
+
+    except aioredis.RedisError as e:
+
+        # Without Redis nobody can tell which worker runs it: skip this turn
+        print(f"Error occurred: {e}")
+
+        return False
+
+
+async def reconcile_periodically(interval: int) -> None:
+
+    while True:
+
+        try:
+
+            if await claim_reconciliation(interval):
+                await reconcile_stats()
+
+        except Exception as e:
+
+            print(f"Error occurred: {e}")
+
+        await asyncio.sleep(interval)
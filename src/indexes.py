@@ -0,0 +1,260 @@
+"""Indexes of the users and books collections.
+
+The registry is applied at startup (see life_span in src.main), which only
+creates the missing indexes: one whose definition changed is reported, and
+dropped and rebuilt by the command with `--rebuild` (while it is rebuilt a
+unique index does not enforce uniqueness). Every query shape used by the
+services is listed in QUERY_SHAPES, and the report command runs explain() on
+each of them and flags the ones doing a COLLSCAN :
+
+    python -m src.indexes [--rebuild]
+"""
+
+import argparse
+import asyncio
+import sys
+
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel
+from pymongo.errors import OperationFailure, PyMongoError
+
+from src.config import db
+
+# Error codes returned when an index with the same keys exists under another name or with other
+# options (85), or one with the same name and other keys (86)
+INDEX_CONFLICT_CODES = (85, 86)
+INDEX_NOT_FOUND_CODE = 27
+
+PUBLISHED = {"status": True, "delete_status": False, "deleted_by_admin": False}
+UNPUBLISHED = {"status": False, "delete_status": False, "deleted_by_admin": False}
+
+# Keyset pagination sorts on (order_by, _id), see src.pagination
+BY_CREATED_AT = [("created_at", DESCENDING), ("_id", DESCENDING)]
+BY_DELETED_AT = [("deleted_at", DESCENDING), ("_id", DESCENDING)]
+
+INDEXES = {
+    "users": [
+        # user_login, user_registration
+        IndexModel([("username", ASCENDING)], name="users_username", unique=True),
+        # user_login, user_registration, password_reset_request
+        IndexModel([("email", ASCENDING)], name="users_email", unique=True),
+        # get_all_users
+        IndexModel(BY_CREATED_AT, name="users_created_at"),
+    ],
+    "books": [
+        # get_all_books
+        IndexModel(BY_CREATED_AT, name="books_created_at"),
+        # get_all_published_books
+        IndexModel(
+            BY_CREATED_AT,
+            name="books_published_created_at",
+            partialFilterExpression=PUBLISHED,
+        ),
+        # get_unpublished_books
+        IndexModel(
+            BY_CREATED_AT,
+            name="books_unpublished_created_at",
+            partialFilterExpression=UNPUBLISHED,
+        ),
+        # get_deleted_books
+        IndexModel(
+            BY_DELETED_AT,
+            name="books_deleted_deleted_at",
+            partialFilterExpression={"delete_status": True},
+        ),
+        # get_user_books
+        IndexModel(
+            [("publisher_user_id", ASCENDING), *BY_CREATED_AT],
+            name="books_publisher_created_at",
+        ),
+        # search_books, the only text index a collection can have
+        IndexModel(
+            [
+                ("title", TEXT),
+                ("author_name", TEXT),
+                ("publisher", TEXT),
+                ("description", TEXT),
+            ],
+            name="books_text",
+            weights={"title": 10, "author_name": 5, "publisher": 3, "description": 1},
+            default_language="english",
+            # The books `language` field holds names like "English", not text index languages
+            language_override="text_language",
+        ),
+    ],
+}
+
+# (collection, service query, filter, sort) with the default sort of each service
+QUERY_SHAPES = [
+    ("users", "user_login", {"$or": [{"username": ""}, {"email": ""}]}, None),
+    ("users", "password_reset_request", {"email": ""}, None),
+    ("users", "get_all_users", {}, BY_CREATED_AT),
+    ("users", "get_user_by_id", {"_id": ""}, None),
+    ("books", "get_all_books", {}, BY_CREATED_AT),
+    ("books", "get_all_published_books", PUBLISHED, BY_CREATED_AT),
+    ("books", "get_unpublished_books", UNPUBLISHED, BY_CREATED_AT),
+    ("books", "get_deleted_books", {"delete_status": True}, BY_DELETED_AT),
+    ("books", "get_user_books", {"publisher_user_id": ""}, BY_CREATED_AT),
+    ("books", "get_a_book", {"_id": "", "delete_status": False, "deleted_by_admin": False}, None),
+    ("books", "search_books", {"$text": {"$search": "book"}, **PUBLISHED}, None),
+]
+
+
+def same_keys(spec: dict, document: dict) -> bool:
+
+    # A text index is stored with the _fts / _ftsx keys, a collection has at most one
+    if TEXT in document["key"].values():
+        return "_fts" in spec["key"]
+
+    return list(spec["key"].items()) == list(document["key"].items())
+
+
+async def conflicting_indexes(collection, index: IndexModel) -> list:
+
+    # Names of the existing indexes in the way of `index`: the one with its name and other keys
+    # (code 86), the one with its keys and partial filter under another name or options (code 85)
+    document = index.document
+    names = []
+
+    for spec in await collection.list_indexes().to_list(None):
+
+        if spec["name"] == "_id_":
+            continue
+
+        if spec["name"] == document["name"] or (
+            same_keys(spec, document)
+            and spec.get("partialFilterExpression") == document.get("partialFilterExpression")
+        ):
+            names.append(spec["name"])
+
+    return names
+
+
+async def drop_index(collection, name: str) -> None:
+
+    try:
+        await collection.drop_index(name)
+
+    except OperationFailure as e:
+
+        # Already dropped by another process
+        if e.code != INDEX_NOT_FOUND_CODE:
+            raise
+
+
+async def ensure_index(collection, index: IndexModel, rebuild: bool) -> None:
+
+    try:
+
+        await collection.create_indexes([index])
+
+    except OperationFailure as e:
+
+        if e.code not in INDEX_CONFLICT_CODES:
+            raise
+
+        names = await conflicting_indexes(collection, index)
+
+        if not rebuild:
+
+            print(
+                f"Index {index.document['name']} of {collection.name} conflicts with {names}, "
+                f"rebuild it with `python -m src.indexes --rebuild`"
+            )
+
+            return
+
+        for name in names:
+            await drop_index(collection, name)
+
+        await collection.create_indexes([index])
+
+
+async def ensure_indexes(database=db, rebuild: bool = False) -> None:
+
+    # Creating an existing index is a no-op, so this is safe on every start. An index whose
+    # definition changed in the registry is only reported, the command rebuilds it
+    for collection, indexes in INDEXES.items():
+
+        for index in indexes:
+
+            try:
+
+                await ensure_index(database[collection], index, rebuild)
+
+            except OperationFailure as e:
+
+                print(f"Error occurred: {e}")
+
+            except PyMongoError as e:
+
+                # MongoDB unreachable: the server starts anyway, the routes not using it work
+                print(f"Error occurred: {e}")
+
+                return
+
+
+def plan_stages(plan: dict):
+
+    yield plan.get("stage")
+
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            yield from plan_stages(plan[key])
+
+    for child in plan.get("inputStages", []):
+        yield from plan_stages(child)
+
+
+async def explain_queries(database=db) -> list:
+
+    report = []
+
+    for collection, name, query, sort in QUERY_SHAPES:
+
+        cursor = database[collection].find(query)
+
+        if sort:
+            cursor = cursor.sort(sort)
+
+        explain = await cursor.limit(10).explain()
+
+        stages = list(plan_stages(explain["queryPlanner"]["winningPlan"]))
+
+        report.append(
+            {
+                "collection": collection,
+                "query": name,
+                "stages": stages,
+                "collscan": "COLLSCAN" in stages,
+            }
+        )
+
+    return report
+
+
+async def main(rebuild: bool = False) -> int:
+
+    await ensure_indexes(rebuild=rebuild)
+
+    report = await explain_queries()
+
+    for line in report:
+
+        flag = "COLLSCAN" if line["collscan"] else "ok"
+
+        print(f"{flag:<9} {line['collection']}.{line['query']:<28} {' > '.join(line['stages'])}")
+
+    return 1 if any(line["collscan"] for line in report) else 0
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="Drop and recreate the indexes whose definition changed in the registry",
+    )
+    args = parser.parse_args()
+
+    sys.exit(asyncio.run(main(args.rebuild)))
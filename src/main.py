@@ -1,19 +1,62 @@
+import asyncio
 from fastapi import FastAPI
-from contextlib import asynccontextmanager
+from fastapi.responses import ORJSONResponse
+from contextlib import asynccontextmanager, nullcontext
 
+from src.indexes import ensure_indexes
+from src.config import AUTOCOMPLETE_REFRESH_SECONDS, STATS_RECONCILE_SECONDS
 from src.home.routes import root_router
 from src.books.routes import book_router
+from src.books.store import book_store
+from src.books.wal import book_log
 from src.web_basics.routes import web_basics_router
 from src.dynamic_books.routes import dynamic_book_router
+from src.dynamic_books.services import BookServices
+from src.dynamic_books.stats import reconcile_periodically
 from src.user.routes import user_router
+from src.user.redis import sync_blocklist
+from src.user.utils import password_hasher
 
 
 @asynccontextmanager
 async def life_span(app: FastAPI):
     print(f"Server is starting ...")
 
+    await ensure_indexes()
+
+    # The shared books store maps (or first publishes) its catalog before serving
+    if hasattr(book_store, "attach"):
+        await asyncio.to_thread(book_store.attach)
+
+    # Optional persistence of the static books, see src.books.wal
+    if book_log.enabled:
+
+        # The shared store publishes the recovered catalog once instead of once per entry
+        with getattr(book_store, "batch", nullcontext)():
+            print(f"Books store recovered: {book_log.recover(book_store)}")
+
+    book_log_flusher = asyncio.create_task(book_log.run())
+
+    blocklist_sync = asyncio.create_task(sync_blocklist())
+
+    # The autocomplete index is built in the background, the server starts right away
+    autocomplete_refresh = asyncio.create_task(
+        BookServices.refresh_autocomplete(AUTOCOMPLETE_REFRESH_SECONDS)
+    )
+
+    stats_reconcile = asyncio.create_task(
+        reconcile_periodically(STATS_RECONCILE_SECONDS)
+    )
+
     yield
 
+    blocklist_sync.cancel()
+    autocomplete_refresh.cancel()
+    stats_reconcile.cancel()
+    book_log_flusher.cancel()
+    await book_log.close()
+    password_hasher.shutdown()
+
     print(f"Server has been stopped")
 
 
@@ -23,7 +66,8 @@ app = FastAPI(
     title="FastBOOK",
     description="Project to learn FastAPI by creating a book review web service",
     version=version,
-    # lifespan=life_span,
+    lifespan=life_span,
+    default_response_class=ORJSONResponse,
 )
 
 app.include_router(root_router)
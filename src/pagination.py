@@ -0,0 +1,111 @@
+"""Keyset (cursor) pagination for the list endpoints.
+
+A cursor is the opaque, url safe encoding of the (sort key, _id) of the last
+document of a page. The next page starts strictly after that position, so it
+is one index range scan whatever the depth (no skip).
+
+The lists only sort on keys that are indexed and set on every document they
+return (BY_CREATED_AT and BY_DELETED_AT in src.indexes): `$lt` never matches a
+missing or null key, such documents would be skipped after the first page.
+"""
+
+import base64
+import json
+from typing import Literal, Optional, Tuple
+
+from fastapi import status
+from fastapi.exceptions import HTTPException
+from pymongo import DESCENDING
+
+# Response header carrying the cursor of the next page (absent on the last page)
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+# `order_by` accepted by the list endpoints
+CreatedOrder = Literal["created_at"]
+DeletedOrder = Literal["deleted_at"]
+
+
+def encode_cursor(document: dict, order_by: str) -> str:
+
+    position = {"k": order_by, "v": document.get(order_by), "id": document["_id"]}
+
+    raw = json.dumps(position, separators=(",", ":")).encode()
+
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, order_by: str) -> dict:
+
+    try:
+
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        position = json.loads(raw)
+
+        if position["k"] != order_by:
+            raise ValueError("cursor was built for another order_by")
+
+        # Values go into the query as they are: no operator document
+        if not isinstance(position["v"], (str, int, float)) or not isinstance(position["id"], (str, int)):
+            raise ValueError("cursor holds a value that is not a scalar")
+
+        return position
+
+    except (ValueError, KeyError, TypeError) as e:
+
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid cursor: {str(e)}",
+        )
+
+
+def keyset_query(query: dict, order_by: str, cursor: Optional[str]) -> dict:
+
+    if not cursor:
+        return query
+
+    position = decode_cursor(cursor, order_by)
+
+    # Documents after (v, id) in the (order_by desc, _id desc) order
+    after = {
+        "$or": [
+            {order_by: {"$lt": position["v"]}},
+            {order_by: position["v"], "_id": {"$lt": position["id"]}},
+        ]
+    }
+
+    return {"$and": [query, after]} if query else after
+
+
+def keyset_sort(order_by: str) -> list:
+
+    return [(order_by, DESCENDING), ("_id", DESCENDING)]
+
+
+async def paginate(
+    collection,
+    query: dict,
+    order_by: str,
+    limit: int,
+    cursor: Optional[str] = None,
+    projection: Optional[dict] = None,
+) -> Tuple[list, Optional[str]]:
+
+    limit = max(limit, 1)
+
+    # The cursor of the next page needs the sort key
+    if projection is not None:
+        projection = {**projection, order_by: 1}
+
+    # One extra document tells whether there is a next page
+    documents = (
+        await collection.find(keyset_query(query, order_by, cursor), projection)
+        .sort(keyset_sort(order_by))
+        .to_list(limit + 1)
+    )
+
+    if len(documents) <= limit:
+        return documents, None
+
+    documents = documents[:limit]
+
+    return documents, encode_cursor(documents[-1], order_by)
@@ -0,0 +1,262 @@
+"""Shared Redis cache of list query results, invalidated by tags.
+
+An entry holds the result of one list query, keyed by (endpoint, parameters),
+with the version of each of its tags when it was computed. A write increments
+the version of the tags it affects (see book_tags), which makes every entry
+computed under an older version a miss at once on every worker and node. The
+entry and its tag versions are read in one round trip.
+
+Stale-while-revalidate: an entry past its fresh time is still served for
+QUERY_CACHE_STALE_SECONDS while one worker (holding a short Redis lock)
+reloads it in the background. An entry with outdated tags is a miss: it may
+still list a book a write removed from it. On a cold miss only the lock holder
+queries MongoDB, the others wait a little for its result. If Redis is
+unavailable the query goes straight to MongoDB.
+
+The cache uses its own Redis database: database 0 holds the token blocklist.
+"""
+
+import asyncio
+import hashlib
+import json
+import time
+import uuid
+
+import redis.asyncio as aioredis
+from bson import json_util
+
+from src.config import (
+    REDIS_HOST,
+    REDIS_PORT,
+    QUERY_CACHE_REDIS_DB,
+    QUERY_CACHE_FRESH_SECONDS,
+    QUERY_CACHE_STALE_SECONDS,
+)
+
+KEY_PREFIX = "query"
+TAG_PREFIX = "tag"
+
+# How long the loader of an entry keeps the lock, and how long the others wait for it
+LOCK_MILLISECONDS = 5000
+MISS_WAIT_SECONDS = 0.5
+MISS_POLL_SECONDS = 0.02
+
+# Deletes the lock only if it still holds our token, in one step: it may have expired and been
+# taken by another loader in between
+UNLOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
+def book_tags(book: dict) -> set:
+
+    # Lists a book appears in, see the BookServices list methods
+    tags = {"books:all", f"books:user:{book.get('publisher_user_id')}"}
+
+    if book.get("delete_status"):
+        tags.add("books:deleted")
+
+    elif not book.get("deleted_by_admin"):
+        tags.add("books:published" if book.get("status") else "books:unpublished")
+
+    return tags
+
+
+class QueryCache:
+
+    def __init__(self, redis, fresh_seconds: int, stale_seconds: int) -> None:
+
+        self.redis = redis
+        self.fresh_seconds = fresh_seconds
+        self.stale_seconds = stale_seconds
+
+        # Background reloads, kept referenced until they finish
+        self._revalidating = set()
+
+        self._unlock = redis.register_script(UNLOCK_SCRIPT)
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def key(self, endpoint: str, params: dict) -> str:
+
+        digest = hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode())
+
+        return f"{KEY_PREFIX}:{endpoint}:{digest.hexdigest()}"
+
+    async def read(self, key: str, tags: list):
+
+        async with self.redis.pipeline(transaction=False) as pipe:
+
+            pipe.get(key)
+            pipe.mget([f"{TAG_PREFIX}:{tag}" for tag in tags])
+
+            raw, versions = await pipe.execute()
+
+        if raw is None:
+            return None, False
+
+        entry = json_util.loads(raw)
+
+        # Computed before a write to one of its tags
+        if entry["versions"] != [int(version or 0) for version in versions]:
+            return None, False
+
+        return entry["value"], entry["fresh_until"] > time.time()
+
+    async def write(self, key: str, value, versions: list) -> None:
+
+        entry = {
+            "value": value,
+            "versions": versions,
+            "fresh_until": time.time() + self.fresh_seconds,
+        }
+
+        await self.redis.set(
+            key, json_util.dumps(entry), ex=self.fresh_seconds + self.stale_seconds
+        )
+
+    async def load(self, key: str, tags: list, loader):
+
+        # Tag versions are taken before the query, a write during it outdates the entry
+        versions = [
+            int(version or 0)
+            for version in await self.redis.mget([f"{TAG_PREFIX}:{tag}" for tag in tags])
+        ]
+
+        value = await loader()
+
+        await self.write(key, value, versions)
+
+        return value
+
+    async def lock(self, key: str):
+
+        token = uuid.uuid4().hex
+
+        if await self.redis.set(f"{key}:lock", token, nx=True, px=LOCK_MILLISECONDS):
+            return token
+
+        return None
+
+    async def unlock(self, key: str, token: str) -> None:
+
+        await self._unlock(keys=[f"{key}:lock"], args=[token])
+
+    async def revalidate(self, key: str, tags: list, loader) -> None:
+
+        token = await self.lock(key)
+
+        if token is None:
+            return
+
+        try:
+
+            await self.load(key, tags, loader)
+
+        except Exception as e:
+
+            print(f"Error occurred: {e}")
+
+        finally:
+
+            await self.unlock(key, token)
+
+    async def get_or_load(self, endpoint: str, params: dict, tags: list, loader):
+
+        key = self.key(endpoint, params)
+
+        try:
+
+            value, fresh = await self.read(key, tags)
+
+            if value is not None and fresh:
+                self.hits += 1
+                return value
+
+            if value is not None:
+
+                self.stale_hits += 1
+
+                task = asyncio.create_task(self.revalidate(key, tags, loader))
+                self._revalidating.add(task)
+                task.add_done_callback(self._revalidating.discard)
+
+                return value
+
+            self.misses += 1
+
+            token = await self.lock(key)
+
+            if token is not None:
+
+                try:
+                    return await self.load(key, tags, loader)
+
+                finally:
+                    await self.unlock(key, token)
+
+            # Another worker is loading this entry, wait for it rather than query too
+            deadline = time.monotonic() + MISS_WAIT_SECONDS
+
+            while time.monotonic() < deadline:
+
+                await asyncio.sleep(MISS_POLL_SECONDS)
+
+                value, fresh = await self.read(key, tags)
+
+                if value is not None:
+                    return value
+
+        except aioredis.RedisError as e:
+
+            self.errors += 1
+
+            print(f"Error occurred: {e}")
+
+        return await loader()
+
+    async def invalidate(self, tags) -> None:
+
+        if not tags:
+            return
+
+        try:
+
+            async with self.redis.pipeline(transaction=False) as pipe:
+
+                for tag in tags:
+                    pipe.incr(f"{TAG_PREFIX}:{tag}")
+
+                await pipe.execute()
+
+        except aioredis.RedisError as e:
+
+            # Entries of these tags stay fresh for at most QUERY_CACHE_FRESH_SECONDS
+            self.errors += 1
+
+            print(f"Error occurred: {e}")
+
+    def stats(self) -> dict:
+
+        lookups = self.hits + self.stale_hits + self.misses
+
+        return {
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "hit_ratio": round((self.hits + self.stale_hits) / lookups, 4) if lookups else 0.0,
+        }
+
+
+query_cache = QueryCache(
+    aioredis.StrictRedis(host=REDIS_HOST, port=REDIS_PORT, db=QUERY_CACHE_REDIS_DB),
+    QUERY_CACHE_FRESH_SECONDS,
+    QUERY_CACHE_STALE_SECONDS,
+)
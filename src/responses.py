@@ -0,0 +1,60 @@
+"""Fast JSON responses.
+
+The app renders its responses with orjson (ORJSONResponse is the default
+response class). On top of that, the list routes named in
+TRUSTED_PROJECTION_ROUTES skip the response_model step, where FastAPI
+validates every document with Pydantic and encodes it again: the documents
+are only shaped to the fields of the model, from a projection computed once
+per model, and dumped with orjson.
+
+Only routes returning documents written by this app should be trusted, since
+nothing checks their types any more. The output is the same as through the
+response model as long as the documents hold the model's types.
+"""
+
+from typing import Iterable, Type
+
+import orjson
+from fastapi import Response
+from pydantic import BaseModel
+
+from src.config import TRUSTED_PROJECTION_ROUTES
+
+
+class TrustedProjection:
+
+    def __init__(self, model: Type[BaseModel]) -> None:
+
+        self.model = model
+
+        # (key in the response, value when the document lacks it), in the model order
+        self.fields = [
+            (
+                field.alias or name,
+                None if field.is_required() or field.default_factory else field.default,
+            )
+            for name, field in model.model_fields.items()
+        ]
+
+        # Mongo projection of the documents the model needs
+        self.projection = {key: 1 for key, _ in self.fields}
+
+    def trusts(self, route: str) -> bool:
+
+        return route in TRUSTED_PROJECTION_ROUTES
+
+    def shape(self, document: dict) -> dict:
+
+        return {key: document.get(key, default) for key, default in self.fields}
+
+    def render(self, documents: Iterable[dict]) -> bytes:
+
+        # str() for the odd ObjectId, orjson already handles datetime
+        return orjson.dumps([self.shape(document) for document in documents], default=str)
+
+    def response(self, documents: Iterable[dict], response: Response) -> Response:
+
+        # Headers set on `response` by the route (cursor, ETag) are not applied to a returned Response
+        return Response(
+            self.render(documents), media_type="application/json", headers=dict(response.headers)
+        )
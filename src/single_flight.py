@@ -0,0 +1,81 @@
+"""In-process coalescing of concurrent identical reads.
+
+The first caller of a key starts the read, the callers arriving while it is in
+flight wait for it and share its result (or its exception). The read runs in
+its own task, so a caller going away does not cancel it for the others.
+
+Keys are tuples starting with a namespace, e.g. ("book", id). A write calls
+forget() so that reads arriving after it start a new query instead of joining
+one that may have started before the write.
+"""
+
+import asyncio
+from collections import Counter
+
+
+class SingleFlight:
+
+    def __init__(self) -> None:
+
+        self._in_flight = {}
+
+        # Per namespace: calls made, and queries actually run
+        self.calls = Counter()
+        self.flights = Counter()
+
+    async def do(self, key: tuple, fn):
+
+        namespace = key[0]
+        self.calls[namespace] += 1
+
+        task = self._in_flight.get(key)
+
+        if task is None:
+
+            self.flights[namespace] += 1
+
+            task = asyncio.ensure_future(fn())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._done(key, done))
+
+        return await asyncio.shield(task)
+
+    def _done(self, key: tuple, task: asyncio.Future) -> None:
+
+        # forget() may already have replaced this flight with a newer one
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+
+        # Retrieve the exception so nobody is warned about it when no caller is left
+        if not task.cancelled():
+            task.exception()
+
+    def forget(self, namespace: str, *args) -> None:
+
+        # One key, or the whole namespace without args
+        if args:
+            self._in_flight.pop((namespace, *args), None)
+            return
+
+        for key in [key for key in self._in_flight if key[0] == namespace]:
+            del self._in_flight[key]
+
+    def stats(self) -> dict:
+
+        stats = {}
+
+        for namespace, calls in self.calls.items():
+
+            coalesced = calls - self.flights[namespace]
+
+            stats[namespace] = {
+                "calls": calls,
+                "queries": self.flights[namespace],
+                "coalesced": coalesced,
+                "coalescing_ratio": round(coalesced / calls, 4) if calls else 0.0,
+            }
+
+        return stats
+
+
+single_flight = SingleFlight()
@@ -0,0 +1,98 @@
+import itertools
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from src.config import USER_CACHE_SIZE, USER_CACHE_TTL
+
+
+class UserCache:
+    """Bounded LRU cache of user documents (without password) with a TTL.
+
+    The cache is local to the process: writes made by another worker are only
+    seen once the entry expires, so keep the TTL short.
+
+    A load records the generation of the user before reading it and passes it
+    to set(): a user invalidated in between is not cached, the document read
+    may predate the write.
+    """
+
+    def __init__(self, max_size: int, ttl: int) -> None:
+
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+        # user id -> stamp of its last invalidation (0 when none), the most recent ones only
+        self._generations = OrderedDict()
+        self._stamps = itertools.count(1)
+
+    def get(self, user_id: str) -> Optional[dict]:
+
+        entry = self._entries.get(user_id)
+
+        if entry is None or entry[0] < time.monotonic():
+
+            if entry is not None:
+                del self._entries[user_id]
+
+            self.misses += 1
+
+            return None
+
+        self._entries.move_to_end(user_id)
+        self.hits += 1
+
+        # Callers merge and mutate user documents, never hand out the cached one
+        return dict(entry[1])
+
+    def generation(self, user_id: str) -> int:
+
+        return self._generations.get(user_id, 0)
+
+    def set(self, user_id: str, user: dict, generation: Optional[int] = None) -> None:
+
+        if self.max_size <= 0:
+            return
+
+        # Invalidated while it was read
+        if generation is not None and generation != self.generation(user_id):
+            return
+
+        self._entries[user_id] = (time.monotonic() + self.ttl, dict(user))
+        self._entries.move_to_end(user_id)
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: str) -> None:
+
+        self._entries.pop(user_id, None)
+
+        self._generations[user_id] = next(self._stamps)
+        self._generations.move_to_end(user_id)
+
+        while len(self._generations) > self.max_size:
+            self._generations.popitem(last=False)
+
+    def clear(self) -> None:
+
+        self._entries.clear()
+
+    def stats(self) -> dict:
+
+        lookups = self.hits + self.misses
+
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+user_cache = UserCache(USER_CACHE_SIZE, USER_CACHE_TTL)
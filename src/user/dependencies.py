@@ -5,8 +5,7 @@ from fastapi.security.http import HTTPAuthorizationCredentials
 from typing import Any, Optional, List
 
 from src.user.schemas import User
-from src.user.utils import decode_token, get_current_user
-from src.user.redis import token_in_blocklist
+from src.user.utils import AuthContext, decode_token, get_current_user
 
 
 class TokenBearer(HTTPBearer):
@@ -22,9 +21,12 @@ class TokenBearer(HTTPBearer):
 
         token = creds.credentials
 
-        token_data = decode_token(token)
+        # Shared with get_current_user and RoleChecker for the whole request
+        context = AuthContext.from_request(request, token)
+
+        token_data = context.token_data()
 
-        if not self.token_valid(token):
+        if token_data is None:
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN, detail={
                     "error" : "This token is invalid or expired",
@@ -32,7 +34,7 @@ class TokenBearer(HTTPBearer):
                 }
             )
 
-        if await token_in_blocklist(token_data["jti"]):
+        if await context.is_revoked():
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN, detail={
                     "error" : "This token is invalid or has been revoked",
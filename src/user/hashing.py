@@ -0,0 +1,104 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+from fastapi import status
+from fastapi.exceptions import HTTPException
+from passlib.context import CryptContext
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+# Run in the pool workers, keep them importable without the app config
+def hash_password(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def check_password(plain_password: str, hashed_password: str) -> bool:
+    return pwd_context.verify(plain_password, hashed_password)
+
+
+class PasswordHasher:
+    """Runs bcrypt in a worker pool so it never blocks the event loop.
+
+    At most `max_pending` hashes wait or run at the same time, the next ones
+    are rejected with a 503 instead of piling up behind a login storm. A
+    process pool broken by the death of a worker is replaced.
+    """
+
+    def __init__(self, kind: str = "process", workers: int = 1, max_pending: int = 64) -> None:
+
+        self.kind = kind
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self._executor: Optional[Executor] = None
+
+    @property
+    def executor(self) -> Executor:
+
+        if self._executor is None:
+
+            if self.kind == "thread":
+                self._executor = ThreadPoolExecutor(max_workers=self.workers)
+            else:
+                # Not forked from the app process: a thread of Motor or Redis could hold a lock
+                # the child would wait on forever
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("forkserver"),
+                )
+
+        return self._executor
+
+    def _discard(self, executor: Executor) -> None:
+
+        # Only once when several calls see the same broken pool
+        if self._executor is executor:
+            self._executor = None
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _run(self, func, *args):
+
+        if self.pending >= self.max_pending:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many password operations in progress, please retry later",
+                headers={"Retry-After": "1"},
+            )
+
+        self.pending += 1
+
+        loop = asyncio.get_running_loop()
+
+        try:
+
+            executor = self.executor
+
+            try:
+                return await loop.run_in_executor(executor, func, *args)
+
+            except BrokenProcessPool:
+
+                # A pool worker died (killed, out of memory), the pool refuses every call since:
+                # start a new one
+                self._discard(executor)
+
+                return await loop.run_in_executor(self.executor, func, *args)
+
+        finally:
+            self.pending -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self._run(hash_password, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run(check_password, plain_password, hashed_password)
+
+    def shutdown(self) -> None:
+
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
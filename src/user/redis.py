@@ -1,10 +1,16 @@
+import asyncio
+import time
 import redis.asyncio as aioredis
 from fastapi import status
 from fastapi.exceptions import HTTPException
 from src.config import REDIS_PORT, REDIS_HOST
 
+# Used when the expiration of the revoked token is unknown
 JTI_EXPIRY = 3600
 
+# Every process publishes the JTI it revokes on this channel
+BLOCKLIST_CHANNEL = "token_blocklist"
+
 try:
     token_blocklist = aioredis.StrictRedis(host=REDIS_HOST, port=REDIS_PORT, db=0)
     token_blocklist.ping()
@@ -18,11 +24,131 @@ except aioredis.ConnectionError as e:
         detail=f"Could not connect to Redis: {str(e)}",
     )
 
-async def add_jti_to_blocklist(jti: str) -> None:
-    await token_blocklist.set(name=jti, value="", ex=JTI_EXPIRY)
+
+class BlocklistMirror:
+    """Local copy of the revoked JTIs with their expiration time.
+
+    Only revoked tokens are stored, so the mirror stays small. While it is not
+    synced with Redis (startup, lost subscription) every lookup goes to Redis.
+    """
+
+    def __init__(self) -> None:
+
+        self.ready = False
+        self._entries = {}
+
+    def add(self, jti: str, expires_at: float) -> None:
+
+        self._entries[jti] = expires_at
+
+    def might_contain(self, jti: str) -> bool:
+
+        if not self.ready:
+            return True
+
+        expires_at = self._entries.get(jti)
+
+        if expires_at is None:
+            return False
+
+        if expires_at < time.time():
+            del self._entries[jti]
+            return False
+
+        return True
+
+    def prune(self) -> None:
+
+        now = time.time()
+
+        self._entries = {
+            jti: expires_at
+            for jti, expires_at in self._entries.items()
+            if expires_at >= now
+        }
+
+    def reset(self) -> None:
+
+        self.ready = False
+        self._entries = {}
+
+
+blocklist_mirror = BlocklistMirror()
+
+
+async def add_jti_to_blocklist(jti: str, exp: int = None) -> None:
+
+    # Keep the entry only as long as the token itself is valid
+    expiry = int(exp - time.time()) if exp else JTI_EXPIRY
+    expiry = max(expiry, 1)
+
+    await token_blocklist.set(name=jti, value="", ex=expiry)
+
+    blocklist_mirror.add(jti, time.time() + expiry)
+
+    await token_blocklist.publish(BLOCKLIST_CHANNEL, f"{jti}:{expiry}")
 
 
 async def token_in_blocklist(jti: str) -> bool:
+
+    # Redis is only asked when the local mirror can not rule the token out
+    if not blocklist_mirror.might_contain(jti):
+        return False
+
     jti = await token_blocklist.get(jti)
 
     return jti is not None
+
+
+async def load_blocklist() -> None:
+
+    # The blocklist is the only content of this Redis database
+    async for key in token_blocklist.scan_iter(count=1000):
+
+        ttl = await token_blocklist.ttl(key)
+
+        if ttl > 0:
+            blocklist_mirror.add(key.decode(), time.time() + ttl)
+
+
+async def sync_blocklist(retry_delay: int = 5) -> None:
+
+    # Run for the lifetime of the app, see life_span in src.main
+    while True:
+
+        pubsub = token_blocklist.pubsub()
+
+        try:
+
+            await pubsub.subscribe(BLOCKLIST_CHANNEL)
+
+            # Subscribe before loading so no revocation is missed in between
+            blocklist_mirror.reset()
+            await load_blocklist()
+            blocklist_mirror.ready = True
+
+            async for message in pubsub.listen():
+
+                if message["type"] != "message":
+                    continue
+
+                jti, expiry = message["data"].decode().rsplit(":", 1)
+
+                blocklist_mirror.add(jti, time.time() + int(expiry))
+
+                blocklist_mirror.prune()
+
+        except asyncio.CancelledError:
+
+            raise
+
+        except Exception as e:
+
+            print(f"Error occurred: {e}")
+
+        finally:
+
+            blocklist_mirror.ready = False
+            await pubsub.aclose()
+
+        await asyncio.sleep(retry_delay)
@@ -1,11 +1,11 @@
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException, status
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Response, status
 from fastapi.encoders import jsonable_encoder
 from datetime import datetime
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.responses import JSONResponse
 
-import httpx, secrets
+import secrets
 
 from src.user.dependencies import RefreshTokenBearer, AccessTokenBearer, RoleChecker
 from src.user.schemas import NewPassword, PasswordReset, User, UserResponse, UserResponseAdmin
@@ -16,13 +16,20 @@ from src.user.send_email import (
 )
 from src.user.utils import create_access_token, get_current_user, get_password_hash, verify_password
 from src.user.redis import add_jti_to_blocklist
+from src.user.services import UserServices, user_loader
+from src.user.cache import user_cache
 
 from src.config import db, DOMAIN_NAME, PORT
+from src.pagination import NEXT_CURSOR_HEADER, CreatedOrder, paginate
+from src.responses import TrustedProjection
 
 role_checker = RoleChecker(["admin", "user"]) 
 
 user_router = APIRouter(tags=["User Routes"])
 
+# User lists sent without response_model validation by the trusted routes
+trusted_users = TrustedProjection(UserResponseAdmin)
+
 # User registration or sign in
 @user_router.post("/registration", response_description="Register a user")
 async def user_registration(user_info: User):
@@ -75,13 +82,14 @@ async def user_registration(user_info: User):
                 )
 
         # Hash user's passowrd
-        user_info["password"] = get_password_hash(user_info["password"])
+        user_info["password"] = await get_password_hash(user_info["password"])
 
         # Create API Key
         user_info["apiKey"] = secrets.token_hex(30)
 
         # Save the user
         new_user = await db["users"].insert_one(user_info)
+        UserServices.invalidate_user(new_user.inserted_id)
         created_user = await db["users"].find_one({"_id": new_user.inserted_id})
 
         if user_info.get("first_name") and user_info.get("last_name"):
@@ -103,6 +111,11 @@ async def user_registration(user_info: User):
             "message": "Account successfully created. A confirmation email has been sent."
         }
 
+    except HTTPException:
+
+        # 409 on a taken username or email, 503 + Retry-After when the password hasher is busy
+        raise
+
     except Exception as e:
 
         print(f"Error occurred: {e}")
@@ -143,6 +156,7 @@ async def password_reset_request(user_email: PasswordReset):
                 update_user = await db["users"].update_one(
                     {"_id": user["_id"]}, {"$set": user}
                 )
+                UserServices.invalidate_user(user["_id"])
 
                 if user.get("first_name") and user.get("last_name"):
 
@@ -163,6 +177,9 @@ async def password_reset_request(user_email: PasswordReset):
                     },
                 )
 
+            except HTTPException:
+                raise
+
             except Exception as e:
 
                 print(f"Error occurred: {e}")
@@ -178,6 +195,11 @@ async def password_reset_request(user_email: PasswordReset):
                 detail="User with this email not found",
             )
 
+    except HTTPException:
+
+        # 404 on an unknown email
+        raise
+
     except Exception as e:
 
         print(f"Error occurred: {e}")
@@ -199,7 +221,7 @@ async def reset_a_password(token: str, new_password: NewPassword):
         }
 
         # Replace the clear password with the hashed one
-        request_data["password"] = get_password_hash(request_data["password"])
+        request_data["password"] = await get_password_hash(request_data["password"])
 
         # Check if the length of the request is greater than 1
         if len(request_data) >= 1:
@@ -219,6 +241,7 @@ async def reset_a_password(token: str, new_password: NewPassword):
             update_result = await db["users"].update_one(
                 {"_id": user["_id"]}, {"$set": request_data}
             )
+            UserServices.invalidate_user(user["_id"])
 
             # Get the currently user updated
             if update_result.modified_count == 1:
@@ -262,6 +285,11 @@ async def reset_a_password(token: str, new_password: NewPassword):
             detail="User with this email not found",
         )
 
+    except HTTPException:
+
+        # 503 + Retry-After when the password hasher is busy
+        raise
+
     except Exception as e:
 
         print(f"Error occurred: {e}")
@@ -291,7 +319,7 @@ async def user_login(user_credentials: OAuth2PasswordRequestForm = Depends()):
         try:
 
             # Validate user credentials and create access token
-            if user and verify_password(
+            if user and await verify_password(
                 user_credentials.password, user["password"]
             ):
 
@@ -320,6 +348,7 @@ async def user_login(user_credentials: OAuth2PasswordRequestForm = Depends()):
                 update_user = await db["users"].update_one(
                     {"_id": user["_id"]}, {"$set": user_info}
                 )
+                UserServices.invalidate_user(user["_id"])
 
                 return JSONResponse(
                     content={
@@ -338,6 +367,9 @@ async def user_login(user_credentials: OAuth2PasswordRequestForm = Depends()):
                     headers={"WWW-Authenticate": "Bearer"},
                 )
 
+        except HTTPException:
+            raise
+
         except Exception as e:
 
             print(f"Error occurred: {e}")
@@ -347,6 +379,11 @@ async def user_login(user_credentials: OAuth2PasswordRequestForm = Depends()):
                 detail=f"Internal server error: {str(e)}",
             )
 
+    except HTTPException:
+
+        # 403 on invalid credentials, 503 + Retry-After when the password hasher is busy
+        raise
+
     except Exception as e:
 
         print(f"Error occurred: {e}")
@@ -360,24 +397,15 @@ async def user_login(user_credentials: OAuth2PasswordRequestForm = Depends()):
 @user_router.get("/refresh_token",
     response_description="Refresh token")
 async def get_new_access_token(
-    token_details: dict = Depends(RefreshTokenBearer()), access_token : str = "Access Token"
+    token_details: dict = Depends(RefreshTokenBearer())
 ):
-    
-    url = f"http://{DOMAIN_NAME}:{PORT}/api/v1/user/me"
 
-    headers = {
-        'accept': 'application/json',
-        'Authorization': f'Bearer {str(access_token)}'
-    }
+    # Same lookup layer (and cache) as the auth dependencies, no HTTP call to ourselves
+    user_info = await UserServices.get_user_by_id(token_details["id"])
 
-    async with httpx.AsyncClient() as client:
-        response = await client.get(url, headers=headers)
+    if user_info is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
 
-    if response.status_code == 200:
-        user_info = response.json()
-    else:
-        raise HTTPException(status_code=response.status_code, detail="Failed to fetch user info")
-    
     if (user_info["is_logged_in"] == True) and (user_info["_id"] == token_details["id"]) and (user_info["email"] == token_details["email"]):
 
         expiry_timestamp = token_details["exp"]
@@ -394,7 +422,7 @@ async def get_new_access_token(
 
             jti = token_details["jti"]
 
-            await add_jti_to_blocklist(jti)
+            await add_jti_to_blocklist(jti, token_details["exp"])
 
             return JSONResponse(
                 content={
@@ -426,7 +454,7 @@ async def revoke_token(token_details: dict = Depends(AccessTokenBearer())):
 
     jti = token_details["jti"]
 
-    await add_jti_to_blocklist(jti)
+    await add_jti_to_blocklist(jti, token_details["exp"])
 
     return JSONResponse(
         status_code=status.HTTP_200_OK, content={"message": "Logged out successfully"}
@@ -437,10 +465,17 @@ async def revoke_token(token_details: dict = Depends(AccessTokenBearer())):
     response_description="Get users",
     response_model=List[UserResponseAdmin],
     dependencies=[Depends(RoleChecker(["admin"]))])
-async def get_all_users(access_token = Depends(AccessTokenBearer()), limit: int = 10, order_by: str = "created_at"):
+async def get_all_users(response: Response, access_token = Depends(AccessTokenBearer()), limit: int = 10, order_by: CreatedOrder = "created_at", cursor: Optional[str] = None):
 
     try:
-        users = await db["users"].find().sort(order_by, -1).to_list(limit)
+        # Trusted, only the fields of the response model are read (no password hash)
+        trusted = trusted_users.trusts("get_all_users")
+        projection = trusted_users.projection if trusted else None
+
+        users, next_cursor = await paginate(db["users"], {}, order_by, limit, cursor, projection)
+
+        if next_cursor:
+            response.headers[NEXT_CURSOR_HEADER] = next_cursor
 
         if not users :
             raise HTTPException(
@@ -448,8 +483,16 @@ async def get_all_users(access_token = Depends(AccessTokenBearer()), limit: int
                 detail = "No users found."
             )
 
+        if trusted:
+            return trusted_users.response(users, response)
+
         return users
 
+    except HTTPException:
+
+        # 400 on an invalid cursor, 404 without any user
+        raise
+
     except Exception as e:
 
         print(f"Error occurred: {e}")
@@ -485,3 +528,11 @@ async def get_one_user(access_token = Depends(AccessTokenBearer()), id : str = "
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Internal server error: {str(e)}",
         )
+
+# Get the user cache counters by admin
+@user_router.get("/cache_stats",
+    response_description="Get user cache statistics",
+    dependencies=[Depends(RoleChecker(["admin"]))])
+async def get_user_cache_stats(access_token = Depends(AccessTokenBearer())):
+
+    return {**user_cache.stats(), "loader": user_loader.stats()}
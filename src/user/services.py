@@ -0,0 +1,53 @@
+from src.config import db, LOOKUP_BATCH_MAX_SIZE, LOOKUP_BATCH_MAX_WAIT_MS
+from src.batch_loader import BatchLoader
+from src.user.cache import user_cache
+from src.single_flight import single_flight
+
+# Users looked up by concurrent requests are read together
+user_loader = BatchLoader(
+    db["users"],
+    max_batch_size=LOOKUP_BATCH_MAX_SIZE,
+    max_wait=LOOKUP_BATCH_MAX_WAIT_MS / 1000,
+)
+
+
+class UserServices:
+
+    # Get one user by ID, without the password
+    async def get_user_by_id(id: str):
+
+        if (user := user_cache.get(id)) is not None:
+
+            return user
+
+        # Concurrent misses on the same user share one query
+        user = await single_flight.do(("user", id), lambda: UserServices.load_user(id))
+
+        if user is None:
+
+            return None
+
+        return dict(user)
+
+    # Read a user from the database into the cache
+    async def load_user(id: str):
+
+        generation = user_cache.generation(id)
+
+        user = await user_loader.load(id)
+
+        if user is None:
+
+            return None
+
+        user = {key: value for key, value in user.items() if key != "password"}
+
+        user_cache.set(id, user, generation)
+
+        return user
+
+    # Drop the cached copy of a user after a write
+    def invalidate_user(id: str) -> None:
+
+        user_cache.invalidate(id)
+        single_flight.forget("user", id)
@@ -1,27 +1,39 @@
-from typing import Annotated
+from typing import Annotated, Optional
 import uuid
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer
 import jwt
 import logging
 from jwt.exceptions import InvalidTokenError
 from datetime import datetime, timedelta, timezone
-from passlib.context import CryptContext
 
-from src.config import ACCESS_TOKEN_EXPIRE_MINUTES, ALGORITHM, db, SECRET_KEY
+from src.config import (
+    ACCESS_TOKEN_EXPIRE_MINUTES,
+    ALGORITHM,
+    PASSWORD_HASH_EXECUTOR,
+    PASSWORD_HASH_MAX_PENDING,
+    PASSWORD_HASH_WORKERS,
+    db,
+    SECRET_KEY,
+)
+from src.user.hashing import PasswordHasher
 from src.user.schemas import TokenData
+from src.user.services import UserServices
+from src.user.redis import token_in_blocklist
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+password_hasher = PasswordHasher(
+    PASSWORD_HASH_EXECUTOR, PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_PENDING
+)
 
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+async def verify_password(plain_password, hashed_password):
+    return await password_hasher.verify(plain_password, hashed_password)
 
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+async def get_password_hash(password):
+    return await password_hasher.hash(password)
 
 
 def create_access_token(payload: dict, timestamp: int = None, refresh: bool = False):
@@ -64,26 +76,83 @@ def verify_access_token(token: str, credentials_exception):
         raise credentials_exception
 
 
-async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]):
+class AuthContext:
+    """Request scoped view of the bearer token.
+
+    The token is decoded, checked against the blocklist and resolved to a user
+    at most once per request, whatever the number of dependencies asking for it.
+    """
+
+    def __init__(self, token: str) -> None:
+
+        self.token = token
+        self._decoded = False
+        self._token_data = None
+        self._revoked = None
+        self._user_loaded = False
+        self._user = None
+
+    @classmethod
+    def from_request(cls, request: Optional[Request], token: str) -> "AuthContext":
+
+        # Without a request (direct calls) there is nothing to share the context with
+        if request is None:
+            return cls(token)
+
+        context = getattr(request.state, "auth_context", None)
+
+        if context is None or context.token != token:
+            context = cls(token)
+            request.state.auth_context = context
+
+        return context
+
+    def token_data(self) -> Optional[dict]:
+
+        if not self._decoded:
+            self._token_data = decode_token(self.token)
+            self._decoded = True
+
+        return self._token_data
+
+    async def is_revoked(self) -> bool:
+
+        if self._revoked is None:
+            self._revoked = await token_in_blocklist(self.token_data()["jti"])
+
+        return self._revoked
+
+    async def user(self) -> Optional[dict]:
+
+        if not self._user_loaded:
+            self._user = await UserServices.get_user_by_id(self.token_data()["id"])
+            self._user_loaded = True
+
+        return self._user
+
+
+async def get_current_user(
+    token: Annotated[str, Depends(oauth2_scheme)], request: Request = None
+):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate token, or token expired",
         headers={"WWW-Authenticate": "Bearer"},
     )
 
-    # Get current user ID
-    current_user_id = verify_access_token(token, credentials_exception).id
+    context = AuthContext.from_request(request, token)
 
-    # Get current user
-    current_user = await db["users"].find_one({"_id": current_user_id})
+    token_data = context.token_data()
 
-    # Delete password and it item before return current user
-    # current_user.pop("password")
+    if not token_data or not token_data.get("id") or not token_data.get("email"):
+        raise credentials_exception
 
-    current_user = {key: value for key, value in current_user.items() if key != "password"}
+    # Get current user, the password is already removed
+    current_user = await context.user()
+
+    if current_user is None:
+        raise credentials_exception
 
-    # Return only the _id item not all user informations
-    # return current_user.pop("_id")
     return current_user
 
 
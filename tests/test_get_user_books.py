@@ -0,0 +1,34 @@
+import asyncio
+
+import pytest
+from fastapi.exceptions import HTTPException
+
+from src.dynamic_books import services
+from src.dynamic_books.services import BookServices
+from src.pagination import encode_cursor
+
+
+@pytest.fixture(autouse=True)
+def no_query_cache(monkeypatch):
+
+    # Straight to the loader, without Redis
+    async def get_or_load(endpoint, params, tags, loader):
+        return await loader()
+
+    monkeypatch.setattr(services.query_cache, "get_or_load", get_or_load)
+
+
+@pytest.mark.parametrize(
+    "cursor",
+    [
+        "garbage",
+        encode_cursor({"_id": "book", "created_at": "2024-01-01"}, "deleted_at"),
+        encode_cursor({"_id": "book", "created_at": {"$gt": ""}}, "created_at"),
+    ],
+)
+def test_malformed_cursor_is_a_bad_request(cursor):
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(BookServices.get_user_books("user", 10, "created_at", cursor))
+
+    assert error.value.status_code == 400